@@ -8,39 +8,18 @@ di conferme ricevute dagli altri utenti.
 
 from __future__ import annotations
 
-import json
 from datetime import datetime, timezone
-from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-from .config import get_base_dir
-
-
-def _get_avalanches_path() -> Path:
-    """Restituisce il percorso del file delle valanghe."""
-    base_dir = get_base_dir()
-    return base_dir / "avalanches.json"
+from . import blobs, spatial, storage
 
 
 def _load_raw() -> List[Dict[str, Any]]:
-    path = _get_avalanches_path()
-    if not path.exists():
-        return []
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        if isinstance(data, list):
-            return data
-        return []
-    except Exception:
-        return []
+    return storage.load("avalanches")
 
 
-def _save_raw(data: List[Dict[str, Any]]) -> None:
-    path = _get_avalanches_path()
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+def _save_record(record: Dict[str, Any]) -> None:
+    spatial.put("avalanches", record)
 
 
 def _parse_iso_timestamp(value: Optional[str]) -> Optional[datetime]:
@@ -58,15 +37,23 @@ def _parse_iso_timestamp(value: Optional[str]) -> Optional[datetime]:
     return parsed.astimezone(timezone.utc)
 
 
-def load_avalanches() -> List[Dict[str, Any]]:
+def load_avalanches(bbox: Optional[spatial.BBox] = None) -> List[Dict[str, Any]]:
     """Carica tutte le segnalazioni di valanghe dal file.
 
+    Parameters
+    ----------
+    bbox: tuple, optional
+        Rettangolo ``(min_lon, min_lat, max_lon, max_lat)``: se indicato
+        vengono restituite solo le segnalazioni al suo interno.
+
     Returns
     -------
     list
         Una lista di segnalazioni.
     """
-    return _load_raw()
+    if bbox is not None:
+        return storage.get_many("avalanches", spatial.query("avalanches", bbox))
+    return list(_load_raw())
 
 
 def add_avalanche(
@@ -103,26 +90,27 @@ def add_avalanche(
     dict
         La segnalazione appena creata.
     """
-    data = _load_raw()
-    next_id = 1 + max((item.get("id", 0) for item in data), default=0)
-    now_iso = datetime.now(timezone.utc).isoformat()
-    record = {
-        "id": next_id,
-        "lat": lat,
-        "lon": lon,
-        "timestamp": now_iso,
-        "confirmations": 1,
-        "confirmation_user_ids": [created_by] if created_by else [],
-        "created_by": created_by,
-        "description": description,
-        "size": size,
-        "danger": danger,
-        "slope": slope,
-        "image": image,
-    }
-    data.append(record)
-    _save_raw(data)
-    return record
+    with storage.transaction():
+        data = _load_raw()
+        next_id = 1 + max((item.get("id", 0) for item in data), default=0)
+        now_iso = datetime.now(timezone.utc).isoformat()
+        record = {
+            "id": next_id,
+            "lat": lat,
+            "lon": lon,
+            "timestamp": now_iso,
+            "confirmations": 1,
+            "confirmation_user_ids": [created_by] if created_by else [],
+            "created_by": created_by,
+            "description": description,
+            "size": size,
+            "danger": danger,
+            "slope": slope,
+            "image": image,
+        }
+        blobs.acquire("avalanche_images", image)
+        _save_record(record)
+        return record
 
 
 def confirm_avalanche(avalanche_id: int, user_id: str) -> Optional[Dict[str, Any]]:
@@ -138,25 +126,30 @@ def confirm_avalanche(avalanche_id: int, user_id: str) -> Optional[Dict[str, Any
     dict or None
         La segnalazione aggiornata, oppure ``None`` se non è stata trovata.
     """
-    data = _load_raw()
-    for item in data:
-        if item.get("id") == avalanche_id:
-            confirmation_users = item.get("confirmation_user_ids") or []
-            if user_id in confirmation_users:
-                item_copy = dict(item)
-                item_copy["already_confirmed"] = True
-                return item_copy
-            confirmation_users.append(user_id)
-            item["confirmation_user_ids"] = confirmation_users
-            item["confirmations"] = int(item.get("confirmations", 0)) + 1
-            _save_raw(data)
+    with storage.transaction():
+        item = storage.get("avalanches", avalanche_id)
+        if item is None:
+            return None
+        confirmation_users = list(item.get("confirmation_user_ids") or [])
+        if user_id in confirmation_users:
             item_copy = dict(item)
-            item_copy["already_confirmed"] = False
+            item_copy["already_confirmed"] = True
             return item_copy
-    return None
-
-
-def filter_avalanches(start_iso: Optional[str] = None, end_iso: Optional[str] = None) -> List[Dict[str, Any]]:
+        confirmation_users.append(user_id)
+        item = dict(item)
+        item["confirmation_user_ids"] = confirmation_users
+        item["confirmations"] = int(item.get("confirmations", 0)) + 1
+        _save_record(item)
+        item_copy = dict(item)
+        item_copy["already_confirmed"] = False
+        return item_copy
+
+
+def filter_avalanches(
+    start_iso: Optional[str] = None,
+    end_iso: Optional[str] = None,
+    bbox: Optional[spatial.BBox] = None,
+) -> List[Dict[str, Any]]:
     """Filtra le segnalazioni restituendo quelle comprese nell'intervallo temporale.
 
     Parameters
@@ -165,13 +158,15 @@ def filter_avalanches(start_iso: Optional[str] = None, end_iso: Optional[str] =
         Limite inferiore (incluso) come ISO 8601 (UTC). Se ``None`` nessun limite inferiore.
     end_iso: str, optional
         Limite superiore (incluso) come ISO 8601 (UTC). Se ``None`` nessun limite superiore.
+    bbox: tuple, optional
+        Rettangolo ``(min_lon, min_lat, max_lon, max_lat)`` come in :func:`load_avalanches`.
 
     Returns
     -------
     list
         Una lista di segnalazioni nell'intervallo specificato, ordinate per data decrescente.
     """
-    data = _load_raw()
+    data = load_avalanches(bbox)
     start_dt = _parse_iso_timestamp(start_iso)
     end_dt = _parse_iso_timestamp(end_iso)
     sortable: List[tuple[datetime, Dict[str, Any]]] = []
@@ -186,3 +181,50 @@ def filter_avalanches(start_iso: Optional[str] = None, end_iso: Optional[str] =
         sortable.append((ts_dt, item))
     sortable.sort(key=lambda pair: pair[0], reverse=True)
     return [item for _, item in sortable]
+
+
+def page_avalanches(
+    limit: int,
+    after: Optional[Tuple[str, int]] = None,
+    start_iso: Optional[str] = None,
+    end_iso: Optional[str] = None,
+    bbox: Optional[spatial.BBox] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[Tuple[str, int]]]:
+    """Restituisce una pagina di segnalazioni dalla più recente.
+
+    Parameters
+    ----------
+    limit: int
+        Numero massimo di segnalazioni nella pagina.
+    after: tuple, optional
+        Chiave restituita dalla pagina precedente; ``None`` per la prima.
+    start_iso, end_iso: str, optional
+        Intervallo temporale come in :func:`filter_avalanches`.
+    bbox: tuple, optional
+        Rettangolo come in :func:`load_avalanches`.
+
+    Returns
+    -------
+    tuple
+        Le segnalazioni della pagina e la chiave per la pagina successiva,
+        ``None`` se non ce ne sono altre.
+    """
+    start_dt = _parse_iso_timestamp(start_iso)
+    end_dt = _parse_iso_timestamp(end_iso)
+    inside = spatial.query("avalanches", bbox) if bbox is not None else None
+
+    def accept(item: Dict[str, Any]) -> bool:
+        if inside is not None and item.get("id") not in inside:
+            return False
+        if not start_dt and not end_dt:
+            return True
+        ts_dt = _parse_iso_timestamp(item.get("timestamp"))
+        if not ts_dt:
+            return False
+        if start_dt and ts_dt < start_dt:
+            return False
+        if end_dt and ts_dt > end_dt:
+            return False
+        return True
+
+    return storage.page("avalanches", "timestamp", limit, after, accept)
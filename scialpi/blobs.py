@@ -0,0 +1,251 @@
+"""Archivio per contenuto delle immagini caricate.
+
+Ogni immagine è salvata una sola volta nella sua cartella dei dati
+(``day_photos``, ``user_photos``, ``avalanche_images``) con il nome
+``<sha256>.<estensione>``: :func:`store` calcola l'hash mentre scrive il
+file e, se lo stesso contenuto esiste già, scarta la copia appena
+ricevuta. I record delle foto, degli utenti e delle valanghe salvano
+questo nome.
+
+La collezione ``blobs`` conta i riferimenti a ogni file: i manager
+chiamano :func:`acquire` quando un record inizia a usarlo e
+:func:`release` quando smette. :func:`collect` elimina i file senza
+riferimenti (con le loro varianti di :mod:`scialpi.images`) dopo
+:data:`BLOB_GRACE`, il margine che copre il tempo tra il caricamento e
+l'accodamento del lavoro che lo elabora. Finché quel lavoro è in attesa o
+in esecuzione il file conta come usato, anche se il worker è fermo o la
+coda è lunga: il riferimento vero lo prende il record creato dal lavoro.
+I file caricati prima dell'archivio per contenuto mantengono il loro nome
+e non vengono mai eliminati.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, Optional, Tuple
+
+from . import storage
+from .config import get_base_dir
+from .images import IMAGE_FOLDERS, VARIANT_SIZES, variant_path
+from .jobs import PENDING, RUNNING
+
+# Tempo minimo prima di eliminare un file senza riferimenti
+BLOB_GRACE = timedelta(hours=1)
+CHUNK_SIZE = 1 << 16
+_NAME_RE = re.compile(r"^[0-9a-f]{64}(\.[a-z0-9]{1,8})?$")
+_SUFFIX_RE = re.compile(r"^\.[a-z0-9]{1,8}$")
+_TMP_PREFIX = ".upload-"
+_EPOCH = datetime(1970, 1, 1)
+# Cartella dei file dei lavori il cui payload non la indica
+JOB_FOLDERS = {"day_photo": "day_photos"}
+
+
+def _now() -> datetime:
+    return datetime.utcnow()
+
+
+def _iso(value: datetime) -> str:
+    return value.isoformat() + "Z"
+
+
+def init_blobs() -> None:
+    storage.ensure_collection("blobs")
+
+
+def is_blob_name(name: Optional[str]) -> bool:
+    """``True`` se ``name`` è il nome di un file dell'archivio per contenuto."""
+    return bool(name) and _NAME_RE.match(name) is not None
+
+
+def _blob_id(folder: str, name: str) -> str:
+    return f"{folder}/{name}"
+
+
+def _suffix(filename: Optional[str]) -> str:
+    suffix = Path(filename or "").suffix.lower()
+    if suffix == ".jpeg":
+        suffix = ".jpg"
+    return suffix if _SUFFIX_RE.match(suffix) else ""
+
+
+def store(stream: BinaryIO, folder: str, filename: Optional[str] = None) -> str:
+    """Salva il contenuto di ``stream`` in ``folder`` e restituisce il nome del file.
+
+    Il nome è l'hash SHA-256 del contenuto con l'estensione di
+    ``filename``; un contenuto già presente non occupa altro spazio. Il
+    file nasce senza riferimenti: entro :data:`BLOB_GRACE` il record che
+    lo usa deve chiamare :func:`acquire`, oppure va accodato il lavoro che
+    lo elabora (vedi :func:`collect`).
+    """
+    directory = get_base_dir() / folder
+    directory.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=_TMP_PREFIX)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        name = digest.hexdigest() + _suffix(filename)
+        target = directory / name
+        with storage.transaction():
+            record = storage.get("blobs", _blob_id(folder, name))
+            if record is None or not target.exists():
+                # mkstemp crea il file con permessi 0600: il proxy che invia
+                # le immagini (X-Sendfile, X-Accel-Redirect) deve poterlo leggere.
+                os.chmod(tmp, 0o644)
+                os.replace(tmp, target)
+            now = _iso(_now())
+            record = dict(record or {"id": _blob_id(folder, name), "refs": 0, "created_at": now})
+            record["size"] = size
+            record["touched_at"] = now
+            storage.put("blobs", record)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+    return name
+
+
+def _add_ref(folder: str, name: Optional[str], delta: int) -> None:
+    if not is_blob_name(name):
+        return
+    with storage.transaction():
+        record = storage.get("blobs", _blob_id(folder, name))
+        if record is None:
+            return
+        record = dict(record)
+        record["refs"] = max((record.get("refs") or 0) + delta, 0)
+        record["touched_at"] = _iso(_now())
+        storage.put("blobs", record)
+
+
+def acquire(folder: str, name: Optional[str]) -> None:
+    """Registra un nuovo riferimento al file ``name`` di ``folder``."""
+    _add_ref(folder, name, 1)
+
+
+def release(folder: str, name: Optional[str]) -> None:
+    """Rimuove un riferimento al file ``name`` di ``folder``."""
+    _add_ref(folder, name, -1)
+
+
+def _parse_iso(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.rstrip("Z"))
+    except ValueError:
+        return None
+
+
+def _remove(folder: str, name: str) -> int:
+    freed = 0
+    paths = [get_base_dir() / folder / name]
+    paths.extend(variant_path(folder, name, size) for size in VARIANT_SIZES)
+    for path in paths:
+        try:
+            freed += path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            pass
+    return freed
+
+
+def _references() -> Iterable[Tuple[str, Optional[str]]]:
+    for photo in storage.load("day_photos"):
+        yield "day_photos", photo.get("filename")
+    for user in storage.load("users"):
+        yield "user_photos", user.get("photo_filename")
+    for avalanche in storage.load("avalanches"):
+        yield "avalanche_images", avalanche.get("image")
+
+
+def _job_references() -> Iterable[str]:
+    """Blob dei lavori in attesa o in esecuzione, che li useranno più tardi."""
+    for status in (PENDING, RUNNING):
+        for job in storage.find("jobs", "status", status):
+            payload = job.get("payload") or {}
+            folder = payload.get("folder") or JOB_FOLDERS.get(job.get("kind"))
+            name = payload.get("filename")
+            if folder and is_blob_name(name):
+                yield _blob_id(folder, name)
+
+
+def recount() -> int:
+    """Ricalcola i riferimenti dai record; restituisce quanti contatori sono cambiati."""
+    counts: Dict[str, int] = {}
+    changed = 0
+    with storage.transaction():
+        for folder, name in _references():
+            if is_blob_name(name):
+                key = _blob_id(folder, name)
+                counts[key] = counts.get(key, 0) + 1
+        for record in list(storage.load("blobs")):
+            refs = counts.get(record["id"], 0)
+            if record.get("refs") != refs:
+                record = dict(record)
+                record["refs"] = refs
+                record["touched_at"] = _iso(_now())
+                storage.put("blobs", record)
+                changed += 1
+    return changed
+
+
+def collect(now: Optional[datetime] = None, grace: timedelta = BLOB_GRACE) -> Dict[str, Any]:
+    """Elimina i file senza riferimenti da più di ``grace``.
+
+    Oltre ai file con zero riferimenti elimina i file dell'archivio senza
+    record e i file temporanei di caricamenti interrotti, se più vecchi
+    di ``grace``. I file dei lavori in attesa o in esecuzione non vengono
+    mai eliminati.
+
+    Returns
+    -------
+    dict
+        ``files`` eliminati e ``bytes`` liberati, varianti comprese.
+    """
+    cutoff = (now or _now()) - grace
+    files = 0
+    freed = 0
+    with storage.transaction():
+        queued = set(_job_references())
+        known = set()
+        for record in list(storage.load("blobs")):
+            known.add(record["id"])
+            touched = _parse_iso(record.get("touched_at"))
+            if (record.get("refs") or 0) > 0 or (touched is not None and touched > cutoff):
+                continue
+            if record["id"] in queued:
+                continue
+            folder, name = record["id"].split("/", 1)
+            freed += _remove(folder, name)
+            storage.delete("blobs", record["id"])
+            files += 1
+        deadline = (cutoff - _EPOCH).total_seconds()
+        for folder in IMAGE_FOLDERS:
+            directory = get_base_dir() / folder
+            if not directory.is_dir():
+                continue
+            for path in directory.iterdir():
+                blob_id = _blob_id(folder, path.name)
+                orphan = is_blob_name(path.name) and blob_id not in known and blob_id not in queued
+                if not (orphan or path.name.startswith(_TMP_PREFIX)):
+                    continue
+                try:
+                    if path.stat().st_mtime > deadline:
+                        continue
+                except FileNotFoundError:
+                    continue
+                freed += _remove(folder, path.name)
+                files += 1
+    return {"files": files, "bytes": freed}
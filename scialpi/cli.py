@@ -8,8 +8,14 @@ aggiungere gite, elencarle e visualizzarne i dettagli.
 from __future__ import annotations
 
 import json
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
 import click
 
+from .config import SQLITE_FILENAME, STORAGE_ENV, get_base_dir
 from .trip_manager import init_data, add_trip, list_trips, read_trip
 
 
@@ -49,9 +55,16 @@ def add(**kwargs) -> None:
 
 
 @cli.command(name="list")
-def _list() -> None:
-    """Elenca tutte le gite registrate."""
-    trips = list_trips()
+@click.option("--start", type=click.DateTime(["%Y-%m-%d"]), help="Solo le gite da questa data (YYYY-MM-DD)")
+@click.option("--end", type=click.DateTime(["%Y-%m-%d"]), help="Solo le gite fino a questa data (YYYY-MM-DD)")
+@click.option("--limit", type=click.IntRange(min=1), help="Numero massimo di gite")
+def _list(start: Optional[datetime], end: Optional[datetime], limit: Optional[int]) -> None:
+    """Elenca le gite registrate, dalla più recente."""
+    trips = list_trips(
+        start=start.date() if start else None,
+        end=end.date() if end else None,
+        limit=limit,
+    )
     if not trips:
         click.echo("Nessuna gita registrata.")
         return
@@ -99,6 +112,111 @@ def show(slug: str, as_json: bool) -> None:
             click.echo("\nNote:\n" + trip["notes"])
 
 
+@cli.command(name="migrate-sqlite")
+def migrate_sqlite() -> None:
+    """Importa i file JSON esistenti nel database SQLite."""
+    from .sqlite_backend import import_json
+
+    base = get_base_dir()
+    database = base / SQLITE_FILENAME
+    counts = import_json(base, database)
+    for name, count in counts.items():
+        click.echo(f"{name}: {count} record")
+    click.echo(f"Database creato in: {database}")
+    click.echo(f"Imposta {STORAGE_ENV}=sqlite per usarlo.")
+
+
+@cli.command()
+@click.option("--threads", type=int, default=1, show_default=True, help="Lavori eseguiti in parallelo")
+@click.option("--once", is_flag=True, help="Esegue i lavori in attesa ed esce")
+def worker(threads: int, once: bool) -> None:
+    """Esegue i lavori in background accodati dal sito (tracce, attività, foto).
+
+    Da usare con ``SCIALPI_JOB_WORKERS=0`` nel server web; più processi
+    worker possono lavorare sulla stessa coda.
+    """
+    from .day_media import init_media_data
+    from . import extras, metrics
+    from .jobs import init_jobs, run_pending, work
+
+    extras.log_missing()
+    init_data()
+    init_media_data()
+    init_jobs()
+    if once:
+        count = run_pending()
+        metrics.flush(force=True)
+        click.echo(f"Lavori eseguiti: {count}")
+        return
+    stop = threading.Event()
+    workers = [threading.Thread(target=work, args=(stop,), daemon=True) for _ in range(max(threads, 1))]
+    for thread in workers:
+        thread.start()
+    click.echo(f"Worker avviato con {len(workers)} thread, Ctrl+C per terminare.")
+    try:
+        while any(thread.is_alive() for thread in workers):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stop.set()
+        for thread in workers:
+            thread.join()
+        metrics.flush(force=True)
+
+
+@cli.command()
+@click.option("--recount", is_flag=True, help="Ricalcola prima i riferimenti dai record")
+@click.option("--grace-hours", type=float, default=1.0, show_default=True, help="Età minima dei file da eliminare")
+def gc(recount: bool, grace_hours: float) -> None:
+    """Elimina le immagini caricate che nessun record usa più."""
+    from datetime import timedelta
+
+    from .blobs import collect, init_blobs
+    from .blobs import recount as recount_refs
+
+    init_blobs()
+    if recount:
+        click.echo(f"Contatori corretti: {recount_refs()}")
+    result = collect(grace=timedelta(hours=grace_hours))
+    click.echo(f"File eliminati: {result['files']} ({result['bytes']} byte)")
+
+
+@cli.command()
+@click.argument("name", required=False)
+@click.option("--limit", type=click.IntRange(min=1), default=20, show_default=True, help="Profili elencati o funzioni mostrate")
+@click.option(
+    "--sort",
+    type=click.Choice(["cumulative", "tottime", "calls"]),
+    default="cumulative",
+    show_default=True,
+    help="Ordinamento delle funzioni nel riepilogo",
+)
+def profiles(name: Optional[str], limit: int, sort: str) -> None:
+    """Elenca i profili delle richieste web o riassume il profilo NAME."""
+    import io
+
+    from .profiling import folded_path, list_profiles, load_stats
+
+    if name is None:
+        items = list_profiles(limit)
+        if not items:
+            click.echo("Nessun profilo salvato.")
+        for info in items:
+            duration_ms = (info.get("duration_seconds") or 0) * 1000
+            click.echo(
+                f"{info.get('name')}  {info.get('status')}  {duration_ms:8.1f} ms  "
+                f"{info.get('method')} {info.get('path')}  [{info.get('user_id')}]"
+            )
+        return
+    stats = load_stats(name)
+    if stats is None:
+        raise click.ClickException(f"Profilo {name} non trovato")
+    click.echo(f"Flamegraph: {folded_path(name)}")
+    out = io.StringIO()
+    stats.stream = out
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    click.echo(out.getvalue().rstrip())
+
+
 # Permette di eseguire il comando anche con ``python -m scialpi.cli``
 if __name__ == "__main__":  # pragma: no cover
     cli()
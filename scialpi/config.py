@@ -5,17 +5,75 @@ delle gite e delle valanghe. Se l'utente definisce la variabile di
 ambiente ``SCIALPI_LOG_HOME`` i dati verranno salvati lì; altrimenti
 verranno utilizzate le sottodirectory della cartella ``data/`` nella
 repository.
+
+La variabile ``SCIALPI_LOG_STORAGE`` sceglie il formato di salvataggio:
+``json`` (predefinito, un file per collezione) oppure ``sqlite`` (un unico
+database ``scialpi.sqlite3`` nella stessa directory).
+
+Le quote mancanti delle tracce caricate vengono cercate dai fornitori
+elencati in ``SCIALPI_ELEVATION_PROVIDERS`` (predefinito ``dem,http``):
+``dem`` legge i tile SRTM ``.hgt`` dalla directory ``SCIALPI_DEM_DIR``
+(predefinita ``dem/`` dentro la directory dei dati), ``http`` interroga il
+servizio Open-Elevation all'indirizzo ``SCIALPI_ELEVATION_URL``. Le quote ottenute dai fornitori remoti
+finiscono in una cache su disco limitata a ``SCIALPI_ELEVATION_CACHE_SIZE``
+celle (``0`` la disattiva).
+
+I caricamenti vengono elaborati in background da
+``SCIALPI_JOB_WORKERS`` thread del server web (predefinito 2); con ``0``
+serve un processo ``scialpi worker`` separato (vedi :mod:`scialpi.jobs`).
+
+Le immagini caricate possono essere inviate dal proxy davanti al server
+web: ``SCIALPI_MEDIA_OFFLOAD=x-sendfile`` (Apache, lighttpd) oppure
+``x-accel-redirect`` (nginx, con la directory dei dati esposta come
+location interna ``SCIALPI_MEDIA_ACCEL_PREFIX``, predefinita ``/_media/``).
 """
 
 from __future__ import annotations
 
 import os
 from pathlib import Path
+from typing import List, Optional
 
 # Nome della variabile d'ambiente che definisce la directory dei dati
 DATA_ENV = "SCIALPI_LOG_HOME"
+# Nome della variabile d'ambiente che sceglie il backend di salvataggio
+STORAGE_ENV = "SCIALPI_LOG_STORAGE"
 # Default directory rispetto alla quale saranno salvati i file
 DEFAULT_BASE = Path(__file__).resolve().parent.parent / "data"
+# Backend disponibili e backend predefinito
+STORAGE_BACKENDS = ("json", "sqlite")
+DEFAULT_STORAGE = "json"
+# Nome del file del database quando si usa il backend SQLite
+SQLITE_FILENAME = "scialpi.sqlite3"
+# Variabili d'ambiente per i fornitori di quote
+DEM_ENV = "SCIALPI_DEM_DIR"
+ELEVATION_ENV = "SCIALPI_ELEVATION_PROVIDERS"
+# Fornitori di quote disponibili, nell'ordine predefinito di consultazione
+ELEVATION_PROVIDERS = ("dem", "http")
+# Variabile d'ambiente e indirizzo predefinito del servizio di quote remoto
+ELEVATION_URL_ENV = "SCIALPI_ELEVATION_URL"
+DEFAULT_ELEVATION_URL = "https://api.open-elevation.com/api/v1/lookup"
+# Variabile d'ambiente, valore predefinito e file della cache delle quote
+ELEVATION_CACHE_ENV = "SCIALPI_ELEVATION_CACHE_SIZE"
+DEFAULT_ELEVATION_CACHE_SIZE = 1_000_000
+ELEVATION_CACHE_FILENAME = "elevation_cache.sqlite3"
+# Variabile d'ambiente e valore predefinito dei worker interni al server web
+JOB_WORKERS_ENV = "SCIALPI_JOB_WORKERS"
+DEFAULT_JOB_WORKERS = 2
+# Variabili d'ambiente per l'invio delle immagini tramite il proxy
+MEDIA_OFFLOAD_ENV = "SCIALPI_MEDIA_OFFLOAD"
+MEDIA_OFFLOAD_MODES = ("x-sendfile", "x-accel-redirect")
+MEDIA_ACCEL_PREFIX_ENV = "SCIALPI_MEDIA_ACCEL_PREFIX"
+DEFAULT_MEDIA_ACCEL_PREFIX = "/_media/"
+# Variabile d'ambiente e valore predefinito del limite di accessi per
+# collezione in una richiesta web; variabile dell'header di debug
+STORAGE_BUDGET_ENV = "SCIALPI_STORAGE_BUDGET"
+DEFAULT_STORAGE_BUDGET = 100
+STORAGE_DEBUG_ENV = "SCIALPI_STORAGE_DEBUG"
+# Utenti abilitati alla profilazione delle richieste e profili da conservare
+PROFILE_USERS_ENV = "SCIALPI_PROFILE_USERS"
+PROFILE_KEEP_ENV = "SCIALPI_PROFILE_KEEP"
+DEFAULT_PROFILE_KEEP = 50
 
 
 def get_base_dir() -> Path:
@@ -34,3 +92,197 @@ def get_base_dir() -> Path:
     if env_value:
         return Path(env_value)
     return DEFAULT_BASE
+
+
+def get_storage_backend() -> str:
+    """Restituisce il nome del backend di salvataggio configurato.
+
+    Valori non riconosciuti della variabile ``SCIALPI_LOG_STORAGE`` fanno
+    ricadere sul backend JSON.
+
+    Returns
+    -------
+    str
+        ``"json"`` oppure ``"sqlite"``.
+    """
+    env_value = (os.environ.get(STORAGE_ENV) or "").strip().lower()
+    if env_value in STORAGE_BACKENDS:
+        return env_value
+    return DEFAULT_STORAGE
+
+
+def get_dem_dir() -> Path:
+    """Restituisce la directory dei tile altimetrici ``.hgt``.
+
+    Returns
+    -------
+    pathlib.Path
+        Il valore di ``SCIALPI_DEM_DIR`` se impostato, altrimenti la
+        sottodirectory ``dem`` della directory dei dati.
+    """
+    env_value = os.environ.get(DEM_ENV)
+    if env_value:
+        return Path(env_value)
+    return get_base_dir() / "dem"
+
+
+def get_elevation_providers() -> List[str]:
+    """Restituisce i fornitori di quote da consultare, in ordine.
+
+    ``SCIALPI_ELEVATION_PROVIDERS`` è un elenco separato da virgole; i nomi
+    non riconosciuti vengono ignorati. Un valore vuoto disattiva la ricerca
+    delle quote.
+
+    Returns
+    -------
+    list of str
+        Nomi presi da ``("dem", "http")``.
+    """
+    env_value = os.environ.get(ELEVATION_ENV)
+    if env_value is None:
+        return list(ELEVATION_PROVIDERS)
+    names = [part.strip().lower() for part in env_value.split(",")]
+    return [name for name in dict.fromkeys(names) if name in ELEVATION_PROVIDERS]
+
+
+def get_elevation_url() -> str:
+    """Restituisce l'indirizzo dell'API di lookup del servizio di quote remoto.
+
+    Returns
+    -------
+    str
+        Il valore di ``SCIALPI_ELEVATION_URL`` se impostato, altrimenti
+        l'API pubblica di Open-Elevation.
+    """
+    return os.environ.get(ELEVATION_URL_ENV) or DEFAULT_ELEVATION_URL
+
+
+def get_elevation_cache_size() -> int:
+    """Restituisce il numero massimo di celle nella cache delle quote.
+
+    Valori non numerici o negativi della variabile
+    ``SCIALPI_ELEVATION_CACHE_SIZE`` fanno ricadere sul valore predefinito.
+
+    Returns
+    -------
+    int
+        Il limite configurato; ``0`` se la cache è disattivata.
+    """
+    env_value = (os.environ.get(ELEVATION_CACHE_ENV) or "").strip()
+    try:
+        size = int(env_value)
+    except ValueError:
+        return DEFAULT_ELEVATION_CACHE_SIZE
+    return size if size >= 0 else DEFAULT_ELEVATION_CACHE_SIZE
+
+
+def get_job_workers() -> int:
+    """Restituisce il numero di thread worker da avviare nel server web.
+
+    Valori non numerici o negativi di ``SCIALPI_JOB_WORKERS`` fanno
+    ricadere sul valore predefinito.
+
+    Returns
+    -------
+    int
+        Il numero configurato; ``0`` se i lavori sono eseguiti da un
+        processo ``scialpi worker`` separato.
+    """
+    env_value = (os.environ.get(JOB_WORKERS_ENV) or "").strip()
+    try:
+        workers = int(env_value)
+    except ValueError:
+        return DEFAULT_JOB_WORKERS
+    return workers if workers >= 0 else DEFAULT_JOB_WORKERS
+
+
+def get_media_offload() -> Optional[str]:
+    """Restituisce il modo in cui il proxy invia le immagini caricate.
+
+    Returns
+    -------
+    str or None
+        ``"x-sendfile"`` o ``"x-accel-redirect"`` secondo
+        ``SCIALPI_MEDIA_OFFLOAD``; ``None`` (valore predefinito o non
+        riconosciuto) se i file li invia Flask.
+    """
+    env_value = (os.environ.get(MEDIA_OFFLOAD_ENV) or "").strip().lower()
+    return env_value if env_value in MEDIA_OFFLOAD_MODES else None
+
+
+def get_media_accel_prefix() -> str:
+    """Restituisce la location interna di nginx che corrisponde alla directory dei dati.
+
+    Returns
+    -------
+    str
+        Il valore di ``SCIALPI_MEDIA_ACCEL_PREFIX``, terminato da ``/``.
+    """
+    prefix = (os.environ.get(MEDIA_ACCEL_PREFIX_ENV) or "").strip() or DEFAULT_MEDIA_ACCEL_PREFIX
+    return prefix if prefix.endswith("/") else prefix + "/"
+
+
+def get_storage_budget() -> int:
+    """Restituisce il numero massimo di accessi a una collezione in una richiesta.
+
+    Oltre questo limite il server web registra un avviso con lo stack del
+    chiamante (vedi :func:`scialpi.storage.track_accesses`). Valori non
+    numerici o negativi di ``SCIALPI_STORAGE_BUDGET`` fanno ricadere sul
+    valore predefinito.
+
+    Returns
+    -------
+    int
+        Il limite configurato; ``0`` disattiva il controllo.
+    """
+    env_value = (os.environ.get(STORAGE_BUDGET_ENV) or "").strip()
+    try:
+        budget = int(env_value)
+    except ValueError:
+        return DEFAULT_STORAGE_BUDGET
+    return budget if budget >= 0 else DEFAULT_STORAGE_BUDGET
+
+
+def get_storage_debug() -> bool:
+    """Indica se le risposte devono riportare gli accessi alle collezioni.
+
+    Returns
+    -------
+    bool
+        ``True`` se ``SCIALPI_STORAGE_DEBUG`` vale ``1``, ``true``, ``yes``
+        o ``on``.
+    """
+    return (os.environ.get(STORAGE_DEBUG_ENV) or "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def get_profile_users() -> List[str]:
+    """Restituisce gli utenti che possono chiedere il profilo di una richiesta.
+
+    Returns
+    -------
+    list of str
+        Id o email, in minuscolo, separati da virgole in
+        ``SCIALPI_PROFILE_USERS``; lista vuota (valore predefinito) se la
+        profilazione è disattivata.
+    """
+    env_value = os.environ.get(PROFILE_USERS_ENV) or ""
+    return [item.strip().lower() for item in env_value.split(",") if item.strip()]
+
+
+def get_profile_keep() -> int:
+    """Restituisce quanti profili delle richieste conservare.
+
+    Valori non numerici o minori di 1 di ``SCIALPI_PROFILE_KEEP`` fanno
+    ricadere sul valore predefinito.
+
+    Returns
+    -------
+    int
+        Il numero di profili più recenti da mantenere.
+    """
+    env_value = (os.environ.get(PROFILE_KEEP_ENV) or "").strip()
+    try:
+        keep = int(env_value)
+    except ValueError:
+        return DEFAULT_PROFILE_KEEP
+    return keep if keep >= 1 else DEFAULT_PROFILE_KEEP
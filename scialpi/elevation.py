@@ -0,0 +1,463 @@
+"""Quote altimetriche per i punti delle tracce.
+
+Le quote mancanti vengono chieste, nell'ordine, ai fornitori configurati
+con ``SCIALPI_ELEVATION_PROVIDERS`` (vedi :mod:`scialpi.config`); ogni
+fornitore riceve solo i punti rimasti senza quota dopo i precedenti.
+
+* :class:`DemProvider` legge i tile SRTM ``.hgt`` di una directory locale:
+  i file sono mappati in memoria e le quote interpolate bilinearmente, per
+  tutti i punti di un tile in un colpo solo quando NumPy è disponibile
+  (extra ``fast``).
+  Non usa la rete, quindi un caricamento non resta mai in attesa e lo
+  stesso punto ha sempre la stessa quota.
+* :class:`HttpProvider` interroga il servizio Open-Elevation e fa da
+  riserva per le zone non coperte dai tile.
+
+Un fornitore è un oggetto con gli attributi ``name`` e ``remote`` e un
+metodo ``lookup(coords)`` che riceve una sequenza di ``(lat, lon)`` e
+restituisce una lista della stessa lunghezza con la quota in metri o
+``None``.
+
+Prima del primo fornitore remoto si consulta la cache persistente di
+:mod:`scialpi.elevation_cache`, che raccoglie poi le quote ricevute: una
+traccia i cui punti sono tutti in cache non usa la rete. Ai fornitori
+remoti va un solo punto per cella della cache.
+"""
+
+from __future__ import annotations
+
+import http.client
+import json
+import logging
+import math
+import mmap
+import os
+import random
+import sqlite3
+import struct
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    np = None  # type: ignore[assignment]
+
+from . import metrics
+from .config import (
+    DEFAULT_ELEVATION_URL,
+    ELEVATION_CACHE_FILENAME,
+    get_base_dir,
+    get_dem_dir,
+    get_elevation_cache_size,
+    get_elevation_providers,
+    get_elevation_url,
+)
+from .elevation_cache import ElevationCache, cell_key
+
+Coordinate = Tuple[float, float]
+
+# Valore dei tile SRTM per le celle senza dato
+HGT_VOID = -32768
+# Punti per richiesta e timeout in secondi del servizio remoto
+HTTP_CHUNK_SIZE = 100
+HTTP_TIMEOUT = 10
+# Richieste parallele, tentativi aggiuntivi e attesa base in secondi tra i tentativi
+HTTP_WORKERS = 4
+HTTP_RETRIES = 2
+HTTP_BACKOFF = 0.5
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_providers: Dict[Tuple[Tuple[str, ...], str, str], List[Any]] = {}
+_caches: Dict[Path, ElevationCache] = {}
+_SAMPLE = struct.Struct(">h")
+
+
+def tile_name(lat0: int, lon0: int) -> str:
+    """Nome del tile ``.hgt`` il cui angolo sud-ovest è ``(lat0, lon0)``."""
+    lat_prefix = "N" if lat0 >= 0 else "S"
+    lon_prefix = "E" if lon0 >= 0 else "W"
+    return f"{lat_prefix}{abs(lat0):02d}{lon_prefix}{abs(lon0):03d}.hgt"
+
+
+class HgtTile:
+    """Tile SRTM ``.hgt`` di un grado per un grado, mappato in memoria.
+
+    Il file è una griglia quadrata di interi a 16 bit big-endian, dalla
+    riga nord alla riga sud; la dimensione (1201 per SRTM3, 3601 per SRTM1)
+    si ricava dalla lunghezza del file.
+
+    Raises
+    ------
+    ValueError
+        Se la lunghezza del file non corrisponde a una griglia quadrata.
+    """
+
+    def __init__(self, path: Path, lat0: int, lon0: int) -> None:
+        size = os.path.getsize(path)
+        side = math.isqrt(size // 2)
+        if side < 2 or side * side * 2 != size:
+            raise ValueError(f"{path} non è un tile .hgt valido")
+        with open(path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.side = side
+        self.lat0 = lat0
+        self.lon0 = lon0
+        self._grid = None
+        if np is not None:
+            self._grid = np.frombuffer(self._data, dtype=">i2").reshape(side, side)
+
+    def interpolate(self, lats: Sequence[float], lons: Sequence[float]) -> List[Optional[float]]:
+        """Quote bilineari dei punti, tutti interni al tile.
+
+        Le celle senza dato non contribuiscono: la quota è la media pesata
+        degli angoli validi, ``None`` se non ce n'è nessuno.
+        """
+        if self._grid is not None:
+            return self._interpolate_numpy(lats, lons)
+        return [self._interpolate_point(lat, lon) for lat, lon in zip(lats, lons)]
+
+    def _interpolate_numpy(self, lats: Sequence[float], lons: Sequence[float]) -> List[Optional[float]]:
+        last = self.side - 1
+        rows = (self.lat0 + 1 - np.asarray(lats, dtype=np.float64)) * last
+        cols = (np.asarray(lons, dtype=np.float64) - self.lon0) * last
+        row0 = np.clip(np.floor(rows).astype(np.intp), 0, last - 1)
+        col0 = np.clip(np.floor(cols).astype(np.intp), 0, last - 1)
+        dr = np.clip(rows - row0, 0.0, 1.0)
+        dc = np.clip(cols - col0, 0.0, 1.0)
+        total = np.zeros(len(rows))
+        weight = np.zeros(len(rows))
+        for row_offset, col_offset, corner_weight in (
+            (0, 0, (1 - dr) * (1 - dc)),
+            (0, 1, (1 - dr) * dc),
+            (1, 0, dr * (1 - dc)),
+            (1, 1, dr * dc),
+        ):
+            values = self._grid[row0 + row_offset, col0 + col_offset]
+            corner_weight = np.where(values != HGT_VOID, corner_weight, 0.0)
+            total += corner_weight * values
+            weight += corner_weight
+        result = np.divide(total, weight, out=np.full(len(rows), np.nan), where=weight > 0)
+        return [None if math.isnan(value) else round(value, 2) for value in result.tolist()]
+
+    def _sample(self, row: int, col: int) -> int:
+        return _SAMPLE.unpack_from(self._data, 2 * (row * self.side + col))[0]
+
+    def _interpolate_point(self, lat: float, lon: float) -> Optional[float]:
+        last = self.side - 1
+        row = (self.lat0 + 1 - lat) * last
+        col = (lon - self.lon0) * last
+        row0 = min(max(math.floor(row), 0), last - 1)
+        col0 = min(max(math.floor(col), 0), last - 1)
+        dr = min(max(row - row0, 0.0), 1.0)
+        dc = min(max(col - col0, 0.0), 1.0)
+        total = weight = 0.0
+        for row_offset, col_offset, corner_weight in (
+            (0, 0, (1 - dr) * (1 - dc)),
+            (0, 1, (1 - dr) * dc),
+            (1, 0, dr * (1 - dc)),
+            (1, 1, dr * dc),
+        ):
+            value = self._sample(row0 + row_offset, col0 + col_offset)
+            if value != HGT_VOID:
+                total += corner_weight * value
+                weight += corner_weight
+        if weight <= 0:
+            return None
+        return round(total / weight, 2)
+
+
+class DemProvider:
+    """Quote dai tile ``.hgt`` di ``directory``, senza accessi alla rete.
+
+    I tile aperti restano mappati per tutta la vita del processo; quelli
+    mancanti vengono cercati di nuovo a ogni richiesta, così un tile
+    aggiunto alla directory viene usato senza riavviare.
+    """
+
+    name = "dem"
+    remote = False
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = Path(directory)
+        self._tiles: Dict[Tuple[int, int], HgtTile] = {}
+        self._lock = threading.Lock()
+
+    def _tile(self, lat0: int, lon0: int) -> Optional[HgtTile]:
+        tile = self._tiles.get((lat0, lon0))
+        if tile is not None:
+            return tile
+        name = tile_name(lat0, lon0)
+        for candidate in (name, name.lower()):
+            path = self.directory / candidate
+            if not path.is_file():
+                continue
+            try:
+                tile = HgtTile(path, lat0, lon0)
+            except (OSError, ValueError) as exc:
+                logger.warning("Tile altimetrico ignorato: %s", exc)
+                return None
+            with self._lock:
+                return self._tiles.setdefault((lat0, lon0), tile)
+        return None
+
+    def lookup(self, coords: Sequence[Coordinate]) -> List[Optional[float]]:
+        results: List[Optional[float]] = [None] * len(coords)
+        by_tile: Dict[Tuple[int, int], List[int]] = {}
+        for index, (lat, lon) in enumerate(coords):
+            if -90 <= lat < 90 and -180 <= lon < 180:
+                by_tile.setdefault((math.floor(lat), math.floor(lon)), []).append(index)
+        for (lat0, lon0), indices in by_tile.items():
+            tile = self._tile(lat0, lon0)
+            if tile is None:
+                continue
+            values = tile.interpolate([coords[i][0] for i in indices], [coords[i][1] for i in indices])
+            for index, value in zip(indices, values):
+                results[index] = value
+        return results
+
+
+class _HttpStatusError(Exception):
+    def __init__(self, status: int) -> None:
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+    @property
+    def retryable(self) -> bool:
+        return self.status >= 500 or self.status == 429
+
+
+class HttpProvider:
+    """Quote dal servizio Open-Elevation, a blocchi di :data:`HTTP_CHUNK_SIZE` punti.
+
+    I blocchi vengono chiesti in parallelo da al più :data:`HTTP_WORKERS`
+    thread, ognuno con una propria connessione keep-alive riusata tra le
+    richieste. Un blocco che fallisce per un errore di rete o del server
+    viene ritentato fino a :data:`HTTP_RETRIES` volte con attesa crescente;
+    se non va comunque a buon fine solo i suoi punti restano senza quota.
+    """
+
+    name = "http"
+    remote = True
+
+    def __init__(
+        self,
+        url: str = DEFAULT_ELEVATION_URL,
+        chunk_size: int = HTTP_CHUNK_SIZE,
+        timeout: float = HTTP_TIMEOUT,
+        workers: int = HTTP_WORKERS,
+        retries: int = HTTP_RETRIES,
+        backoff: float = HTTP_BACKOFF,
+    ) -> None:
+        self.url = url
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        parts = urllib.parse.urlsplit(url)
+        self._https = parts.scheme == "https"
+        self._netloc = parts.netloc
+        self._path = parts.path or "/"
+        self._local = threading.local()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self._https:
+                conn = http.client.HTTPSConnection(self._netloc, timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(self._netloc, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _drop_connection(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _get(self, path: str) -> bytes:
+        conn = self._connection()
+        started = time.perf_counter()
+        try:
+            conn.request("GET", path, headers={"Accept": "application/json"})
+            resp = conn.getresponse()
+            body = resp.read()
+        except BaseException:
+            # Lo stato della connessione è incerto: la prossima richiesta ne apre una nuova.
+            self._drop_connection()
+            metrics.inc("scialpi_elevation_requests_total", outcome="error")
+            raise
+        finally:
+            metrics.observe("scialpi_elevation_request_duration_seconds", time.perf_counter() - started)
+        metrics.inc("scialpi_elevation_requests_total", outcome=str(resp.status))
+        if resp.will_close:
+            self._drop_connection()
+        if resp.status != 200:
+            raise _HttpStatusError(resp.status)
+        return body
+
+    def _fetch_chunk(self, chunk: Sequence[Coordinate]) -> List[Optional[float]]:
+        locations = "|".join(f"{lat},{lon}" for lat, lon in chunk)
+        metrics.inc("scialpi_elevation_points_total", len(chunk))
+        payload = json.loads(self._get(self._path + "?locations=" + urllib.parse.quote(locations)).decode("utf-8"))
+        data = payload.get("results", [])
+        if len(data) != len(chunk):
+            raise ValueError("risposta con un numero di punti inatteso")
+        values: List[Optional[float]] = []
+        for item in data:
+            elevation = item.get("elevation")
+            values.append(None if elevation is None else float(elevation))
+        return values
+
+    def _fetch_with_retry(self, chunk: Sequence[Coordinate]) -> List[Optional[float]]:
+        attempt = 0
+        while True:
+            try:
+                return self._fetch_chunk(chunk)
+            except (OSError, http.client.HTTPException, _HttpStatusError) as exc:
+                retryable = not isinstance(exc, _HttpStatusError) or exc.retryable
+                if not retryable or attempt >= self.retries:
+                    logger.warning("Quote non disponibili da %s: %s", self.url, exc)
+                    return [None] * len(chunk)
+            except ValueError as exc:
+                logger.warning("Risposta non valida da %s: %s", self.url, exc)
+                return [None] * len(chunk)
+            time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+            attempt += 1
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            # Un pool creato prima di un fork non ha thread nel processo figlio.
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="elevation")
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def lookup(self, coords: Sequence[Coordinate]) -> List[Optional[float]]:
+        chunks = [coords[start : start + self.chunk_size] for start in range(0, len(coords), self.chunk_size)]
+        if len(chunks) <= 1 or self.workers <= 1:
+            parts = [self._fetch_with_retry(chunk) for chunk in chunks]
+        else:
+            parts = list(self._pool().map(self._fetch_with_retry, chunks))
+        results: List[Optional[float]] = []
+        for part in parts:
+            results.extend(part)
+        return results
+
+
+def _build_provider(name: str) -> Any:
+    if name == "dem":
+        return DemProvider(get_dem_dir())
+    return HttpProvider(get_elevation_url())
+
+
+def providers() -> List[Any]:
+    """Fornitori configurati, nell'ordine in cui vanno consultati."""
+    names = tuple(get_elevation_providers())
+    key = (names, str(get_dem_dir()), get_elevation_url())
+    configured = _providers.get(key)
+    if configured is None:
+        configured = [_build_provider(name) for name in names]
+        with _lock:
+            configured = _providers.setdefault(key, configured)
+    return configured
+
+
+def _cache() -> Optional[ElevationCache]:
+    size = get_elevation_cache_size()
+    if not size:
+        return None
+    path = get_base_dir() / ELEVATION_CACHE_FILENAME
+    cache = _caches.get(path)
+    if cache is None:
+        with _lock:
+            cache = _caches.setdefault(path, ElevationCache(path, size))
+    cache.max_entries = size
+    return cache
+
+
+def _lookup_remote(
+    provider: Any, coords: Sequence[Coordinate], cache: Optional[ElevationCache]
+) -> List[Optional[float]]:
+    if cache is None:
+        return provider.lookup(coords)
+    # Un solo punto per cella: gli altri ricevono la stessa quota.
+    cells: Dict[int, int] = {}
+    for index, (lat, lon) in enumerate(coords):
+        cells.setdefault(cell_key(lat, lon), index)
+    representatives = list(cells.values())
+    values = provider.lookup([coords[i] for i in representatives])
+    by_cell = {cell_key(*coords[i]): value for i, value in zip(representatives, values)}
+    fetched = [(coords[i][0], coords[i][1], value) for i, value in zip(representatives, values) if value is not None]
+    try:
+        cache.put_many(fetched)
+    except sqlite3.Error as exc:
+        logger.warning("Cache delle quote non aggiornata: %s", exc)
+    return [by_cell[cell_key(lat, lon)] for lat, lon in coords]
+
+
+def lookup(coords: Sequence[Coordinate]) -> List[Optional[float]]:
+    """Quote dei punti ``(lat, lon)``; ``None`` dove nessun fornitore risponde."""
+    results: List[Optional[float]] = [None] * len(coords)
+    missing = list(range(len(coords)))
+    cache = _cache()
+    cache_checked = False
+    for provider in providers():
+        if not missing:
+            break
+        if provider.remote and cache is not None and not cache_checked:
+            cache_checked = True
+            try:
+                cached = cache.get_many([coords[i] for i in missing])
+            except sqlite3.Error as exc:
+                logger.warning("Cache delle quote non disponibile: %s", exc)
+                cache = None
+            else:
+                for index, value in zip(missing, cached):
+                    results[index] = value
+                missing = [index for index in missing if results[index] is None]
+                if not missing:
+                    break
+        pending = [coords[i] for i in missing]
+        if provider.remote:
+            values = _lookup_remote(provider, pending, cache)
+        else:
+            values = provider.lookup(pending)
+        for index, value in zip(missing, values):
+            results[index] = value
+        missing = [index for index in missing if results[index] is None]
+    return results
+
+
+def ensure_elevation(points: List[List[float]]) -> List[List[float]]:
+    """Completa con la quota i punti ``[lat, lon]`` di una traccia.
+
+    I punti che hanno già una quota la mantengono; quelli per cui nessun
+    fornitore risponde restano senza.
+    """
+    missing = [index for index, point in enumerate(points) if len(point) < 3 or point[2] is None]
+    if not missing:
+        return points
+    elevations = lookup([(float(points[i][0]), float(points[i][1])) for i in missing])
+    found = dict(zip(missing, elevations))
+    enriched: List[List[float]] = []
+    for index, point in enumerate(points):
+        elevation = found.get(index)
+        if index not in found:
+            enriched.append([point[0], point[1], float(point[2])])
+        elif elevation is not None:
+            enriched.append([point[0], point[1], float(elevation)])
+        else:
+            enriched.append(point)
+    return enriched
@@ -0,0 +1,141 @@
+"""Cache persistente delle quote ottenute dai fornitori remoti.
+
+Le coordinate vengono quantizzate a :data:`QUANTUM` gradi (circa 11 m in
+latitudine) e ogni cella della griglia ricorda la prima quota ottenuta per
+un suo punto. La cache è un database SQLite in modalità WAL nella
+directory dei dati, condiviso tra i processi del server web e la CLI.
+
+Ogni lettura aggiorna l'istante d'uso delle celle trovate; quando il
+numero di celle supera il limite configurato vengono eliminate quelle
+usate meno di recente, in blocchi di :data:`EVICT_FRACTION` del limite.
+Il numero di celle è tenuto da due trigger nella tabella
+``elevation_count``, così una scrittura non deve contare la tabella.
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Lato delle celle in gradi
+QUANTUM = 1e-4
+# Parametri per ricavare una chiave intera unica da una cella
+_LAT_OFFSET = 90 * 10_000
+_LON_OFFSET = 180 * 10_000
+_LON_SPAN = 2 * _LON_OFFSET + 1
+# Massimo numero di parametri per query
+_BATCH = 500
+# Frazione del limite liberata, oltre l'eccedenza, quando la cache è piena
+EVICT_FRACTION = 0.01
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS elevations "
+    "(cell INTEGER PRIMARY KEY, elevation REAL NOT NULL, used REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_elevations_used ON elevations (used)",
+    "CREATE TABLE IF NOT EXISTS elevation_count (id INTEGER PRIMARY KEY CHECK (id = 0), cells INTEGER NOT NULL)",
+    # Conta le celle già presenti solo alla creazione della tabella.
+    "INSERT OR IGNORE INTO elevation_count (id, cells) SELECT 0, COUNT(*) FROM elevations",
+    "CREATE TRIGGER IF NOT EXISTS elevations_count_insert AFTER INSERT ON elevations "
+    "BEGIN UPDATE elevation_count SET cells = cells + 1 WHERE id = 0; END",
+    "CREATE TRIGGER IF NOT EXISTS elevations_count_delete AFTER DELETE ON elevations "
+    "BEGIN UPDATE elevation_count SET cells = cells - 1 WHERE id = 0; END",
+)
+
+
+def cell_key(lat: float, lon: float) -> int:
+    """Chiave intera della cella che contiene ``(lat, lon)``."""
+    lat_q = round(lat / QUANTUM)
+    lon_q = round(lon / QUANTUM)
+    return (lat_q + _LAT_OFFSET) * _LON_SPAN + (lon_q + _LON_OFFSET)
+
+
+def _batches(items: Sequence, size: int = _BATCH) -> Iterable[Sequence]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+class ElevationCache:
+    """Quote per cella, salvate in ``path`` e limitate a ``max_entries`` celle."""
+
+    def __init__(self, path: Path, max_entries: int) -> None:
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        # Una connessione aperta prima di un fork non va usata nel figlio.
+        if conn is not None and getattr(self._local, "pid", None) != os.getpid():
+            conn = None
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for statement in _SCHEMA:
+                    conn.execute(statement)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get_many(self, coords: Sequence[Tuple[float, float]]) -> List[Optional[float]]:
+        """Quote in cache dei punti ``(lat, lon)``; ``None`` per quelli assenti."""
+        keys = [cell_key(lat, lon) for lat, lon in coords]
+        unique = list(dict.fromkeys(keys))
+        found: Dict[int, float] = {}
+        conn = self._connection()
+        for batch in _batches(unique):
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT cell, elevation FROM elevations WHERE cell IN ({placeholders})", batch
+            )
+            found.update(rows)
+        if found:
+            now = time.time()
+            hits = list(found)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for batch in _batches(hits):
+                    placeholders = ",".join("?" * len(batch))
+                    conn.execute(f"UPDATE elevations SET used = ? WHERE cell IN ({placeholders})", [now, *batch])
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return [found.get(key) for key in keys]
+
+    def put_many(self, items: Iterable[Tuple[float, float, float]]) -> None:
+        """Salva le quote ``(lat, lon, quota)`` ed elimina le celle in eccesso."""
+        now = time.time()
+        rows = [(cell_key(lat, lon), float(elevation), now) for lat, lon, elevation in items]
+        if not rows:
+            return
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO elevations (cell, elevation, used) VALUES (?, ?, ?) "
+                "ON CONFLICT (cell) DO UPDATE SET used = excluded.used",
+                rows,
+            )
+            (count,) = conn.execute("SELECT cells FROM elevation_count WHERE id = 0").fetchone()
+            if count > self.max_entries:
+                conn.execute(
+                    "DELETE FROM elevations WHERE cell IN "
+                    "(SELECT cell FROM elevations ORDER BY used LIMIT ?)",
+                    (count - self.max_entries + max(int(self.max_entries * EVICT_FRACTION), 1),),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
@@ -0,0 +1,37 @@
+"""Dipendenze opzionali del pacchetto.
+
+Pillow (extra ``images``) serve a :mod:`scialpi.images` per le varianti
+ridimensionate delle foto; numpy (extra ``fast``) ai calcoli vettoriali di
+:mod:`scialpi.track_stats` e :mod:`scialpi.elevation`. Senza di loro
+l'applicazione funziona ugualmente, con le foto originali e i calcoli in
+Python puro: :func:`log_missing` lo segnala una volta all'avvio del server
+web e di ``scialpi worker``.
+"""
+
+from __future__ import annotations
+
+import logging
+
+from . import images, track_stats
+
+logger = logging.getLogger(__name__)
+
+_logged = False
+
+
+def log_missing() -> None:
+    """Registra un avviso per ogni extra non installato, solo la prima volta."""
+    global _logged
+    if _logged:
+        return
+    _logged = True
+    if images.Image is None:
+        logger.warning(
+            "Pillow non installato: le foto vengono servite senza varianti ridimensionate "
+            "(pip install 'scialpi-log[images]')"
+        )
+    if track_stats.np is None:
+        logger.warning(
+            "numpy non installato: statistiche delle tracce e quote calcolate in Python puro "
+            "(pip install 'scialpi-log[fast]')"
+        )
@@ -0,0 +1,149 @@
+"""Lettura in streaming dei file GPX.
+
+Il file viene letto con :func:`xml.etree.ElementTree.iterparse`: ogni punto
+(``trkpt`` o ``rtept``) viene convertito appena chiuso e poi rimosso
+dall'albero, così la memoria usata resta costante anche per file GPX di
+centinaia di MB. Le attività finiscono direttamente in un
+:class:`~scialpi.track_stats.TrackArrays`, senza oggetti per punto.
+
+In :func:`read_track` e :func:`read_activity` i punti delle tracce
+precedono quelli delle rotte, come nei parser che leggevano l'intero
+documento.
+"""
+
+from __future__ import annotations
+
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+
+from .track_stats import TrackArrays, timestamp
+
+# (lat, lon, quota, secondi dall'epoch UTC); quota e istante possono mancare
+Point = Tuple[float, float, Optional[float], Optional[float]]
+
+_TRACK_POINT = "trkpt"
+_ROUTE_POINT = "rtept"
+_CONTAINERS = ("trkseg", "rte")
+
+
+def _local_name(tag: str) -> str:
+    return tag.rpartition("}")[2]
+
+
+def parse_time(text: Optional[str]) -> Optional[float]:
+    """Secondi dall'epoch di un istante ISO 8601; ``None`` se non valido."""
+    if not text:
+        return None
+    text = text.strip()
+    if not text:
+        return None
+    if text.endswith("Z"):
+        text = text[:-1] + "+00:00"
+    try:
+        return timestamp(datetime.fromisoformat(text))
+    except ValueError:
+        return None
+
+
+def _parse_float(text: Optional[str]) -> Optional[float]:
+    if not text:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def _iter_points(source: IO[bytes], with_time: bool) -> Iterator[Tuple[bool, Point]]:
+    # Coppie (punto di rotta?, punto). Si tiene il segmento o la rotta
+    # aperti per staccarne i punti già letti: con il solo ``clear()`` gli
+    # elementi vuoti resterebbero appesi al genitore fino alla sua chiusura.
+    names: Dict[str, str] = {}
+    container = None
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        tag = elem.tag
+        name = names.get(tag)
+        if name is None:
+            name = names[tag] = _local_name(tag)
+        if name in _CONTAINERS:
+            if event == "start":
+                container = elem
+            else:
+                elem.clear()
+                container = None
+            continue
+        if event == "start" or (name != _TRACK_POINT and name != _ROUTE_POINT):
+            continue
+        attrib = elem.attrib
+        try:
+            lat = float(attrib["lat"])
+            lon = float(attrib["lon"])
+        except (KeyError, ValueError):
+            lat = lon = None
+        if lat is not None:
+            # Come ``find(".//{*}ele")``: vale il primo discendente nell'ordine
+            # del documento, anche se annidato (per esempio nelle estensioni).
+            ele_text = time_text = None
+            for child in elem.iter():
+                child_name = names.get(child.tag)
+                if child_name == "ele":
+                    if ele_text is None:
+                        ele_text = child.text or ""
+                elif child_name == "time":
+                    if time_text is None:
+                        time_text = child.text or ""
+            time = parse_time(time_text) if with_time else None
+            yield name == _ROUTE_POINT, (lat, lon, _parse_float(ele_text), time)
+        elem.clear()
+        if container is not None:
+            del container[:]
+
+
+def iter_points(source: IO[bytes], with_time: bool = False) -> Iterator[Point]:
+    """Punti ``(lat, lon, quota, istante)`` di un file GPX nell'ordine del documento.
+
+    Parameters
+    ----------
+    source:
+        File binario aperto, per esempio l'upload di Flask.
+    with_time:
+        Se falso l'istante dei punti non viene interpretato e vale ``None``.
+
+    Raises
+    ------
+    xml.etree.ElementTree.ParseError
+        Se il documento non è XML valido.
+    """
+    for _, point in _iter_points(source, with_time):
+        yield point
+
+
+def read_track(source: IO[bytes]) -> List[List[float]]:
+    """Traccia ``[[lat, lon, ele?], ...]`` di un file GPX; lista vuota se non valido."""
+    points: List[List[float]] = []
+    route_points: List[List[float]] = []
+    try:
+        for is_route, (lat, lon, ele, _) in _iter_points(source, False):
+            target = route_points if is_route else points
+            target.append([lat, lon] if ele is None else [lat, lon, ele])
+    except (ET.ParseError, OSError):
+        return []
+    points.extend(route_points)
+    return points
+
+
+def read_activity(source: IO[bytes]) -> TrackArrays:
+    """Punti di un'attività registrata, con quote e istanti, pronti per le statistiche.
+
+    Un file non valido restituisce array vuoti.
+    """
+    arrays = TrackArrays()
+    route_arrays = TrackArrays()
+    try:
+        for is_route, (lat, lon, ele, time) in _iter_points(source, True):
+            (route_arrays if is_route else arrays).append(lat, lon, ele, time)
+    except (ET.ParseError, OSError):
+        return TrackArrays()
+    arrays.extend(route_arrays)
+    return arrays
@@ -0,0 +1,120 @@
+"""Varianti ridimensionate delle immagini caricate.
+
+Le foto delle giornate, dei profili e delle segnalazioni di valanghe
+vengono servite anche in formati ridotti, scelti tra :data:`VARIANT_SIZES`:
+``thumb`` per le miniature, ``card`` per le schede e ``full`` per la
+visualizzazione a schermo intero. Ogni variante è generata una sola volta,
+al caricamento o alla prima richiesta, e salvata in
+``variants/<cartella>/<formato>/`` dentro la directory dei dati; la
+ricodifica applica l'orientamento EXIF e scarta i metadati (EXIF,
+commenti, miniature incorporate) tranne il profilo colore ICC, senza il
+quale le foto Display P3 o Adobe RGB cambierebbero colore.
+
+Serve Pillow, con l'extra ``images``: se non è installato, o l'immagine
+non si può decodificare, :func:`image_variant` restituisce ``None`` e si
+usa l'originale.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from pathlib import Path
+from typing import Optional
+from uuid import uuid4
+
+from .config import get_base_dir
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    Image = None  # type: ignore[assignment]
+    ImageOps = None  # type: ignore[assignment]
+
+# Lato massimo in pixel di ogni variante
+VARIANT_SIZES = {"thumb": 320, "card": 960, "full": 2048}
+# Cartelle dei dati con immagini caricate
+IMAGE_FOLDERS = ("day_photos", "user_photos", "avalanche_images")
+VARIANTS_DIRNAME = "variants"
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+
+logger = logging.getLogger(__name__)
+
+
+def variant_path(folder: str, filename: str, size: str) -> Path:
+    """Percorso della variante ``size`` dell'immagine ``folder/filename``."""
+    return get_base_dir() / VARIANTS_DIRNAME / folder / size / filename
+
+
+def _encode(image, target: Path, image_format: str, icc_profile: Optional[bytes]) -> None:
+    if image_format == "JPEG":
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+            # Un profilo CMYK non descrive più i pixel convertiti.
+            icc_profile = None
+        options = {"quality": JPEG_QUALITY, "optimize": True, "progressive": True}
+    elif image_format == "PNG":
+        options = {"optimize": True}
+    else:
+        options = {"quality": WEBP_QUALITY}
+    if icc_profile:
+        options["icc_profile"] = icc_profile
+    image.save(target, image_format, **options)
+
+
+def _render(source: Path, target: Path, edge: int) -> bool:
+    with Image.open(source) as image:
+        image_format = "JPEG" if image.format == "MPO" else image.format
+        if image_format not in ("JPEG", "PNG", "WEBP") or getattr(image, "is_animated", False):
+            return False
+        icc_profile = image.info.get("icc_profile")
+        # Per i JPEG la decodifica a scala ridotta evita di espandere tutti i pixel.
+        image.draft(image.mode, (edge, edge))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((edge, edge), Image.LANCZOS)
+        image.info = {}
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(f".{uuid4().hex}.tmp")
+        try:
+            _encode(image, tmp, image_format, icc_profile)
+            os.replace(tmp, target)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+    return True
+
+
+def image_variant(folder: str, filename: str, size: str) -> Optional[Path]:
+    """Percorso della variante ``size`` di un'immagine, generata se manca.
+
+    Restituisce ``None`` se la variante non si può produrre: Pillow assente,
+    nome o formato non validi, file originale mancante o illeggibile.
+    """
+    edge = VARIANT_SIZES.get(size)
+    if edge is None or folder not in IMAGE_FOLDERS:
+        return None
+    if not filename or filename.startswith(".") or Path(filename).name != filename:
+        return None
+    target = variant_path(folder, filename, size)
+    if target.is_file():
+        return target
+    if Image is None:
+        return None
+    source = get_base_dir() / folder / filename
+    if not source.is_file():
+        return None
+    try:
+        if not _render(source, target, edge):
+            return None
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        logger.warning("Variante %s di %s/%s non generata: %s", size, folder, filename, exc)
+        return None
+    return target
+
+
+def make_variants(folder: str, filename: str) -> None:
+    """Genera tutte le varianti di un'immagine appena caricata."""
+    for size in VARIANT_SIZES:
+        if image_variant(folder, filename, size) is None:
+            break
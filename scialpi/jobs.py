@@ -0,0 +1,395 @@
+"""Coda persistente dei lavori in background.
+
+I caricamenti (tracce GPX, attività, foto) salvano il file ricevuto nella
+directory ``uploads/`` dei dati e accodano un lavoro nella collezione
+``jobs``; la richiesta HTTP risponde subito e il lavoro viene eseguito da
+un worker:
+
+* thread interni al processo web, in numero ``SCIALPI_JOB_WORKERS``
+  (vedi :mod:`scialpi.config`), avviati alla prima richiesta;
+* oppure un processo separato, ``scialpi worker``, con
+  ``SCIALPI_JOB_WORKERS=0`` nel server web.
+
+Un lavoro passa da ``pending`` a ``running`` e poi a ``done`` (con il suo
+``result``) o ``failed`` (con il messaggio ``error``). La presa in carico
+avviene dentro :func:`scialpi.storage.transaction`, quindi più worker,
+anche in processi diversi, non eseguono mai lo stesso lavoro. Durante
+l'esecuzione il worker rinnova ``heartbeat_at`` ogni
+:data:`HEARTBEAT_SECONDS`; un lavoro ``running`` senza rinnovo da oltre
+:data:`JOB_TIMEOUT_SECONDS`, per esempio perché il suo processo è
+terminato, torna in coda fino a :data:`MAX_ATTEMPTS` tentativi. Se il
+primo worker era solo lento, al termine trova il lavoro ripreso da un
+altro tentativo e ne scarta l'esito senza toccare i file caricati, che
+vengono eliminati solo quando il lavoro è concluso.
+
+Un :class:`JobError` conclude subito il lavoro con il suo messaggio. Le
+altre eccezioni, per esempio un errore di rete o di I/O temporaneo,
+rimettono il lavoro in coda dopo :data:`RETRY_DELAY_SECONDS`, raddoppiati
+a ogni tentativo, fino a :data:`MAX_ATTEMPTS` tentativi.
+
+Le funzioni che eseguono i lavori si registrano con :func:`handler`; quelle
+dei caricamenti sono in :mod:`scialpi.uploads`.
+"""
+
+from __future__ import annotations
+
+import importlib
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from uuid import uuid4
+
+from . import metrics, storage
+from .config import get_base_dir, get_job_workers
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Secondi senza heartbeat dopo i quali un lavoro in esecuzione si considera abbandonato
+JOB_TIMEOUT_SECONDS = 120
+# Intervallo in secondi tra due heartbeat di un lavoro in esecuzione
+HEARTBEAT_SECONDS = 30
+MAX_ATTEMPTS = 3
+# Attesa in secondi prima di ripetere un lavoro fallito, raddoppiata a ogni tentativo
+RETRY_DELAY_SECONDS = 30
+# I lavori conclusi vengono eliminati dopo questo tempo
+JOB_RETENTION = timedelta(days=7)
+# Attesa massima in secondi di un worker senza lavori prima di ricontrollare la coda
+POLL_SECONDS = 1.0
+
+logger = logging.getLogger(__name__)
+
+_handlers: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {}
+_wakeup = threading.Event()
+_lock = threading.Lock()
+_threads: List[threading.Thread] = []
+_threads_pid: Optional[int] = None
+
+
+class JobError(Exception):
+    """Errore previsto di un lavoro: il messaggio viene mostrato all'utente."""
+
+
+def _now() -> datetime:
+    return datetime.utcnow()
+
+
+def _iso(value: datetime) -> str:
+    return value.isoformat() + "Z"
+
+
+def _parse_iso(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.rstrip("Z"))
+    except ValueError:
+        return None
+
+
+def init_jobs() -> None:
+    """Crea la collezione dei lavori e la directory dei file caricati."""
+    storage.ensure_collection("jobs")
+    uploads_dir().mkdir(parents=True, exist_ok=True)
+
+
+def uploads_dir() -> Path:
+    """Directory dei file caricati in attesa di elaborazione."""
+    return get_base_dir() / "uploads"
+
+
+def spool(file_storage, suffix: str = "") -> str:
+    """Salva un file caricato in :func:`uploads_dir` e ne restituisce il nome."""
+    directory = uploads_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    name = uuid4().hex + suffix
+    file_storage.save(directory / name)
+    return name
+
+
+def spool_text(text: str, suffix: str = "") -> str:
+    """Come :func:`spool` per un contenuto testuale."""
+    directory = uploads_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    name = uuid4().hex + suffix
+    (directory / name).write_text(text, encoding="utf-8")
+    return name
+
+
+def discard_upload(payload: Dict[str, Any]) -> None:
+    """Elimina i file caricati elencati in ``payload["files"]``."""
+    for name in payload.get("files") or []:
+        try:
+            (uploads_dir() / name).unlink()
+        except FileNotFoundError:
+            pass
+
+
+def handler(kind: str) -> Callable:
+    """Decoratore che registra la funzione che esegue i lavori di tipo ``kind``.
+
+    La funzione riceve il ``payload`` del lavoro e restituisce il
+    ``result`` da salvare; i file elencati in ``payload["files"]`` vengono
+    eliminati da :func:`run_job` al termine.
+    """
+
+    def register(func: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+        _handlers[kind] = func
+        return func
+
+    return register
+
+
+def _handler(kind: str) -> Optional[Callable[[Dict[str, Any]], Dict[str, Any]]]:
+    if kind not in _handlers:
+        # Registra i lavori dei caricamenti.
+        importlib.import_module(".uploads", __package__)
+    return _handlers.get(kind)
+
+
+def enqueue(kind: str, payload: Dict[str, Any], owner_id: Optional[str] = None) -> Dict[str, Any]:
+    """Accoda un lavoro e sveglia i worker del processo."""
+    job = {
+        "id": uuid4().hex,
+        "kind": kind,
+        "status": PENDING,
+        "owner_id": owner_id,
+        "payload": payload,
+        "result": None,
+        "error": None,
+        "attempts": 0,
+        "created_at": _iso(_now()),
+        "started_at": None,
+        "finished_at": None,
+    }
+    storage.put("jobs", job)
+    start_workers()
+    _wakeup.set()
+    return job
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    return storage.get("jobs", job_id)
+
+
+def job_summary(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Stato pubblico di un lavoro, senza il payload interno."""
+    return {
+        "id": job.get("id"),
+        "kind": job.get("kind"),
+        "status": job.get("status"),
+        "result": job.get("result"),
+        "error": job.get("error"),
+        "created_at": job.get("created_at"),
+        "started_at": job.get("started_at"),
+        "finished_at": job.get("finished_at"),
+    }
+
+
+def _is_stale(job: Dict[str, Any], now: datetime) -> bool:
+    seen = _parse_iso(job.get("heartbeat_at") or job.get("started_at"))
+    return seen is not None and seen <= now - timedelta(seconds=JOB_TIMEOUT_SECONDS)
+
+
+def _owned(current: Optional[Dict[str, Any]], job: Dict[str, Any]) -> bool:
+    """``True`` se ``current`` è ancora in esecuzione nel tentativo ``job``."""
+    return (
+        current is not None
+        and current.get("status") == RUNNING
+        and current.get("worker") == job.get("worker")
+        and current.get("attempts") == job.get("attempts")
+    )
+
+
+def _is_ready(job: Dict[str, Any], now: datetime) -> bool:
+    run_after = _parse_iso(job.get("run_after"))
+    return run_after is None or run_after <= now
+
+
+def _has_work(now: datetime) -> bool:
+    return any(_is_ready(job, now) for job in storage.find("jobs", "status", PENDING)) or any(
+        _is_stale(job, now) for job in storage.find("jobs", "status", RUNNING)
+    )
+
+
+def _requeue_stale(now: datetime) -> None:
+    for job in storage.find("jobs", "status", RUNNING):
+        if not _is_stale(job, now):
+            continue
+        job = dict(job)
+        if (job.get("attempts") or 0) >= MAX_ATTEMPTS:
+            job["status"] = FAILED
+            job["error"] = "Elaborazione interrotta"
+            job["finished_at"] = _iso(now)
+            discard_upload(job.get("payload") or {})
+        else:
+            job["status"] = PENDING
+        storage.put("jobs", job)
+
+
+def claim(worker: str) -> Optional[Dict[str, Any]]:
+    """Prende in carico il lavoro in attesa più vecchio, se c'è.
+
+    I lavori da ripetere vengono presi solo allo scadere di ``run_after``.
+
+    La coda viene prima controllata senza lock: un worker senza lavori non
+    prende il lock esclusivo dei dati e non blocca le scritture del sito.
+    Dentro la transazione il controllo si ripete, perché un altro worker
+    può aver preso il lavoro nel frattempo.
+    """
+    if not _has_work(_now()):
+        return None
+    with storage.transaction():
+        now = _now()
+        _requeue_stale(now)
+        pending = [job for job in storage.find("jobs", "status", PENDING) if _is_ready(job, now)]
+        if not pending:
+            return None
+        job = dict(min(pending, key=lambda item: item.get("created_at") or ""))
+        job["status"] = RUNNING
+        job["worker"] = worker
+        job["attempts"] = (job.get("attempts") or 0) + 1
+        job["started_at"] = _iso(now)
+        job["heartbeat_at"] = job["started_at"]
+        storage.put("jobs", job)
+    return job
+
+
+def _touch(job: Dict[str, Any]) -> bool:
+    """Rinnova l'heartbeat di ``job``; ``False`` se il tentativo non è più in esecuzione."""
+    with storage.transaction():
+        current = get_job(job["id"])
+        if not _owned(current, job):
+            return False
+        current = dict(current)
+        current["heartbeat_at"] = _iso(_now())
+        storage.put("jobs", current)
+    return True
+
+
+def _heartbeat(job: Dict[str, Any], stop: threading.Event) -> None:
+    while not stop.wait(HEARTBEAT_SECONDS):
+        try:
+            if not _touch(job):
+                return
+        except Exception:
+            logger.exception("Heartbeat del lavoro %s non salvato", job.get("id"))
+
+
+def run_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Esegue un lavoro già preso in carico da :func:`claim` e ne salva l'esito.
+
+    Un errore inatteso rimette il lavoro in coda con ``run_after``, finché
+    restano tentativi. Se nel frattempo il lavoro è tornato in coda, perché
+    è mancato l'heartbeat, l'esito viene scartato e i file caricati restano
+    al tentativo successivo; la funzione restituisce lo stato attuale.
+    """
+    payload = job.get("payload") or {}
+    func = _handler(job.get("kind"))
+    result = None
+    error = None
+    retry = False
+    stop = threading.Event()
+    beat = threading.Thread(target=_heartbeat, args=(job, stop), name=f"scialpi-heartbeat-{job['id']}", daemon=True)
+    beat.start()
+    try:
+        if func is None:
+            raise JobError(f"Tipo di lavoro sconosciuto: {job.get('kind')}")
+        result = func(payload)
+    except JobError as exc:
+        error = str(exc)
+    except Exception:
+        attempts = job.get("attempts") or 1
+        retry = attempts < MAX_ATTEMPTS
+        logger.exception("Lavoro %s (%s) fallito al tentativo %d", job.get("id"), job.get("kind"), attempts)
+        error = "Errore durante l'elaborazione"
+    finally:
+        stop.set()
+        beat.join()
+    with storage.transaction():
+        current = get_job(job["id"])
+        if not _owned(current, job):
+            logger.warning("Lavoro %s ripreso da un altro tentativo: esito scartato", job.get("id"))
+            return dict(current or job)
+        current = dict(current)
+        now = _now()
+        if retry:
+            delay = RETRY_DELAY_SECONDS * 2 ** ((current.get("attempts") or 1) - 1)
+            current["status"] = PENDING
+            current["run_after"] = _iso(now + timedelta(seconds=delay))
+        else:
+            current["status"] = FAILED if error else DONE
+            current["result"] = result
+            current["error"] = error
+            current["finished_at"] = _iso(now)
+        storage.put("jobs", current)
+    if current["status"] != PENDING:
+        discard_upload(payload)
+    return current
+
+
+def prune(now: Optional[datetime] = None) -> int:
+    """Elimina i lavori conclusi da più di :data:`JOB_RETENTION`."""
+    cutoff = (now or _now()) - JOB_RETENTION
+    removed = 0
+    with storage.transaction():
+        for status in (DONE, FAILED):
+            for job in list(storage.find("jobs", "status", status)):
+                finished = _parse_iso(job.get("finished_at"))
+                if finished is not None and finished < cutoff:
+                    storage.delete("jobs", job["id"])
+                    removed += 1
+    return removed
+
+
+def run_pending(worker: Optional[str] = None) -> int:
+    """Esegue i lavori in attesa finché la coda non è vuota; restituisce quanti."""
+    worker = worker or f"{os.getpid()}-{threading.get_ident()}"
+    count = 0
+    while True:
+        job = claim(worker)
+        if job is None:
+            return count
+        run_job(job)
+        count += 1
+
+
+def work(stop: Optional[threading.Event] = None, worker: Optional[str] = None) -> None:
+    """Ciclo di un worker: esegue i lavori in attesa finché ``stop`` non è impostato."""
+    stop = stop or threading.Event()
+    last_prune = None
+    while not stop.is_set():
+        try:
+            run_pending(worker)
+            metrics.flush()
+            now = _now()
+            if last_prune is None or now - last_prune > timedelta(hours=1):
+                prune(now)
+                last_prune = now
+        except Exception:
+            logger.exception("Errore nel worker dei lavori")
+        _wakeup.wait(POLL_SECONDS)
+        _wakeup.clear()
+
+
+def start_workers(count: Optional[int] = None) -> None:
+    """Avvia i thread worker del processo, se configurati e non già attivi."""
+    global _threads_pid
+    count = get_job_workers() if count is None else count
+    if count <= 0:
+        return
+    with _lock:
+        # Dopo un fork i thread del processo padre non esistono più.
+        if _threads_pid == os.getpid() and all(thread.is_alive() for thread in _threads):
+            return
+        _threads.clear()
+        _threads_pid = os.getpid()
+        for index in range(count):
+            thread = threading.Thread(target=work, name=f"scialpi-jobs-{index}", daemon=True)
+            thread.start()
+            _threads.append(thread)
@@ -0,0 +1,113 @@
+"""Lock consultivi tra processi sulla directory dei dati.
+
+Più worker dell'applicazione web possono scrivere sugli stessi file. Un
+:class:`DirLock` usa ``flock`` su un file ``.lock`` nella directory dei dati:
+in modo esclusivo per le transazioni di scrittura, condiviso per le
+ricariche della cache. All'interno dello stesso processo i thread vengono
+serializzati da un ``RLock``, quindi il lock è rientrante per il thread che
+lo possiede.
+
+I tempi di attesa vengono accumulati in :func:`lock_stats` e nelle
+metriche di :mod:`scialpi.metrics`; le attese più lunghe di
+:data:`SLOW_WAIT_SECONDS` vengono anche registrate nel log.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from . import metrics
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None  # type: ignore[assignment]
+
+logger = logging.getLogger(__name__)
+
+# Attese oltre questa soglia vengono segnalate nel log
+SLOW_WAIT_SECONDS = 0.5
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, float] = {
+    "acquisitions": 0,
+    "contended": 0,
+    "wait_seconds_total": 0.0,
+    "wait_seconds_max": 0.0,
+}
+
+
+def record_wait(seconds: float, what: str) -> None:
+    """Registra il tempo speso in attesa di un lock."""
+    with _stats_lock:
+        _stats["acquisitions"] += 1
+        _stats["wait_seconds_total"] += seconds
+        if seconds > _stats["wait_seconds_max"]:
+            _stats["wait_seconds_max"] = seconds
+        if seconds > 0.001:
+            _stats["contended"] += 1
+    metrics.inc("scialpi_lock_acquisitions_total")
+    metrics.inc("scialpi_lock_wait_seconds_total", seconds)
+    if seconds > 0.001:
+        metrics.inc("scialpi_lock_contended_total")
+    if seconds >= SLOW_WAIT_SECONDS:
+        logger.warning("Attesa di %.3f s per il lock %s", seconds, what)
+
+
+def lock_stats() -> Dict[str, float]:
+    """Restituisce una copia dei contatori di attesa sui lock."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+class DirLock:
+    """Lock rientrante su ``<directory>/.lock``, condiviso o esclusivo."""
+
+    def __init__(self, directory: Path) -> None:
+        self.path = directory / ".lock"
+        self._mutex = threading.RLock()
+        self._depth = 0
+        self._owner: Optional[int] = None
+        self._fd: Optional[int] = None
+        self._pid: Optional[int] = None
+
+    def _open(self) -> int:
+        # Dopo un fork il descrittore ereditato condividerebbe il lock con il
+        # processo padre: ogni processo apre il proprio.
+        if self._fd is None or self._pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+    def acquire(self, shared: bool = False) -> None:
+        started = time.perf_counter()
+        self._mutex.acquire()
+        try:
+            if self._depth == 0 and fcntl is not None:
+                fcntl.flock(self._open(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        except BaseException:
+            self._mutex.release()
+            raise
+        self._depth += 1
+        if self._depth == 1:
+            self._owner = threading.get_ident()
+            record_wait(time.perf_counter() - started, str(self.path))
+
+    def release(self) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            self._owner = None
+            if fcntl is not None and self._fd is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._mutex.release()
+
+    @property
+    def held(self) -> bool:
+        """``True`` se il thread corrente possiede già il lock."""
+        return self._owner == threading.get_ident()
@@ -0,0 +1,335 @@
+"""Metriche di funzionamento in formato Prometheus.
+
+Contatori e istogrammi vivono nella memoria del processo e vengono
+aggiornati con :func:`inc` e :func:`observe`; i nomi ammessi, con tipo,
+descrizione ed eventuali bucket, sono in :data:`DEFINITIONS`. Li
+alimentano il server web (richieste per endpoint), i backend di
+:mod:`scialpi.storage` (letture e scritture delle collezioni) e
+:mod:`scialpi.elevation` (chiamate al servizio di quote remoto).
+
+Ogni processo salva periodicamente le proprie metriche con :func:`flush`,
+e all'uscita, in ``metrics/<host>-<pid>-<token>.json`` dentro la directory
+dei dati; :func:`render` somma i file di tutti i processi, così
+``/metrics`` riporta i totali anche con più worker del server web, con
+``scialpi worker`` e con più container che condividono i dati. Host e
+token evitano che processi di container diversi, o con un pid riciclato,
+scrivano sullo stesso file.
+
+I file non aggiornati da :data:`RETIRE_SECONDS` vengono sommati in
+``retired.json`` ed eliminati, così i totali non calano e la directory
+non cresce a ogni riavvio. Non serve sapere se il processo è ancora vivo:
+un processo che torna a salvare dopo il ritiro del suo file ne scrive uno
+nuovo con i soli valori successivi. Ritiro e salvataggi avvengono sotto
+un ``flock`` su ``metrics/.lock``. Un processo figlio creato con ``fork``
+riparte da zero, per non contare due volte i valori ereditati.
+"""
+
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import math
+import os
+import re
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+from .config import get_base_dir
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None  # type: ignore[assignment]
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Nome -> (tipo, descrizione, bucket degli istogrammi)
+DEFINITIONS: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {
+    "scialpi_http_requests_total": ("counter", "Richieste HTTP per endpoint, metodo e stato.", ()),
+    "scialpi_http_request_duration_seconds": ("histogram", "Durata delle richieste HTTP per endpoint.", DURATION_BUCKETS),
+    "scialpi_http_response_size_bytes": ("histogram", "Dimensione delle risposte HTTP per endpoint.", SIZE_BUCKETS),
+    "scialpi_storage_loads_total": ("counter", "Letture di una collezione dal disco.", ()),
+    "scialpi_storage_load_bytes_total": ("counter", "Byte letti dal disco per collezione.", ()),
+    "scialpi_storage_load_seconds_total": ("counter", "Tempo di lettura e parsing per collezione.", ()),
+    "scialpi_storage_cache_hits_total": ("counter", "Accessi a una collezione serviti dalla cache in memoria.", ()),
+    "scialpi_storage_saves_total": ("counter", "Scritture su una collezione.", ()),
+    "scialpi_storage_save_bytes_total": ("counter", "Byte scritti per collezione.", ()),
+    "scialpi_storage_save_seconds_total": ("counter", "Tempo di scrittura per collezione.", ()),
+    "scialpi_lock_acquisitions_total": ("counter", "Acquisizioni dei lock sui dati.", ()),
+    "scialpi_lock_contended_total": ("counter", "Acquisizioni dei lock sui dati con attesa.", ()),
+    "scialpi_lock_wait_seconds_total": ("counter", "Tempo speso in attesa dei lock sui dati.", ()),
+    "scialpi_elevation_requests_total": ("counter", "Richieste al servizio di quote remoto per esito.", ()),
+    "scialpi_elevation_points_total": ("counter", "Punti chiesti al servizio di quote remoto.", ()),
+    "scialpi_elevation_request_duration_seconds": (
+        "histogram",
+        "Durata delle richieste al servizio di quote remoto.",
+        DURATION_BUCKETS,
+    ),
+}
+METRICS_DIRNAME = "metrics"
+# Somma delle metriche dei file ritirati
+RETIRED_FILENAME = "retired.json"
+# Intervallo minimo in secondi tra due salvataggi delle metriche di un processo
+FLUSH_SECONDS = 5.0
+# Secondi senza salvataggi dopo i quali il file di un processo viene ritirato
+RETIRE_SECONDS = 12 * FLUSH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+Labels = Tuple[Tuple[str, str], ...]
+Counters = Dict[Tuple[str, Labels], float]
+Histograms = Dict[Tuple[str, Labels], List[float]]
+
+_lock = threading.Lock()
+# Serializza i salvataggi dei thread del processo
+_flush_lock = threading.Lock()
+_counters: Counters = {}
+# Per ogni serie: conteggi per bucket (l'ultimo è +Inf), somma dei valori
+_histograms: Histograms = {}
+_last_flush = 0.0
+# Vero se le metriche sono cambiate dall'ultimo salvataggio
+_dirty = False
+# Distingue i file di processi diversi con lo stesso host e pid
+_token = uuid4().hex[:8]
+# Valori dell'ultimo salvataggio e valori già sommati in retired.json
+_saved: Optional[Tuple[Counters, Histograms]] = None
+_offset: Tuple[Counters, Histograms] = ({}, {})
+_HOST = re.sub(r"[^A-Za-z0-9_.-]", "_", socket.gethostname()) or "host"
+
+
+def _reset() -> None:
+    global _last_flush, _dirty, _token, _saved, _offset
+    _counters.clear()
+    _histograms.clear()
+    _last_flush = 0.0
+    _dirty = False
+    _token = uuid4().hex[:8]
+    _saved = None
+    _offset = ({}, {})
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset)
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def inc(name: str, value: float = 1.0, **labels: Any) -> None:
+    """Incrementa di ``value`` il contatore ``name`` con le etichette ``labels``."""
+    global _dirty
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+        _dirty = True
+
+
+def observe(name: str, value: float, **labels: Any) -> None:
+    """Registra ``value`` nell'istogramma ``name``."""
+    global _dirty
+    buckets = DEFINITIONS[name][2]
+    key = (name, _labels(labels))
+    with _lock:
+        series = _histograms.get(key)
+        if series is None:
+            series = _histograms[key] = [0.0] * (len(buckets) + 2)
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                series[index] += 1
+                break
+        else:
+            series[len(buckets)] += 1
+        series[-1] += value
+        _dirty = True
+
+
+def _serialize(counters: Counters, histograms: Histograms, **extra: Any) -> Dict[str, Any]:
+    return {
+        **extra,
+        "counters": [[name, list(labels), value] for (name, labels), value in counters.items()],
+        "histograms": [[name, list(labels), list(series)] for (name, labels), series in histograms.items()],
+    }
+
+
+def _subtract(current: Tuple[Counters, Histograms], offset: Tuple[Counters, Histograms]) -> Tuple[Counters, Histograms]:
+    counters = {key: value - offset[0].get(key, 0.0) for key, value in current[0].items()}
+    histograms = {}
+    for key, series in current[1].items():
+        base = offset[1].get(key)
+        histograms[key] = list(series) if base is None else [a - b for a, b in zip(series, base)]
+    return counters, histograms
+
+
+def metrics_dir() -> Path:
+    return get_base_dir() / METRICS_DIRNAME
+
+
+@contextmanager
+def _directory_lock(directory: Path) -> Iterator[None]:
+    # Non si usa :class:`scialpi.locking.DirLock`, che registra a sua volta
+    # delle metriche.
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(directory / ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def flush(force: bool = False) -> None:
+    """Salva le metriche del processo, al più ogni :data:`FLUSH_SECONDS` se non ``force``.
+
+    Se nel frattempo il file del processo è stato sommato in
+    :data:`RETIRED_FILENAME`, il nuovo file riporta solo i valori successivi.
+    """
+    global _last_flush, _dirty, _saved, _offset
+    with _flush_lock:
+        now = time.monotonic()
+        if not _dirty or (not force and now - _last_flush < FLUSH_SECONDS):
+            return
+        _last_flush = now
+        with _lock:
+            _dirty = False
+            current = (dict(_counters), {key: list(series) for key, series in _histograms.items()})
+        if not current[0] and not current[1]:
+            return
+        directory = metrics_dir()
+        path = directory / f"{_HOST}-{os.getpid()}-{_token}.json"
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            with _directory_lock(directory):
+                if _saved is not None and not path.exists():
+                    # Il file è stato ritirato: retired.json contiene già i
+                    # valori dell'ultimo salvataggio.
+                    _offset = _saved
+                _write(path, _serialize(*_subtract(current, _offset), host=_HOST, pid=os.getpid()))
+                _saved = current
+        except OSError as exc:
+            logger.warning("Metriche non salvate in %s: %s", path, exc)
+
+
+atexit.register(flush, True)
+
+
+def _write(path: Path, data: Dict[str, Any]) -> None:
+    tmp = path.with_name(f".{path.stem}.{threading.get_ident()}.tmp")
+    tmp.write_text(json.dumps(data, separators=(",", ":")), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _retire_stale(directory: Path) -> None:
+    """Somma in :data:`RETIRED_FILENAME` i file fermi da :data:`RETIRE_SECONDS` e li elimina."""
+    if fcntl is None:
+        # Senza lock un processo potrebbe riscrivere il file mentre viene ritirato.
+        return
+    with _directory_lock(directory):
+        deadline = time.time() - RETIRE_SECONDS
+        stale = []
+        for path in directory.glob("*.json"):
+            if path.name == RETIRED_FILENAME:
+                continue
+            try:
+                if path.stat().st_mtime < deadline:
+                    stale.append(path)
+            except FileNotFoundError:
+                continue
+        if not stale:
+            return
+        retired = directory / RETIRED_FILENAME
+        _write(retired, _serialize(*_merge(_read_files([retired] + stale))))
+        for path in stale:
+            path.unlink()
+
+
+def _merge(snapshots: List[Dict[str, Any]]) -> Tuple[Counters, Histograms]:
+    counters: Counters = {}
+    histograms: Histograms = {}
+    for data in snapshots:
+        for name, labels, value in data.get("counters", []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0.0) + value
+        for name, labels, series in data.get("histograms", []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            total = histograms.get(key)
+            if total is None or len(total) != len(series):
+                histograms[key] = list(series)
+            else:
+                histograms[key] = [a + b for a, b in zip(total, series)]
+    return counters, histograms
+
+
+def _read_files(paths: List[Path]) -> List[Dict[str, Any]]:
+    snapshots = []
+    for path in paths:
+        try:
+            snapshots.append(json.loads(path.read_text(encoding="utf-8")))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def _read_snapshots() -> List[Dict[str, Any]]:
+    directory = metrics_dir()
+    if not directory.is_dir():
+        return []
+    try:
+        _retire_stale(directory)
+    except OSError as exc:
+        logger.warning("Metriche dei processi fermi non raccolte in %s: %s", directory, exc)
+    return _read_files(list(directory.glob("*.json")))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(int(value)) if float(value).is_integer() else repr(value)
+
+
+def render() -> str:
+    """Metriche di tutti i processi nel formato testuale di Prometheus."""
+    flush(force=True)
+    counters, histograms = _merge(_read_snapshots())
+    lines: List[str] = []
+    for name, (kind, description, buckets) in DEFINITIONS.items():
+        if kind == "counter":
+            series = sorted((labels, value) for (metric, labels), value in counters.items() if metric == name)
+        else:
+            series = sorted((labels, value) for (metric, labels), value in histograms.items() if metric == name)
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in series:
+            if kind == "counter":
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+            cumulative = 0.0
+            for bound, count in zip(buckets + (math.inf,), value[:-1]):
+                cumulative += count
+                le = _format_value(bound) if math.isinf(bound) else repr(float(bound))
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', le))} {_format_value(cumulative)}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value[-1])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {_format_value(cumulative)}")
+    return "\n".join(lines) + "\n"
@@ -1,45 +1,22 @@
 from __future__ import annotations
 
-import json
 from datetime import datetime
 from typing import Any, Dict, List, Optional
 from uuid import uuid4
 
+from . import storage
 from .config import get_base_dir
 
 
 def init_social_data() -> None:
     base_dir = get_base_dir()
     base_dir.mkdir(parents=True, exist_ok=True)
-    for name in ("posts.json", "comments.json"):
-        path = base_dir / name
-        if not path.exists():
-            path.write_text("[]", encoding="utf-8")
+    for name in ("posts", "comments"):
+        storage.ensure_collection(name)
 
 
-def _path(name: str):
-    return get_base_dir() / name
-
-
-def _load_list(name: str) -> List[Dict[str, Any]]:
-    path = _path(name)
-    if not path.exists():
-        return []
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        if isinstance(data, list):
-            return data
-        return []
-    except Exception:
-        return []
-
-
-def _save_list(name: str, data: List[Dict[str, Any]]) -> None:
-    path = _path(name)
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+def _save_record(name: str, record: Dict[str, Any]) -> None:
+    storage.put(name, record)
 
 
 def _now_iso() -> str:
@@ -47,7 +24,6 @@ def _now_iso() -> str:
 
 
 def add_post(day_id: str, user_id: str, text: str) -> Dict[str, Any]:
-    posts = _load_list("posts.json")
     post = {
         "id": uuid4().hex,
         "day_id": day_id,
@@ -55,26 +31,21 @@ def add_post(day_id: str, user_id: str, text: str) -> Dict[str, Any]:
         "text": text,
         "created_at": _now_iso(),
     }
-    posts.append(post)
-    _save_list("posts.json", posts)
+    _save_record("posts", post)
     return post
 
 
 def get_post(post_id: str) -> Optional[Dict[str, Any]]:
-    for post in _load_list("posts.json"):
-        if post.get("id") == post_id:
-            return post
-    return None
+    return storage.get("posts", post_id)
 
 
 def list_posts(day_id: str) -> List[Dict[str, Any]]:
-    posts = [p for p in _load_list("posts.json") if p.get("day_id") == day_id]
+    posts = storage.find("posts", "day_id", day_id)
     posts.sort(key=lambda item: item.get("created_at", ""), reverse=True)
     return posts
 
 
 def add_comment(post_id: str, user_id: str, text: str) -> Dict[str, Any]:
-    comments = _load_list("comments.json")
     comment = {
         "id": uuid4().hex,
         "post_id": post_id,
@@ -82,12 +53,47 @@ def add_comment(post_id: str, user_id: str, text: str) -> Dict[str, Any]:
         "text": text,
         "created_at": _now_iso(),
     }
-    comments.append(comment)
-    _save_list("comments.json", comments)
+    _save_record("comments", comment)
     return comment
 
 
 def list_comments(post_id: str) -> List[Dict[str, Any]]:
-    comments = [c for c in _load_list("comments.json") if c.get("post_id") == post_id]
+    comments = storage.find("comments", "post_id", post_id)
     comments.sort(key=lambda item: item.get("created_at", ""))
     return comments
+
+
+def list_day_thread(day_id: str) -> List[Dict[str, Any]]:
+    """Post di una giornata con i commenti e i nomi degli autori.
+
+    I post sono dal più recente, i commenti di ogni post dal più vecchio;
+    ogni record ha in più ``author_name`` (``"Utente"`` se l'autore non
+    esiste) e ogni post la lista ``comments``. Post, commenti e autori
+    vengono cercati con una sola richiesta per collezione e uniti per
+    chiave.
+    """
+    posts = list_posts(day_id)
+    if not posts:
+        return []
+    comments_by_post: Dict[str, List[Dict[str, Any]]] = {}
+    for comment in storage.find_many("comments", "post_id", [post.get("id") for post in posts]):
+        comments_by_post.setdefault(comment.get("post_id"), []).append(comment)
+    user_ids = {post.get("user_id") for post in posts}
+    for comments in comments_by_post.values():
+        comments.sort(key=lambda item: item.get("created_at", ""))
+        user_ids.update(comment.get("user_id") for comment in comments)
+    user_ids.discard(None)
+    names = {user.get("id"): user.get("name") for user in storage.get_many("users", user_ids)}
+
+    def author_name(record: Dict[str, Any]) -> Optional[str]:
+        user_id = record.get("user_id")
+        return names[user_id] if user_id in names else "Utente"
+
+    thread = []
+    for post in posts:
+        comments = [
+            {**comment, "author_name": author_name(comment)}
+            for comment in comments_by_post.get(post.get("id"), [])
+        ]
+        thread.append({**post, "author_name": author_name(post), "comments": comments})
+    return thread
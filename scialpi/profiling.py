@@ -0,0 +1,157 @@
+"""Profili ``cProfile`` delle richieste web.
+
+Il server web profila le richieste degli utenti abilitati (vedi
+:mod:`scialpi_web.profiling`) e le salva con :func:`save_profile` nella
+directory ``profiles/`` dei dati. Ogni profilo è composto da questi file
+con lo stesso nome:
+
+* ``.prof``: le statistiche di :mod:`pstats`, leggibili con
+  ``python -m pstats`` o snakeviz;
+* ``.json``: metodo, percorso, endpoint, utente e durata della richiesta;
+* ``.folded``: gli stack nel formato "collassato" (``a;b;c 123``, tempo
+  in microsecondi) letto da ``flamegraph.pl``, speedscope e inferno.
+  Viene scritto da :func:`folded_path` solo quando serve, per esempio con
+  ``scialpi profiles NAME``, e non durante la richiesta profilata.
+
+``cProfile`` registra solo le coppie chiamante-chiamato, non gli stack
+completi: :func:`collapsed_stacks` ricostruisce gli stack dalle radici e
+divide il tempo di ogni funzione tra i chiamanti in proporzione al tempo
+speso per ciascuno, come fanno gli strumenti che convertono i file
+``.prof`` in flamegraph. Restano solo gli ultimi :data:`DEFAULT_PROFILE_KEEP`
+profili (``SCIALPI_PROFILE_KEEP``).
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import pstats
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from .config import get_base_dir, get_profile_keep
+
+PROFILES_DIRNAME = "profiles"
+# Profondità massima degli stack ricostruiti
+MAX_DEPTH = 64
+# Gli stack con meno di questo tempo, in secondi, vengono tralasciati
+MIN_SECONDS = 1e-6
+
+FuncKey = Tuple[str, int, str]
+
+
+def profiles_dir() -> Path:
+    return get_base_dir() / PROFILES_DIRNAME
+
+
+def _label(func: FuncKey) -> str:
+    filename, line, name = func
+    if filename == "~":
+        label = name
+    else:
+        label = f"{Path(filename).name}:{name}:{line}"
+    return label.replace(";", ",")
+
+
+def collapsed_stacks(stats: pstats.Stats) -> List[str]:
+    """Stack in formato collassato, uno per riga, con il tempo proprio in microsecondi."""
+    entries: Dict[FuncKey, Tuple[Any, ...]] = stats.stats  # type: ignore[attr-defined]
+    callees: Dict[FuncKey, List[Tuple[FuncKey, float]]] = {}
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    totals: Dict[Tuple[str, ...], float] = {}
+
+    def walk(func: FuncKey, path: Tuple[str, ...], seen: frozenset, share: float) -> None:
+        _, _, own, cumulative, _ = entries[func]
+        path = path + (_label(func),)
+        if own * share > 0:
+            totals[path] = totals.get(path, 0.0) + own * share
+        if len(path) >= MAX_DEPTH:
+            return
+        seen = seen | {func}
+        for callee, edge_cumulative in callees.get(func, ()):
+            callee_cumulative = entries[callee][3]
+            if callee in seen or callee_cumulative <= 0:
+                continue
+            callee_share = share * edge_cumulative / callee_cumulative
+            if callee_share * callee_cumulative >= MIN_SECONDS:
+                walk(callee, path, seen, min(callee_share, 1.0))
+
+    for func, entry in entries.items():
+        if not entry[4]:
+            walk(func, (), frozenset(), 1.0)
+    lines = []
+    for path, seconds in sorted(totals.items()):
+        micros = int(round(seconds * 1_000_000))
+        if micros > 0:
+            lines.append(f"{';'.join(path)} {micros}")
+    return lines
+
+
+def save_profile(stats: pstats.Stats, info: Dict[str, Any]) -> str:
+    """Salva un profilo con le informazioni ``info`` e restituisce il suo nome.
+
+    Dopo il salvataggio elimina i profili più vecchi oltre
+    ``SCIALPI_PROFILE_KEEP``.
+    """
+    directory = profiles_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    now = datetime.utcnow()
+    name = f"{now.strftime('%Y%m%dT%H%M%S%f')}-{uuid4().hex[:8]}"
+    stats.dump_stats(str(directory / f"{name}.prof"))
+    info = {"name": name, "created_at": now.isoformat() + "Z", **info}
+    (directory / f"{name}.json").write_text(json.dumps(info, ensure_ascii=False), encoding="utf-8")
+    _rotate(directory, get_profile_keep())
+    return name
+
+
+def _rotate(directory: Path, keep: int) -> None:
+    names = sorted({path.stem for path in directory.glob("*.json")})
+    for name in names[: max(len(names) - keep, 0)]:
+        for suffix in (".json", ".prof", ".folded"):
+            try:
+                (directory / f"{name}{suffix}").unlink()
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles(limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Informazioni dei profili salvati, dal più recente."""
+    directory = profiles_dir()
+    if not directory.is_dir():
+        return []
+    profiles = []
+    for path in sorted(directory.glob("*.json"), reverse=True)[:limit]:
+        try:
+            profiles.append(json.loads(path.read_text(encoding="utf-8")))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def load_stats(name: str) -> Optional[pstats.Stats]:
+    """Statistiche del profilo ``name``, o ``None`` se non esiste."""
+    path = profiles_dir() / f"{name}.prof"
+    if Path(name).name != name or not path.is_file():
+        return None
+    return pstats.Stats(str(path))
+
+
+def folded_path(name: str) -> Optional[Path]:
+    """File ``.folded`` del profilo ``name``, scritto la prima volta che serve.
+
+    Restituisce ``None`` se il profilo non esiste.
+    """
+    path = profiles_dir() / f"{name}.folded"
+    if Path(name).name == name and path.is_file():
+        return path
+    stats = load_stats(name)
+    if stats is None:
+        return None
+    tmp = path.with_name(f".{path.name}.{uuid4().hex[:8]}.tmp")
+    tmp.write_text("\n".join(collapsed_stacks(stats)) + "\n", encoding="utf-8")
+    os.replace(tmp, path)
+    return path
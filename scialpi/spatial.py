@@ -0,0 +1,216 @@
+"""Indice spaziale in memoria per percorsi e segnalazioni di valanghe.
+
+Ogni record viene ridotto a un rettangolo ``(min_lon, min_lat, max_lon,
+max_lat)``: per i percorsi il campo ``bbox`` della traccia, per le
+valanghe (e per i percorsi senza traccia) il punto ``lat``/``lon``. I
+rettangoli vengono distribuiti in una griglia uniforme di celle da
+:data:`CELL_DEGREES` gradi, così una ricerca per area guarda solo le celle
+che interseca.
+
+L'indice di una collezione viene costruito alla prima ricerca ed è legato
+alla versione della collezione (vedi :func:`scialpi.storage.version`): se
+un altro processo scrive, alla ricerca successiva viene ricostruito. Le
+scritture fatte tramite :func:`put` lo aggiornano invece sul posto.
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+
+from . import storage
+from .config import get_base_dir, get_storage_backend
+
+BBox = Tuple[float, float, float, float]
+
+# Lato delle celle della griglia in gradi (circa 5 km alle nostre latitudini)
+CELL_DEGREES = 0.05
+# Rettangoli che coprono più celle di così stanno in una lista a parte
+MAX_CELLS_PER_RECORD = 64
+
+_lock = threading.Lock()
+_indexes: Dict[Tuple[str, str, str], Tuple[int, "GridIndex"]] = {}
+
+
+def parse_bbox(value: str) -> BBox:
+    """Interpreta ``"min_lon,min_lat,max_lon,max_lat"``.
+
+    Raises
+    ------
+    ValueError
+        Se il valore non contiene quattro numeri validi.
+    """
+    parts = [part.strip() for part in value.split(",")]
+    if len(parts) != 4:
+        raise ValueError("bbox deve essere min_lon,min_lat,max_lon,max_lat")
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(part) for part in parts)
+    except ValueError:
+        raise ValueError("bbox deve contenere solo numeri") from None
+    if not all(math.isfinite(v) for v in (min_lon, min_lat, max_lon, max_lat)) or min_lat > max_lat:
+        raise ValueError("bbox non valido")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def track_bbox(track: List[List[float]]) -> Optional[List[float]]:
+    """Rettangolo ``[min_lon, min_lat, max_lon, max_lat]`` di una traccia ``[[lat, lon, ...], ...]``."""
+    lats = []
+    lons = []
+    for point in track:
+        try:
+            lats.append(float(point[0]))
+            lons.append(float(point[1]))
+        except (TypeError, ValueError, IndexError):
+            continue
+    if not lats:
+        return None
+    return [min(lons), min(lats), max(lons), max(lats)]
+
+
+def record_bbox(record: Dict[str, Any]) -> Optional[BBox]:
+    """Rettangolo di un record: il campo ``bbox`` se presente, altrimenti ``lat``/``lon``."""
+    bbox = record.get("bbox")
+    if isinstance(bbox, (list, tuple)) and len(bbox) == 4:
+        try:
+            min_lon, min_lat, max_lon, max_lat = (float(v) for v in bbox)
+        except (TypeError, ValueError):
+            pass
+        else:
+            return min_lon, min_lat, max_lon, max_lat
+    try:
+        lat = float(record.get("lat"))
+        lon = float(record.get("lon"))
+    except (TypeError, ValueError):
+        return None
+    if not (math.isfinite(lat) and math.isfinite(lon)):
+        return None
+    return lon, lat, lon, lat
+
+
+def _intersects(a: BBox, b: BBox) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class GridIndex:
+    """Griglia uniforme di celle che associa a ogni cella le chiavi dei record.
+
+    Le celle contengono ``frozenset`` sostituiti a ogni modifica: una ricerca
+    in corso in un altro thread non vede mai un insieme a metà.
+    """
+
+    def __init__(self, cell_degrees: float = CELL_DEGREES) -> None:
+        self.cell_degrees = cell_degrees
+        self.boxes: Dict[Any, BBox] = {}
+        self.cells: Dict[Tuple[int, int], FrozenSet[Any]] = {}
+        self.large: FrozenSet[Any] = frozenset()
+
+    def _cell_range(self, bbox: BBox) -> Tuple[int, int, int, int]:
+        size = self.cell_degrees
+        return (
+            math.floor(bbox[0] / size),
+            math.floor(bbox[1] / size),
+            math.floor(bbox[2] / size),
+            math.floor(bbox[3] / size),
+        )
+
+    def _cells(self, bbox: BBox) -> Optional[List[Tuple[int, int]]]:
+        x0, y0, x1, y1 = self._cell_range(bbox)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > MAX_CELLS_PER_RECORD:
+            return None
+        return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+    def insert(self, key: Any, bbox: Optional[BBox]) -> None:
+        self.remove(key)
+        if bbox is None:
+            return
+        self.boxes[key] = bbox
+        cells = self._cells(bbox)
+        if cells is None:
+            self.large = self.large | {key}
+            return
+        for cell in cells:
+            self.cells[cell] = self.cells.get(cell, frozenset()) | {key}
+
+    def remove(self, key: Any) -> None:
+        bbox = self.boxes.pop(key, None)
+        if bbox is None:
+            return
+        cells = self._cells(bbox)
+        if cells is None:
+            self.large = self.large - {key}
+            return
+        for cell in cells:
+            remaining = self.cells.get(cell, frozenset()) - {key}
+            if remaining:
+                self.cells[cell] = remaining
+            else:
+                self.cells.pop(cell, None)
+
+    def query(self, bbox: BBox) -> Set[Any]:
+        """Chiavi dei record il cui rettangolo interseca ``bbox``.
+
+        Un ``bbox`` con ``min_lon > max_lon`` attraversa l'antimeridiano.
+        """
+        if bbox[0] > bbox[2]:
+            return self.query((bbox[0], bbox[1], 180.0, bbox[3])) | self.query((-180.0, bbox[1], bbox[2], bbox[3]))
+        x0, y0, x1, y1 = self._cell_range(bbox)
+        candidates: Set[Any] = set(self.large)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.cells):
+            # Area più grande dell'indice: conviene scorrere le celle occupate.
+            for (x, y), keys in list(self.cells.items()):
+                if x0 <= x <= x1 and y0 <= y <= y1:
+                    candidates.update(keys)
+        else:
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    candidates.update(self.cells.get((x, y), ()))
+        boxes = self.boxes
+        return {key for key in candidates if key in boxes and _intersects(boxes[key], bbox)}
+
+
+def _index_key(name: str) -> Tuple[str, str, str]:
+    return (get_storage_backend(), str(get_base_dir()), name)
+
+
+def _index(name: str) -> GridIndex:
+    index_key = _index_key(name)
+    version = storage.version(name)
+    cached = _indexes.get(index_key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    index = GridIndex()
+    field = storage.key_field(name)
+    for record in storage.load(name):
+        key = record.get(field)
+        if key is not None:
+            index.insert(key, record_bbox(record))
+    with _lock:
+        _indexes[index_key] = (version, index)
+    return index
+
+
+def query(name: str, bbox: BBox) -> Set[Any]:
+    """Chiavi dei record di ``name`` che cadono, anche in parte, in ``bbox``."""
+    return _index(name).query(bbox)
+
+
+def put(name: str, record: Dict[str, Any]) -> Dict[str, Any]:
+    """Come :func:`scialpi.storage.put`, aggiornando anche l'indice spaziale."""
+    with storage.transaction():
+        before = storage.version(name)
+        storage.put(name, record)
+        after = storage.version(name)
+        index_key = _index_key(name)
+        with _lock:
+            cached = _indexes.get(index_key)
+            if cached is None:
+                return record
+            if cached[0] != before:
+                # L'indice era già indietro: verrà ricostruito alla prossima ricerca.
+                _indexes.pop(index_key, None)
+                return record
+            index = cached[1]
+            index.insert(record.get(storage.key_field(name)), record_bbox(record))
+            _indexes[index_key] = (after, index)
+    return record
@@ -0,0 +1,249 @@
+"""Backend SQLite per le collezioni di scialpi-log.
+
+Attivo quando ``SCIALPI_LOG_STORAGE=sqlite``. Ogni collezione è una
+tabella con la chiave primaria del record, alcune colonne indicizzate
+estratte dal record (per esempio ``days.route_id``) e il record completo
+serializzato in JSON nella colonna ``data``. Le scritture toccano solo la
+riga interessata e incrementano il contatore in ``collection_versions``,
+usato dalla cache di :mod:`scialpi.storage` per capire quando ricaricare.
+Le transazioni di :func:`scialpi.storage.transaction` diventano transazioni
+``BEGIN IMMEDIATE``, che fanno anche da lock tra processi.
+
+:func:`import_json` copia nel database i file JSON esistenti.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any, ContextManager, Dict, Iterable, List, Optional, Tuple
+
+from .locking import record_wait
+from .storage import COLLECTIONS, JsonBackend, key_field, record_load, record_save
+
+# Colonne estratte dai record e indicizzate, oltre alla chiave primaria
+INDEXED_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "days": ("route_id", "owner_id", "date"),
+    "posts": ("day_id",),
+    "comments": ("post_id",),
+    "day_photos": ("day_id",),
+    "memberships": ("user_id", "group_id"),
+    "friends": ("user_id",),
+    "users": ("email",),
+    "jobs": ("status",),
+}
+# Collezioni con chiave numerica
+INTEGER_KEYS = {"avalanches"}
+
+
+def _columns(name: str) -> Tuple[str, ...]:
+    return (key_field(name),) + INDEXED_COLUMNS.get(name, ()) + ("data",)
+
+
+def _schema(name: str) -> List[str]:
+    key = key_field(name)
+    key_type = "INTEGER" if name in INTEGER_KEYS else "TEXT"
+    columns = [f'"{key}" {key_type} PRIMARY KEY NOT NULL']
+    columns += [f'"{column}" TEXT' for column in INDEXED_COLUMNS.get(name, ())]
+    columns.append("data TEXT NOT NULL")
+    statements = [f'CREATE TABLE IF NOT EXISTS "{name}" ({", ".join(columns)})']
+    for column in INDEXED_COLUMNS.get(name, ()):
+        statements.append(f'CREATE INDEX IF NOT EXISTS "idx_{name}_{column}" ON "{name}" ("{column}")')
+    return statements
+
+
+def _row(name: str, record: Dict[str, Any]) -> Tuple[Any, ...]:
+    values: List[Any] = [record.get(key_field(name))]
+    for column in INDEXED_COLUMNS.get(name, ()):
+        value = record.get(column)
+        values.append(value if isinstance(value, (str, int, float)) else None)
+    values.append(json.dumps(record, ensure_ascii=False))
+    return tuple(values)
+
+
+class SqliteBackend:
+    """Collezioni salvate in un unico database SQLite."""
+
+    kind = "sqlite"
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.location = str(path)
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        # Una connessione aperta prima di un fork non va usata nel figlio.
+        if conn is not None and getattr(self._local, "pid", None) != os.getpid():
+            conn = None
+            self._local.depth = 0
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS collection_versions "
+                    "(name TEXT PRIMARY KEY NOT NULL, version INTEGER NOT NULL)"
+                )
+                for name in COLLECTIONS:
+                    for statement in _schema(name):
+                        conn.execute(statement)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _depth(self) -> int:
+        return getattr(self._local, "depth", 0)
+
+    def begin(self) -> None:
+        depth = self._depth()
+        if depth == 0:
+            conn = self._connection()
+            started = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            record_wait(time.perf_counter() - started, self.location)
+        self._local.depth = depth + 1
+
+    def commit(self) -> None:
+        self._local.depth = self._depth() - 1
+        if self._local.depth == 0:
+            self._connection().execute("COMMIT")
+
+    def rollback(self) -> None:
+        self._local.depth = self._depth() - 1
+        if self._local.depth == 0:
+            self._connection().execute("ROLLBACK")
+
+    def read_lock(self) -> ContextManager[None]:
+        # Le letture avvengono in una transazione: bastano a dare coerenza.
+        return nullcontext()
+
+    @staticmethod
+    def _version(conn: sqlite3.Connection, name: str) -> int:
+        row = conn.execute("SELECT version FROM collection_versions WHERE name = ?", (name,)).fetchone()
+        return int(row[0]) if row else 0
+
+    def signature(self, name: str) -> Optional[int]:
+        if name not in COLLECTIONS:
+            return None
+        return self._version(self._connection(), name)
+
+    def version(self, name: str) -> int:
+        return self.signature(name) or 0
+
+    def read(self, name: str) -> Tuple[Optional[int], List[Dict[str, Any]]]:
+        if name not in COLLECTIONS:
+            return None, []
+        started = time.perf_counter()
+        conn = self._connection()
+        # Versione e righe lette nella stessa transazione, quindi coerenti.
+        own = not conn.in_transaction
+        if own:
+            conn.execute("BEGIN")
+        try:
+            version = self._version(conn, name)
+            rows = conn.execute(f'SELECT data FROM "{name}" ORDER BY rowid').fetchall()
+        finally:
+            if own:
+                conn.execute("COMMIT")
+        records: List[Dict[str, Any]] = []
+        size = 0
+        for (data,) in rows:
+            size += len(data)
+            try:
+                records.append(json.loads(data))
+            except ValueError:
+                continue
+        record_load(name, size, time.perf_counter() - started)
+        return version, records
+
+    def ensure(self, name: str) -> None:
+        self._connection()
+
+    def _write(self, name: str, statements: Iterable[Tuple[str, Any]], size: int = 0) -> Tuple[int, int]:
+        started = time.perf_counter()
+        conn = self._connection()
+        own = not conn.in_transaction
+        if own:
+            conn.execute("BEGIN IMMEDIATE")
+        try:
+            before = self._version(conn, name)
+            for sql, params in statements:
+                if isinstance(params, list):
+                    conn.executemany(sql, params)
+                else:
+                    conn.execute(sql, params)
+            after = before + 1
+            conn.execute(
+                "INSERT INTO collection_versions (name, version) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET version = excluded.version",
+                (name, after),
+            )
+            if own:
+                conn.execute("COMMIT")
+        except BaseException:
+            if own:
+                conn.execute("ROLLBACK")
+            raise
+        record_save(name, size, time.perf_counter() - started)
+        return before, after
+
+    def _upsert_sql(self, name: str) -> str:
+        columns = _columns(name)
+        quoted = ", ".join(f'"{column}"' for column in columns)
+        placeholders = ", ".join("?" for _ in columns)
+        updates = ", ".join(f'"{column}" = excluded."{column}"' for column in columns[1:])
+        # ON CONFLICT ... DO UPDATE mantiene il rowid, quindi l'ordine di inserimento.
+        return (
+            f'INSERT INTO "{name}" ({quoted}) VALUES ({placeholders}) '
+            f'ON CONFLICT("{key_field(name)}") DO UPDATE SET {updates}'
+        )
+
+    def put(self, name: str, record: Dict[str, Any]) -> Tuple[int, int]:
+        row = _row(name, record)
+        return self._write(name, [(self._upsert_sql(name), row)], len(row[-1]))
+
+    def delete(self, name: str, key: Any) -> Tuple[int, int]:
+        return self._write(name, [(f'DELETE FROM "{name}" WHERE "{key_field(name)}" = ?', (key,))])
+
+    def write_all(self, name: str, records: List[Dict[str, Any]]) -> Tuple[int, int]:
+        rows = [_row(name, record) for record in records if record.get(key_field(name)) is not None]
+        return self._write(
+            name,
+            [(f'DELETE FROM "{name}"', ()), (self._upsert_sql(name), rows)],
+            sum(len(row[-1]) for row in rows),
+        )
+
+
+def import_json(base_dir: Path, database: Path) -> Dict[str, int]:
+    """Importa i file JSON di ``base_dir`` nel database ``database``.
+
+    Il contenuto di ogni collezione nel database viene sostituito da quello
+    del file corrispondente; i record senza chiave vengono ignorati.
+
+    Returns
+    -------
+    dict
+        Numero di record importati per collezione.
+    """
+    source = JsonBackend(base_dir)
+    target = SqliteBackend(database)
+    counts: Dict[str, int] = {}
+    for name in COLLECTIONS:
+        _, records = source.read(name)
+        records = [record for record in records if record.get(key_field(name)) is not None]
+        target.write_all(name, records)
+        counts[name] = len(records)
+    return counts
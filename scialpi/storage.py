@@ -0,0 +1,841 @@
+"""Accesso condiviso alle collezioni di dati.
+
+Tutti i manager (percorsi, giornate, utenti, post, foto e valanghe)
+leggono e scrivono i propri dati tramite questo modulo. Ogni collezione
+viene tenuta in memoria già decodificata e rivalidata tramite una firma
+fornita dal backend: per i file JSON inode, dimensione e mtime, per SQLite
+un contatore di versione. Finché la firma non cambia una lettura costa un
+controllo e una ricerca in un dizionario; se un altro processo modifica i
+dati la collezione viene ricaricata alla lettura successiva.
+
+Il backend si sceglie con la variabile ``SCIALPI_LOG_STORAGE`` (vedi
+:mod:`scialpi.config`). Le scritture avvengono per singolo record tramite
+:func:`put` e :func:`delete`: il backend JSON le accoda a un journal, quello
+SQLite aggiorna una riga. :func:`save` sostituisce l'intera collezione ed è
+usata solo per importazioni e manutenzione.
+
+Più processi possono lavorare sugli stessi dati: ogni scrittura, e ogni
+ciclo lettura-modifica-scrittura racchiuso in :func:`transaction`, avviene
+sotto un lock esclusivo tra processi (``flock`` su ``.lock`` per JSON,
+``BEGIN IMMEDIATE`` per SQLite).
+
+Oltre alla lista dei record la cache mantiene un indice per chiave primaria
+e gli indici dei campi elencati in :data:`INDEXES` (per esempio le giornate
+per ``route_id``): :func:`get` e :func:`find` li usano per trovare i record
+senza scorrere la collezione.
+
+Le liste restituite da :func:`load` sono condivise tra tutte le chiamate
+e non devono essere modificate, così come i record che contengono: per
+aggiornare un record se ne modifica una copia e la si passa a :func:`put`.
+
+:func:`track_accesses` conta gli accessi a ogni collezione fatti da un
+thread, per esempio durante una richiesta web, e segnala i cicli che
+leggono un record alla volta.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+import threading
+import time
+import traceback
+from bisect import bisect_left, insort
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple, Union
+
+from . import metrics
+from .config import SQLITE_FILENAME, get_base_dir, get_storage_backend
+from .locking import DirLock
+
+# Collezioni note e campo usato come chiave primaria di ciascuna
+COLLECTIONS: Dict[str, str] = {
+    "routes": "id",
+    "days": "id",
+    "users": "id",
+    "groups": "id",
+    "memberships": "id",
+    "invites": "id",
+    "friends": "id",
+    "reset_tokens": "token",
+    "posts": "id",
+    "comments": "id",
+    "day_photos": "id",
+    "avalanches": "id",
+    "jobs": "id",
+    "blobs": "id",
+}
+
+# Campi indicizzati in memoria, oltre alla chiave primaria
+INDEXES: Dict[str, Tuple[str, ...]] = {
+    "days": ("route_id", "owner_id"),
+    "posts": ("day_id",),
+    "comments": ("post_id",),
+    "day_photos": ("day_id",),
+    "memberships": ("user_id",),
+    "friends": ("user_id",),
+    "users": ("email",),
+    "jobs": ("status",),
+}
+
+Signature = Hashable
+# Valore di ordinamento di un record per :func:`ordered`
+SortValue = Callable[[Dict[str, Any]], str]
+
+_lock = threading.Lock()
+_cache: Dict[Tuple[str, str], "Collection"] = {}
+_backends: Dict[Tuple[str, Path], Any] = {}
+# AccessLog attivo nel thread, vedi :func:`track_accesses`
+_tracking = threading.local()
+# Frame riportati nello stack di una collezione oltre il limite di accessi
+STACK_DEPTH = 8
+_SOURCE_ROOT = str(Path(__file__).resolve().parent.parent)
+
+
+def key_field(name: str) -> str:
+    """Restituisce il campo chiave della collezione ``name``."""
+    return COLLECTIONS.get(name, "id")
+
+
+def _fsync_dir(path: Path) -> None:
+    # Rende persistente la rinomina; non tutti i sistemi permettono di
+    # aprire una directory, in quel caso ci si affida al filesystem.
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path: Path, content: Union[str, bytes]) -> None:
+    """Scrive ``content`` in ``path`` tramite file temporaneo, fsync e ``os.replace``."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = content.encode("utf-8") if isinstance(content, str) else content
+    fd, tmp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_name, 0o644)
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+    _fsync_dir(path.parent)
+
+
+def record_load(name: str, size: int, seconds: float) -> None:
+    """Registra nelle metriche la lettura di una collezione dal disco."""
+    metrics.inc("scialpi_storage_loads_total", collection=name)
+    metrics.inc("scialpi_storage_load_bytes_total", size, collection=name)
+    metrics.inc("scialpi_storage_load_seconds_total", seconds, collection=name)
+
+
+def record_save(name: str, size: int, seconds: float) -> None:
+    """Registra nelle metriche una scrittura su una collezione."""
+    metrics.inc("scialpi_storage_saves_total", collection=name)
+    metrics.inc("scialpi_storage_save_bytes_total", size, collection=name)
+    metrics.inc("scialpi_storage_save_seconds_total", seconds, collection=name)
+
+
+def _journal_line(entry: Dict[str, Any]) -> str:
+    return json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+class JsonBackend:
+    """Collezioni salvate come snapshot ``<nome>.json`` più journal.
+
+    Lo snapshot è la lista completa dei record, nello stesso formato di
+    sempre. Le modifiche vengono aggiunte in coda a ``<nome>.journal``, una
+    riga JSON per operazione (``put`` con il record completo oppure ``del``
+    con la chiave), con fsync a ogni scrittura: il costo di una modifica
+    dipende dal record e non dalla dimensione della collezione.
+
+    In lettura il journal viene riapplicato sullo snapshot. Quando supera
+    :attr:`compact_bytes` viene compattato: si riscrive lo snapshot e il
+    journal riparte da una sola riga ``base``. Entrambi i file vengono
+    sostituiti con ``os.replace``; le operazioni sono idempotenti, quindi
+    un'interruzione tra le due sostituzioni non altera i dati. Ogni riga ha
+    un numero di sequenza crescente, che fa da versione della collezione.
+
+    Le scritture avvengono sotto il lock esclusivo di :class:`DirLock`, le
+    letture dal disco sotto quello condiviso, così nessun processo vede un
+    file a metà di una compattazione.
+    """
+
+    kind = "json"
+    compact_bytes = 1024 * 1024
+
+    def __init__(self, base_dir: Path) -> None:
+        self.base_dir = base_dir
+        self.location = str(base_dir)
+        self.lock = DirLock(base_dir)
+        self._versions: Dict[str, Tuple[Optional[Tuple[int, int, int, int]], int]] = {}
+
+    def path(self, name: str) -> Path:
+        return self.base_dir / f"{name}.json"
+
+    def begin(self) -> None:
+        self.lock.acquire()
+
+    def commit(self) -> None:
+        self.lock.release()
+
+    def rollback(self) -> None:
+        # Le righe già accodate restano valide: non c'è nulla da annullare.
+        self.lock.release()
+
+    @contextmanager
+    def read_lock(self) -> Iterator[None]:
+        self.lock.acquire(shared=True)
+        try:
+            yield
+        finally:
+            self.lock.release()
+
+    def journal_path(self, name: str) -> Path:
+        return self.base_dir / f"{name}.journal"
+
+    @staticmethod
+    def _stat(st: Optional[os.stat_result]) -> Optional[Tuple[int, int, int, int]]:
+        if st is None:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+
+    @staticmethod
+    def _try_stat(path: Path) -> Optional[os.stat_result]:
+        try:
+            return os.stat(path)
+        except FileNotFoundError:
+            return None
+
+    def signature(self, name: str) -> Optional[Signature]:
+        snapshot = self._try_stat(self.path(name))
+        journal = self._try_stat(self.journal_path(name))
+        if snapshot is None and journal is None:
+            return None
+        return (self._stat(snapshot), self._stat(journal))
+
+    def version(self, name: str) -> int:
+        """Numero di sequenza dell'ultima operazione sulla collezione.
+
+        Cresce a ogni scrittura e resta invariato nelle compattazioni; viene
+        riletto dal journal solo quando il file cambia.
+        """
+        path = self.journal_path(name)
+        st = self._stat(self._try_stat(path))
+        cached = self._versions.get(name)
+        if cached is not None and cached[0] == st:
+            return cached[1]
+        seq = self.last_seq(path) if st is not None else 0
+        self._versions[name] = (st, seq)
+        return seq
+
+    def _read_snapshot(self, name: str) -> Tuple[Optional[os.stat_result], List[Dict[str, Any]]]:
+        # La firma viene presa dal descrittore aperto: descrive esattamente il
+        # contenuto letto anche se nel frattempo il file viene sostituito.
+        try:
+            with open(self.path(name), "r", encoding="utf-8") as f:
+                st = os.fstat(f.fileno())
+                try:
+                    data = json.load(f)
+                except ValueError:
+                    return st, []
+        except OSError:
+            return None, []
+        if not isinstance(data, list):
+            return st, []
+        return st, data
+
+    def _read_journal(self, name: str) -> Tuple[Optional[os.stat_result], List[Dict[str, Any]]]:
+        try:
+            with open(self.journal_path(name), "rb") as f:
+                st = os.fstat(f.fileno())
+                raw = f.read()
+        except OSError:
+            return None, []
+        entries: List[Dict[str, Any]] = []
+        for line in raw.split(b"\n"):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Riga troncata da un'interruzione durante la scrittura.
+                continue
+            if isinstance(entry, dict):
+                entries.append(entry)
+        return st, entries
+
+    def read(self, name: str) -> Tuple[Optional[Signature], List[Dict[str, Any]]]:
+        started = time.perf_counter()
+        snapshot_st, records = self._read_snapshot(name)
+        journal_st, entries = self._read_journal(name)
+        if snapshot_st is None and journal_st is None:
+            return None, []
+        if entries:
+            records = self._replay(name, records, entries)
+        size = sum(st.st_size for st in (snapshot_st, journal_st) if st is not None)
+        record_load(name, size, time.perf_counter() - started)
+        return (self._stat(snapshot_st), self._stat(journal_st)), records
+
+    @staticmethod
+    def _replay(name: str, records: List[Dict[str, Any]], entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        field = key_field(name)
+        records = list(records)
+        positions = {record.get(field): index for index, record in enumerate(records)}
+        deleted = False
+        for entry in entries:
+            op = entry.get("op")
+            if op == "put":
+                record = entry.get("record")
+                if not isinstance(record, dict):
+                    continue
+                key = record.get(field)
+                index = positions.get(key)
+                if index is None or records[index] is None:
+                    positions[key] = len(records)
+                    records.append(record)
+                else:
+                    records[index] = record
+            elif op == "del":
+                index = positions.pop(entry.get("key"), None)
+                if index is not None:
+                    records[index] = None
+                    deleted = True
+        if deleted:
+            records = [record for record in records if record is not None]
+        return records
+
+    @staticmethod
+    def last_seq(path: Path) -> int:
+        """Numero di sequenza dell'ultima riga completa del journal."""
+        try:
+            with open(path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                end = f.tell()
+                block = 4096
+                tail = b""
+                position = end
+                while position > 0:
+                    step = min(block, position)
+                    position -= step
+                    f.seek(position)
+                    tail = f.read(step) + tail
+                    lines = [line for line in tail.split(b"\n") if line.strip()]
+                    # La prima riga del blocco può essere incompleta: serve
+                    # almeno una riga preceduta da un ritorno a capo.
+                    for line in reversed(lines if position == 0 else lines[1:]):
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            continue
+                        if isinstance(entry, dict):
+                            return int(entry.get("seq") or 0)
+                    block *= 2
+        except OSError:
+            pass
+        return 0
+
+    def ensure(self, name: str) -> None:
+        if not self.path(name).exists():
+            atomic_write(self.path(name), "[]")
+
+    def _append(self, name: str, entry: Dict[str, Any]):
+        started = time.perf_counter()
+        before = self.signature(name)
+        path = self.journal_path(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        entry = {"seq": self.last_seq(path) + 1, **entry}
+        line = _journal_line(entry).encode("utf-8")
+        with open(path, "ab+") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size:
+                f.seek(size - 1)
+                if f.read(1) != b"\n":
+                    # Chiude una riga rimasta a metà, altrimenti la nuova andrebbe persa.
+                    line = b"\n" + line
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+            size += len(line)
+        if size > self.compact_bytes:
+            # Si rilegge dal disco: la lista in memoria potrebbe non includere
+            # le scritture di altri processi.
+            self._compact(name, self.read(name)[1], entry["seq"])
+        record_save(name, len(line), time.perf_counter() - started)
+        return before, self.signature(name)
+
+    def _compact(self, name: str, records: List[Dict[str, Any]], seq: int) -> int:
+        data = json.dumps(records, indent=2, ensure_ascii=False).encode("utf-8")
+        atomic_write(self.path(name), data)
+        atomic_write(self.journal_path(name), _journal_line({"seq": seq, "op": "base"}))
+        return len(data)
+
+    def compact(self, name: str) -> None:
+        """Riporta il journal di ``name`` dentro lo snapshot."""
+        _, records = self.read(name)
+        self._compact(name, records, self.last_seq(self.journal_path(name)))
+
+    def write_all(self, name: str, records: List[Dict[str, Any]]):
+        """Sostituisce l'intera collezione riscrivendo lo snapshot."""
+        started = time.perf_counter()
+        before = self.signature(name)
+        size = self._compact(name, records, self.last_seq(self.journal_path(name)) + 1)
+        record_save(name, size, time.perf_counter() - started)
+        return before, self.signature(name)
+
+    def put(self, name: str, record: Dict[str, Any]):
+        return self._append(name, {"op": "put", "record": record})
+
+    def delete(self, name: str, key: Any):
+        return self._append(name, {"op": "del", "key": key})
+
+
+def _backend():
+    kind = get_storage_backend()
+    base_dir = get_base_dir()
+    backend = _backends.get((kind, base_dir))
+    if backend is None:
+        if kind == "sqlite":
+            from .sqlite_backend import SqliteBackend
+
+            backend = SqliteBackend(base_dir / SQLITE_FILENAME)
+        else:
+            backend = JsonBackend(base_dir)
+        with _lock:
+            backend = _backends.setdefault((kind, base_dir), backend)
+    return backend
+
+
+def _cache_key(backend, name: str) -> Tuple[str, str]:
+    return (f"{backend.kind}:{backend.location}", name)
+
+
+class Collection:
+    """Una collezione in cache con i suoi indici.
+
+    ``records`` mantiene l'ordine di salvataggio. ``positions`` associa la
+    chiave primaria alla posizione del record, ``indexes`` associa il valore
+    di ogni campo di :data:`INDEXES` alle posizioni dei record che lo hanno,
+    in ordine crescente. Gli indici vengono aggiornati a ogni :func:`put`,
+    senza ricostruirli; una cancellazione sposta le posizioni e li
+    ricostruisce da capo.
+    """
+
+    def __init__(self, name: str, signature: Signature, records: List[Dict[str, Any]]) -> None:
+        self.field = key_field(name)
+        self.fields = INDEXES.get(name, ())
+        self.signature = signature
+        self.records = records
+        self._build()
+
+    def _build(self) -> None:
+        self._ordered: Dict[Tuple[str, Optional[SortValue]], Tuple[List[Tuple[str, Any]], List[Dict[str, Any]]]] = {}
+        self.positions: Dict[Any, int] = {}
+        self.indexes: Dict[str, Dict[Any, List[int]]] = {field: {} for field in self.fields}
+        for position, record in enumerate(self.records):
+            key = record.get(self.field)
+            if key is not None:
+                self.positions[key] = position
+            self._add(position, record)
+
+    def _add(self, position: int, record: Dict[str, Any]) -> None:
+        for field in self.fields:
+            value = record.get(field)
+            if isinstance(value, Hashable) and value is not None:
+                bucket = self.indexes[field].setdefault(value, [])
+                insort(bucket, position)
+
+    def _remove(self, position: int, record: Dict[str, Any]) -> None:
+        for field in self.fields:
+            value = record.get(field)
+            if not isinstance(value, Hashable) or value is None:
+                continue
+            bucket = self.indexes[field].get(value)
+            if not bucket:
+                continue
+            index = bisect_left(bucket, position)
+            if index < len(bucket) and bucket[index] == position:
+                del bucket[index]
+            if not bucket:
+                del self.indexes[field][value]
+
+    def get(self, key: Any) -> Optional[Dict[str, Any]]:
+        position = self.positions.get(key)
+        return None if position is None else self.records[position]
+
+    def find(self, field: str, value: Any) -> List[Dict[str, Any]]:
+        return [self.records[position] for position in self.indexes[field].get(value, ())]
+
+    def ordered(self, field: str, key: Optional[SortValue] = None) -> Tuple[List[Tuple[str, Any]], List[Dict[str, Any]]]:
+        view = self._ordered.get((field, key))
+        if view is None:
+            pairs = [
+                (order_key(self.field, field, record, key), record)
+                for record in self.records
+                if record.get(self.field) is not None
+            ]
+            pairs.sort(key=lambda pair: pair[0])
+            view = ([item for item, _ in pairs], [record for _, record in pairs])
+            self._ordered[(field, key)] = view
+        return view
+
+    def put(self, record: Dict[str, Any]) -> None:
+        # Un nuovo dizionario: chi sta scorrendo un ordinamento precedente
+        # continua a vedere liste coerenti.
+        self._ordered = {}
+        key = record.get(self.field)
+        position = self.positions.get(key) if key is not None else None
+        if position is None:
+            position = len(self.records)
+            self.records.append(record)
+            if key is not None:
+                self.positions[key] = position
+        else:
+            self._remove(position, self.records[position])
+            self.records[position] = record
+        self._add(position, record)
+
+    def delete(self, key: Any) -> None:
+        position = self.positions.get(key)
+        if position is None:
+            return
+        del self.records[position]
+        self._build()
+
+
+def order_key(key_name: str, field: str, record: Dict[str, Any], key: Optional[SortValue] = None) -> Tuple[str, Any]:
+    """Chiave di ordinamento ``(valore di field, chiave primaria)`` usata da :func:`ordered`.
+
+    Il valore è ``key(record)`` se ``key`` è indicato, altrimenti il campo
+    ``field`` come stringa; un campo mancante vale ``""`` e va per primo.
+    """
+    if key is not None:
+        return (key(record), record.get(key_name))
+    value = record.get(field)
+    return ("" if value is None else str(value), record.get(key_name))
+
+
+def _caller_stack() -> List[str]:
+    frames = [
+        frame
+        for frame in traceback.extract_stack()
+        if frame.filename.startswith(_SOURCE_ROOT) and frame.filename != __file__
+    ]
+    return [f"{Path(frame.filename).name}:{frame.lineno} in {frame.name}" for frame in frames[-STACK_DEPTH:]]
+
+
+class AccessLog:
+    """Accessi alle collezioni registrati da :func:`track_accesses`.
+
+    ``counts`` conta per collezione le chiamate a questo modulo (:func:`get`,
+    :func:`find`, :func:`load`, :func:`put`, ...), ``loads`` quante di
+    queste hanno dovuto rileggere la collezione dal backend. La prima
+    chiamata che porta una collezione oltre ``budget`` accessi salva in
+    ``stacks`` i frame del codice dell'applicazione che l'hanno fatta: di
+    solito è il ciclo che chiama :func:`get` per ogni elemento di una lista.
+    """
+
+    def __init__(self, budget: int = 0) -> None:
+        self.budget = budget
+        self.counts: Dict[str, int] = {}
+        self.loads: Dict[str, int] = {}
+        self.stacks: Dict[str, List[str]] = {}
+
+    def record(self, name: str) -> None:
+        count = self.counts[name] = self.counts.get(name, 0) + 1
+        if self.budget and count == self.budget + 1:
+            self.stacks[name] = _caller_stack()
+
+    def over_budget(self) -> Dict[str, int]:
+        """Collezioni con più di ``budget`` accessi e relativo conteggio."""
+        if not self.budget:
+            return {}
+        return {name: count for name, count in self.counts.items() if count > self.budget}
+
+    def summary(self) -> str:
+        """Conteggi come ``users=41, days=3``, dal più alto."""
+        items = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))
+        return ", ".join(f"{name}={count}" for name, count in items)
+
+
+@contextmanager
+def track_accesses(budget: int = 0) -> Iterator[AccessLog]:
+    """Conta gli accessi alle collezioni fatti dal thread dentro il blocco ``with``.
+
+    Serve a trovare le viste che leggono una collezione record per record
+    invece di usare :func:`get_many` o :func:`find_many`. ``budget`` è il
+    numero di accessi per collezione oltre il quale viene salvato lo stack
+    del chiamante; ``0`` non pone limiti. I blocchi si possono annidare:
+    conta solo quello più interno.
+    """
+    previous = getattr(_tracking, "log", None)
+    log = _tracking.log = AccessLog(budget)
+    try:
+        yield log
+    finally:
+        _tracking.log = previous
+
+
+def _collection(backend, name: str) -> Optional[Collection]:
+    log = getattr(_tracking, "log", None)
+    if log is not None:
+        log.record(name)
+    signature = backend.signature(name)
+    if signature is None:
+        return None
+    cache_key = _cache_key(backend, name)
+    cached = _cache.get(cache_key)
+    if cached is not None and cached.signature == signature:
+        metrics.inc("scialpi_storage_cache_hits_total", collection=name)
+        return cached
+    if log is not None:
+        log.loads[name] = log.loads.get(name, 0) + 1
+    with backend.read_lock():
+        read_signature, data = backend.read(name)
+    if read_signature is None:
+        return None
+    collection = Collection(name, read_signature, data)
+    with _lock:
+        _cache[cache_key] = collection
+    return collection
+
+
+def load(name: str) -> List[Dict[str, Any]]:
+    """Restituisce la collezione ``name`` usando la cache in memoria.
+
+    La lista restituita è condivisa: va trattata in sola lettura. Le
+    scritture di questo processo la aggiornano sul posto.
+    """
+    collection = _collection(_backend(), name)
+    return collection.records if collection is not None else []
+
+
+def get(name: str, key: Any) -> Optional[Dict[str, Any]]:
+    """Restituisce il record di ``name`` con chiave ``key``, o ``None``."""
+    if key is None:
+        return None
+    collection = _collection(_backend(), name)
+    return collection.get(key) if collection is not None else None
+
+
+def get_many(name: str, keys: Iterable[Any]) -> List[Dict[str, Any]]:
+    """Restituisce i record di ``name`` con le chiavi ``keys`` nell'ordine della collezione.
+
+    Le chiavi che non esistono vengono ignorate.
+    """
+    collection = _collection(_backend(), name)
+    if collection is None:
+        return []
+    positions = sorted({collection.positions[key] for key in keys if key in collection.positions})
+    return [collection.records[position] for position in positions]
+
+
+def find(name: str, field: str, value: Any) -> List[Dict[str, Any]]:
+    """Restituisce i record di ``name`` con ``field`` uguale a ``value``.
+
+    ``field`` deve essere uno dei campi di :data:`INDEXES` per ``name``. I
+    record seguono l'ordine della collezione.
+    """
+    if field not in INDEXES.get(name, ()):
+        raise KeyError(f"{name}.{field} non è indicizzato")
+    collection = _collection(_backend(), name)
+    return collection.find(field, value) if collection is not None else []
+
+
+def find_many(name: str, field: str, values: Iterable[Any]) -> List[Dict[str, Any]]:
+    """Come :func:`find` per più valori, mantenendo l'ordine della collezione."""
+    if field not in INDEXES.get(name, ()):
+        raise KeyError(f"{name}.{field} non è indicizzato")
+    collection = _collection(_backend(), name)
+    if collection is None:
+        return []
+    index = collection.indexes[field]
+    positions = sorted({p for value in set(values) for p in index.get(value, ())})
+    return [collection.records[position] for position in positions]
+
+
+def ordered(
+    name: str, field: str, key: Optional[SortValue] = None
+) -> Tuple[List[Tuple[str, Any]], List[Dict[str, Any]]]:
+    """Restituisce i record di ``name`` ordinati per ``field`` e poi per chiave.
+
+    Il risultato è la coppia ``(chiavi, record)``: ``chiavi[i]`` è
+    :func:`order_key` di ``record[i]`` e le chiavi sono crescenti, quindi si
+    può cercare una posizione con :mod:`bisect`. ``key`` calcola il valore
+    da ordinare quando il campo grezzo non si ordina come stringa, per
+    esempio le date salvate in formati diversi; deve restituire una
+    stringa e va passata sempre la stessa funzione, perché l'ordinamento
+    viene memorizzato per ``(field, key)``. L'ordinamento viene calcolato
+    una volta e riusato finché la collezione non cambia; le due liste sono
+    condivise e vanno trattate in sola lettura.
+    """
+    collection = _collection(_backend(), name)
+    if collection is None:
+        return [], []
+    return collection.ordered(field, key)
+
+
+def page(
+    name: str,
+    field: str,
+    limit: int,
+    after: Optional[Tuple[str, Any]] = None,
+    accept: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    key: Optional[SortValue] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[Tuple[str, Any]]]:
+    """Restituisce una pagina di ``name`` in ordine decrescente di ``field``.
+
+    La paginazione è per chiave: ``after`` è la chiave (vedi
+    :func:`order_key`) dell'ultimo record della pagina precedente e la
+    pagina parte dal record immediatamente più vecchio, quindi gli
+    inserimenti concorrenti non spostano i risultati e il costo non dipende
+    dalla profondità. ``accept`` scarta i record che non rispettano i
+    filtri; ``key`` è il valore di ordinamento, come in :func:`ordered`.
+
+    Returns
+    -------
+    tuple
+        I record della pagina e la chiave da passare come ``after`` per la
+        pagina successiva, ``None`` se i record sono finiti.
+    """
+    keys, records = ordered(name, field, key)
+    if after is None:
+        index = len(keys)
+    else:
+        try:
+            index = bisect_left(keys, tuple(after))
+        except TypeError:
+            raise ValueError("Chiave di paginazione non valida") from None
+    items: List[Dict[str, Any]] = []
+    while index > 0 and len(items) < limit:
+        index -= 1
+        if accept is None or accept(records[index]):
+            items.append(records[index])
+    if len(items) < limit or index == 0:
+        return items, None
+    return items, keys[index]
+
+
+def version(name: str) -> int:
+    """Versione della collezione ``name``: un intero che cresce a ogni scrittura.
+
+    Con JSON è il numero di sequenza del journal, con SQLite il contatore
+    di ``collection_versions``. Serve a capire se una collezione è cambiata
+    senza leggerla, per esempio per gli ETag delle API.
+    """
+    return _backend().version(name)
+
+
+def _store(backend, name: str, collection: Optional[Collection], result, apply) -> None:
+    before, after = result
+    cache_key = _cache_key(backend, name)
+    with _lock:
+        # Se qualcun altro ha scritto dopo la nostra ultima lettura la
+        # collezione in memoria non è completa: meglio ricaricarla.
+        if after is None or collection is None or before != collection.signature:
+            _cache.pop(cache_key, None)
+        else:
+            apply(collection)
+            collection.signature = after
+            _cache[cache_key] = collection
+
+
+@contextmanager
+def transaction() -> Iterator[None]:
+    """Esegue il blocco ``with`` sotto il lock esclusivo dei dati.
+
+    Serve per i cicli lettura-modifica-scrittura, anche su più collezioni:
+    le letture fatte dentro la transazione vedono le ultime scritture di
+    tutti i processi e nessun altro processo può scrivere finché il blocco
+    non termina. Le transazioni si possono annidare. Con SQLite un errore
+    annulla tutte le scritture del blocco; con JSON quelle già accodate
+    restano.
+    """
+    backend = _backend()
+    backend.begin()
+    try:
+        yield
+    except BaseException:
+        backend.rollback()
+        if backend.kind == "sqlite":
+            prefix = _cache_key(backend, "")[0]
+            with _lock:
+                for cache_key in [k for k in _cache if k[0] == prefix]:
+                    _cache.pop(cache_key, None)
+        raise
+    backend.commit()
+
+
+def put(name: str, record: Dict[str, Any]) -> Dict[str, Any]:
+    """Inserisce ``record`` o sostituisce quello con la stessa chiave."""
+    backend = _backend()
+    with transaction():
+        collection = _collection(backend, name)
+        result = backend.put(name, record)
+        _store(backend, name, collection, result, lambda c: c.put(record))
+    return record
+
+
+def delete(name: str, key: Any) -> bool:
+    """Elimina il record con chiave ``key``; ``False`` se non esiste."""
+    backend = _backend()
+    with transaction():
+        collection = _collection(backend, name)
+        if collection is None or collection.get(key) is None:
+            return False
+        result = backend.delete(name, key)
+        _store(backend, name, collection, result, lambda c: c.delete(key))
+    return True
+
+
+def save(name: str, records: List[Dict[str, Any]]) -> None:
+    """Sostituisce l'intera collezione ``name`` e aggiorna la cache."""
+    backend = _backend()
+    records = list(records)
+    with transaction():
+        result = backend.write_all(name, records)
+        with _lock:
+            _cache[_cache_key(backend, name)] = Collection(name, result[1], records)
+
+
+def ensure_collection(name: str) -> None:
+    """Crea la collezione vuota se non esiste ancora."""
+    with transaction():
+        _backend().ensure(name)
+
+
+def compact(name: Optional[str] = None) -> None:
+    """Compatta il journal di una collezione, o di tutte se ``name`` è ``None``.
+
+    Ha effetto solo sul backend JSON; SQLite gestisce da sé i propri file.
+    """
+    backend = _backend()
+    if not hasattr(backend, "compact"):
+        return
+    with transaction():
+        for item in [name] if name else list(COLLECTIONS):
+            backend.compact(item)
+    invalidate(name)
+
+
+def invalidate(name: Optional[str] = None) -> None:
+    """Svuota la cache di una collezione, o di tutte se ``name`` è ``None``."""
+    with _lock:
+        if name is None:
+            _cache.clear()
+        else:
+            for cache_key in [k for k in _cache if k[1] == name]:
+                _cache.pop(cache_key, None)
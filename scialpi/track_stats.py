@@ -0,0 +1,216 @@
+"""Statistiche di tracce e attività GPS.
+
+Un unico motore calcola distanza, dislivello positivo e negativo, durata,
+tempo in salita e in discesa a partire da array impaccati di coordinate,
+quote e istanti (vedi :class:`TrackArrays`). Se NumPy è installato
+(extra ``fast``) i calcoli sono vettoriali; altrimenti si usa un ciclo
+in Python puro che converte ogni coordinata in radianti una sola volta.
+
+Le quote e gli istanti mancanti sono NaN: i segmenti con una quota
+mancante non contano per il dislivello, quelli senza istante o con istante
+non crescente non contano per i tempi.
+"""
+
+from __future__ import annotations
+
+import math
+from array import array
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    np = None  # type: ignore[assignment]
+
+EARTH_RADIUS_M = 6371000.0
+NAN = math.nan
+
+
+class TrackArrays:
+    """Punti di una traccia in array paralleli di ``float``.
+
+    ``lat`` e ``lon`` in gradi, ``ele`` in metri, ``time`` in secondi
+    dall'epoch UTC; i valori mancanti sono NaN.
+    """
+
+    __slots__ = ("lat", "lon", "ele", "time")
+
+    def __init__(self) -> None:
+        self.lat = array("d")
+        self.lon = array("d")
+        self.ele = array("d")
+        self.time = array("d")
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    def append(self, lat: float, lon: float, ele: Optional[float] = None, time: Optional[float] = None) -> None:
+        self.lat.append(lat)
+        self.lon.append(lon)
+        self.ele.append(NAN if ele is None else ele)
+        self.time.append(NAN if time is None else time)
+
+    def extend(self, other: "TrackArrays") -> None:
+        """Accoda i punti di ``other``."""
+        self.lat.extend(other.lat)
+        self.lon.extend(other.lon)
+        self.ele.extend(other.ele)
+        self.time.extend(other.time)
+
+    @classmethod
+    def from_track(cls, track: Iterable[List[Any]]) -> "TrackArrays":
+        """Costruisce gli array da una traccia ``[[lat, lon, ele?], ...]``."""
+        arrays = cls()
+        for point in track:
+            try:
+                lat = float(point[0])
+                lon = float(point[1])
+            except (TypeError, ValueError, IndexError):
+                continue
+            ele = None
+            if len(point) > 2 and point[2] is not None:
+                try:
+                    ele = float(point[2])
+                except (TypeError, ValueError):
+                    ele = None
+            arrays.append(lat, lon, ele)
+        return arrays
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def timestamp(value: Optional[datetime]) -> Optional[float]:
+    """Secondi dall'epoch di ``value``; gli istanti senza fuso sono considerati UTC."""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return (value - _EPOCH).total_seconds()
+    return value.timestamp()
+
+
+def _totals_numpy(points: TrackArrays) -> Tuple[float, float, float, float, float, float]:
+    lat = np.radians(np.frombuffer(points.lat, dtype=np.float64))
+    lon = np.radians(np.frombuffer(points.lon, dtype=np.float64))
+    ele = np.frombuffer(points.ele, dtype=np.float64)
+    times = np.frombuffer(points.time, dtype=np.float64)
+    cos_lat = np.cos(lat)
+    a = np.sin(np.diff(lat) / 2) ** 2 + cos_lat[:-1] * cos_lat[1:] * np.sin(np.diff(lon) / 2) ** 2
+    distance = float(2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0))).sum())
+    climb = np.diff(ele)
+    up = climb > 0
+    down = climb < 0
+    gain = float(climb[up].sum())
+    loss = float(-climb[down].sum())
+    seconds = np.diff(times)
+    moving = seconds > 0
+    total = float(seconds[moving].sum())
+    up_seconds = float(seconds[moving & up].sum())
+    down_seconds = float(seconds[moving & down].sum())
+    return distance, gain, loss, total, up_seconds, down_seconds
+
+
+def _totals_python(points: TrackArrays) -> Tuple[float, float, float, float, float, float]:
+    radians = math.radians
+    lat = [radians(value) for value in points.lat]
+    lon = [radians(value) for value in points.lon]
+    cos_lat = [math.cos(value) for value in lat]
+    sin = math.sin
+    asin = math.asin
+    sqrt = math.sqrt
+    distance = gain = loss = total = up_seconds = down_seconds = 0.0
+    rows = zip(lat, lon, cos_lat, points.ele, points.time)
+    prev_lat, prev_lon, prev_cos, prev_ele, prev_time = next(rows)
+    for cur_lat, cur_lon, cur_cos, cur_ele, cur_time in rows:
+        a = sin((cur_lat - prev_lat) / 2) ** 2 + prev_cos * cur_cos * sin((cur_lon - prev_lon) / 2) ** 2
+        distance += asin(sqrt(a if a < 1.0 else 1.0))
+        climb = cur_ele - prev_ele
+        if climb > 0:
+            gain += climb
+        elif climb < 0:
+            loss -= climb
+        seconds = cur_time - prev_time
+        if seconds > 0:
+            total += seconds
+            if climb > 0:
+                up_seconds += seconds
+            elif climb < 0:
+                down_seconds += seconds
+        prev_lat, prev_lon, prev_cos, prev_ele, prev_time = cur_lat, cur_lon, cur_cos, cur_ele, cur_time
+    return 2 * EARTH_RADIUS_M * distance, gain, loss, total, up_seconds, down_seconds
+
+
+def compute_totals(points: TrackArrays) -> Dict[str, float]:
+    """Totali grezzi della traccia in metri e secondi.
+
+    Returns
+    -------
+    dict
+        ``distance_m``, ``gain_m``, ``loss_m``, ``total_seconds``,
+        ``up_seconds`` e ``down_seconds``.
+    """
+    if len(points) < 2:
+        totals = (0.0,) * 6
+    elif np is not None:
+        totals = _totals_numpy(points)
+    else:
+        totals = _totals_python(points)
+    keys = ("distance_m", "gain_m", "loss_m", "total_seconds", "up_seconds", "down_seconds")
+    return dict(zip(keys, totals))
+
+
+def route_stats(points: TrackArrays) -> Tuple[Optional[float], Optional[int]]:
+    """Distanza in km e dislivello positivo in metri di un percorso."""
+    if len(points) < 2:
+        return None, None
+    totals = compute_totals(points)
+    return round(totals["distance_m"] / 1000, 2), int(round(totals["gain_m"]))
+
+
+def activity_stats(points: TrackArrays) -> Dict[str, Optional[float]]:
+    """Statistiche di un'attività registrata, con passo e velocità di salita.
+
+    Returns
+    -------
+    dict
+        ``distance_km``, ``gain_m``, ``loss_m``, ``duration_h``,
+        ``pace_min_km``, ``vam``, ``up_hours`` e ``down_hours``; ``None``
+        per i valori che non si possono calcolare.
+    """
+    if len(points) < 2:
+        return {
+            "distance_km": None,
+            "gain_m": None,
+            "loss_m": None,
+            "duration_h": None,
+            "pace_min_km": None,
+            "vam": None,
+            "up_hours": None,
+            "down_hours": None,
+        }
+    totals = compute_totals(points)
+    distance_m = totals["distance_m"]
+    gain_m = totals["gain_m"]
+    loss_m = totals["loss_m"]
+    total_seconds = totals["total_seconds"]
+    up_seconds = totals["up_seconds"]
+    down_seconds = totals["down_seconds"]
+    distance_km = round(distance_m / 1000, 2) if distance_m > 0 else None
+    duration_h = round(total_seconds / 3600, 2) if total_seconds > 0 else None
+    pace_min_km = None
+    if distance_km and total_seconds > 0:
+        pace_min_km = round((total_seconds / 60) / distance_km, 1)
+    vam = None
+    if duration_h and gain_m > 0:
+        vam = round(gain_m / duration_h, 0)
+    return {
+        "distance_km": distance_km,
+        "gain_m": int(round(gain_m)) if gain_m else None,
+        "loss_m": int(round(loss_m)) if loss_m else None,
+        "duration_h": duration_h,
+        "pace_min_km": pace_min_km,
+        "vam": vam,
+        "up_hours": round(up_seconds / 3600, 2) if up_seconds > 0 else None,
+        "down_hours": round(down_seconds / 3600, 2) if down_seconds > 0 else None,
+    }
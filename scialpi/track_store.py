@@ -0,0 +1,258 @@
+"""Archivio binario delle tracce GPS dei percorsi.
+
+Le tracce non stanno più dentro ``routes.json``: ogni traccia è un file
+``tracks/<chiave>.trk`` nella directory dei dati, così l'elenco dei
+percorsi resta piccolo e le coordinate vengono lette solo quando servono
+(dettaglio del percorso o mappa). La chiave è l'hash SHA-256 del contenuto
+codificato, restituito da :func:`save_track`: tracce diverse non possono
+sovrascriversi e tracce identiche condividono il file.
+
+Formato del file, little-endian::
+
+    magic "SCTK" | versione u8 | flag u8 | 2 byte liberi | n punti u32
+    latitudini  float64 × n
+    longitudini float64 × n
+    quote       float32 × n   (solo se il flag HAS_ELEVATION è attivo)
+
+Le quote mancanti di singoli punti sono salvate come NaN e tornano a
+essere punti ``[lat, lon]`` in lettura.
+
+Accanto alla traccia completa vengono salvati alcuni livelli di dettaglio
+ridotto (``<chiave>.lod<n>.trk``, stesso formato), semplificati con
+Douglas–Peucker alle tolleranze di :data:`LOD_TOLERANCES`: una mappa poco
+ingrandita chiede il livello adatto alla propria scala e riceve una
+frazione dei punti.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import math
+import os
+import struct
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from .config import get_base_dir
+from .storage import atomic_write
+
+MAGIC = b"SCTK"
+VERSION = 1
+HAS_ELEVATION = 0x01
+_HEADER = struct.Struct("<4sBB2xI")
+# Numero di tracce decodificate tenute in memoria
+CACHE_SIZE = 64
+# Tolleranze in metri dei livelli di dettaglio; il livello 0 è la traccia completa
+LOD_TOLERANCES = (0.0, 5.0, 15.0, 40.0, 100.0)
+EARTH_RADIUS_M = 6371000.0
+
+_lock = threading.Lock()
+_cache: "OrderedDict[Tuple[str, int, int, int], List[List[float]]]" = OrderedDict()
+
+
+def tracks_dir() -> Path:
+    """Restituisce la directory che contiene i file delle tracce."""
+    return get_base_dir() / "tracks"
+
+
+def track_path(key: str, level: int = 0) -> Path:
+    if level:
+        return tracks_dir() / f"{key}.lod{level}.trk"
+    return tracks_dir() / f"{key}.trk"
+
+
+def level_for_tolerance(tolerance_m: float) -> int:
+    """Livello più semplificato la cui tolleranza non supera ``tolerance_m``."""
+    level = 0
+    for index, tolerance in enumerate(LOD_TOLERANCES):
+        if tolerance <= tolerance_m:
+            level = index
+    return level
+
+
+def tolerance_for_zoom(zoom: float, lat: float = 0.0) -> float:
+    """Metri per pixel di una mappa Web Mercator al livello di zoom ``zoom``."""
+    return 2 * math.pi * EARTH_RADIUS_M * math.cos(math.radians(lat)) / (256 * 2 ** zoom)
+
+
+def simplify_track(track: List[List[float]], tolerance_m: float) -> List[List[float]]:
+    """Semplifica la traccia con Douglas–Peucker.
+
+    Le distanze sono calcolate in metri su una proiezione equirettangolare
+    centrata sulla traccia, sufficiente alle dimensioni di una gita. Il
+    primo e l'ultimo punto vengono sempre mantenuti.
+    """
+    count = len(track)
+    if tolerance_m <= 0 or count < 3:
+        return list(track)
+    lat0 = math.radians(sum(point[0] for point in track) / count)
+    ky = EARTH_RADIUS_M * math.pi / 180
+    kx = ky * math.cos(lat0)
+    xs = [point[1] * kx for point in track]
+    ys = [point[0] * ky for point in track]
+    keep = [False] * count
+    keep[0] = keep[-1] = True
+    tolerance2 = tolerance_m * tolerance_m
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax = xs[first]
+        ay = ys[first]
+        dx = xs[last] - ax
+        dy = ys[last] - ay
+        segment2 = dx * dx + dy * dy
+        farthest = -1
+        farthest2 = tolerance2
+        for index in range(first + 1, last):
+            px = xs[index] - ax
+            py = ys[index] - ay
+            if segment2:
+                t = (px * dx + py * dy) / segment2
+                t = 0.0 if t < 0 else 1.0 if t > 1 else t
+                px -= t * dx
+                py -= t * dy
+            distance2 = px * px + py * py
+            if distance2 > farthest2:
+                farthest = index
+                farthest2 = distance2
+        if farthest >= 0:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [point for point, kept in zip(track, keep) if kept]
+
+
+def _little_endian(values: array) -> bytes:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def encode_track(track: List[List[float]]) -> bytes:
+    """Converte una traccia ``[[lat, lon, ele?], ...]`` nel formato binario."""
+    lats = array("d")
+    lons = array("d")
+    eles = array("f")
+    has_elevation = False
+    for point in track:
+        try:
+            lat = float(point[0])
+            lon = float(point[1])
+        except (TypeError, ValueError, IndexError):
+            continue
+        ele = math.nan
+        if len(point) > 2 and point[2] is not None:
+            try:
+                ele = float(point[2])
+                has_elevation = True
+            except (TypeError, ValueError):
+                ele = math.nan
+        lats.append(lat)
+        lons.append(lon)
+        eles.append(ele)
+    flags = HAS_ELEVATION if has_elevation else 0
+    parts = [_HEADER.pack(MAGIC, VERSION, flags, len(lats)), _little_endian(lats), _little_endian(lons)]
+    if has_elevation:
+        parts.append(_little_endian(eles))
+    return b"".join(parts)
+
+
+def decode_track(data: bytes) -> List[List[float]]:
+    """Operazione inversa di :func:`encode_track`."""
+    if len(data) < _HEADER.size:
+        return []
+    magic, version, flags, count = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        return []
+    offset = _HEADER.size
+    lats = _from_little_endian("d", data[offset : offset + 8 * count])
+    offset += 8 * count
+    lons = _from_little_endian("d", data[offset : offset + 8 * count])
+    offset += 8 * count
+    if not flags & HAS_ELEVATION:
+        return [[lat, lon] for lat, lon in zip(lats, lons)]
+    eles = _from_little_endian("f", data[offset : offset + 4 * count])
+    # float32 introduce decimali spuri: le quote GPS non vanno oltre il cm.
+    return [
+        [lat, lon] if math.isnan(ele) else [lat, lon, round(ele, 2)]
+        for lat, lon, ele in zip(lats, lons, eles)
+    ]
+
+
+def _save_levels(key: str, track: List[List[float]]) -> None:
+    for level in range(1, len(LOD_TOLERANCES)):
+        simplified = simplify_track(track, LOD_TOLERANCES[level])
+        atomic_write(track_path(key, level), encode_track(simplified))
+
+
+def save_track(track: List[List[float]]) -> str:
+    """Salva la traccia e i suoi livelli di dettaglio; restituisce la chiave.
+
+    Se una traccia con lo stesso contenuto esiste già non viene riscritta.
+    Una traccia vuota non viene salvata e ha chiave ``""``.
+    """
+    if not track:
+        return ""
+    data = encode_track(track)
+    key = hashlib.sha256(data).hexdigest()
+    if not track_path(key).is_file():
+        atomic_write(track_path(key), data)
+        _save_levels(key, decode_track(data))
+    return key
+
+
+def load_track(key: Optional[str], tolerance_m: float = 0.0) -> List[List[float]]:
+    """Legge la traccia con chiave ``key``; lista vuota se non esiste.
+
+    Con ``tolerance_m`` positiva restituisce il livello di dettaglio più
+    semplificato entro quella tolleranza. I livelli mancanti, per esempio
+    delle tracce salvate prima della loro introduzione, vengono calcolati
+    e salvati alla prima richiesta.
+    """
+    if not key:
+        return []
+    level = level_for_tolerance(tolerance_m)
+    track = _read_track(track_path(key, level))
+    if track is None and level:
+        full = _read_track(track_path(key))
+        if full is None:
+            return []
+        _save_levels(key, full)
+        track = _read_track(track_path(key, level))
+    return track or []
+
+
+def _read_track(path: Path) -> Optional[List[List[float]]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    cache_key = (str(path), st.st_ino, st.st_mtime_ns, st.st_size)
+    with _lock:
+        cached = _cache.get(cache_key)
+        if cached is not None:
+            _cache.move_to_end(cache_key)
+            return cached
+    try:
+        with open(path, "rb") as f:
+            track = decode_track(f.read())
+    except OSError:
+        return None
+    with _lock:
+        _cache[cache_key] = track
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return track
@@ -3,16 +3,25 @@
 Separiamo il concetto di "gita" (percorso) dalla "gita del giorno".
 - Percorso: nome, descrizione, difficolta, dislivello, distanza, traccia.
 - Giornata: data, qualita neve, descrizione, meteo, valanghe viste.
+
+La traccia di un percorso non è salvata nel record ma in
+:mod:`scialpi.track_store`, con la chiave nel campo ``track_file``
+(``track_hash`` riassume invece la geometria e compone l'id): gli elenchi dei
+percorsi non la contengono e va chiesta esplicitamente con
+``get_route(route_id, include_track=True)`` o :func:`get_route_track`.
 """
 
 from __future__ import annotations
 
 import hashlib
-import json
-import math
+from bisect import bisect_left
+from datetime import date, datetime
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
+from . import spatial, storage, track_stats, track_store
 from .config import get_base_dir
 from .utils import slugify
 
@@ -21,66 +30,54 @@ def init_data() -> Path:
     """Inizializza la struttura delle directory per i dati."""
     base_dir = get_base_dir()
     base_dir.mkdir(parents=True, exist_ok=True)
-    routes_file = base_dir / "routes.json"
-    if not routes_file.exists():
-        routes_file.write_text("[]", encoding="utf-8")
-    days_file = base_dir / "days.json"
-    if not days_file.exists():
-        days_file.write_text("[]", encoding="utf-8")
-    avalanches_file = base_dir / "avalanches.json"
-    if not avalanches_file.exists():
-        avalanches_file.write_text("[]", encoding="utf-8")
+    for name in ("routes", "days", "avalanches"):
+        storage.ensure_collection(name)
+    _migrate_routes()
     return base_dir
 
 
-def _routes_path() -> Path:
-    return get_base_dir() / "routes.json"
+def _migrate_routes() -> None:
+    # I percorsi salvati prima dell'archivio delle tracce le contengono
+    # ancora nel record, quelli precedenti all'indice spaziale non hanno il
+    # rettangolo della traccia e quelli precedenti alle chiavi per
+    # contenuto hanno il file in ``tracks/<track_hash>.trk``: li
+    # aggiorniamo una volta sola.
+    if all(_route_migrated(route) for route in _load_routes()):
+        return
+    with storage.transaction():
+        for route in _load_routes():
+            if _route_migrated(route):
+                continue
+            route = dict(route)
+            track = route.pop("track", None) or []
+            if track:
+                if not route.get("track_hash"):
+                    route["track_hash"] = _track_hash(track)
+            else:
+                track = track_store.load_track(route.get("track_file") or route.get("track_hash"))
+            route["track_file"] = track_store.save_track(track)
+            route["bbox"] = spatial.track_bbox(track)
+            _save_route(route)
 
 
-def _days_path() -> Path:
-    return get_base_dir() / "days.json"
+def _route_migrated(route: Dict[str, Any]) -> bool:
+    return "track" not in route and "bbox" in route and "track_file" in route
 
 
 def _load_routes() -> List[Dict[str, Any]]:
-    path = _routes_path()
-    if not path.exists():
-        return []
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        if isinstance(data, list):
-            return data
-        return []
-    except Exception:
-        return []
+    return storage.load("routes")
 
 
-def _save_routes(routes: List[Dict[str, Any]]) -> None:
-    path = _routes_path()
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(routes, f, indent=2, ensure_ascii=False)
+def _save_route(route: Dict[str, Any]) -> None:
+    spatial.put("routes", route)
 
 
 def _load_days() -> List[Dict[str, Any]]:
-    path = _days_path()
-    if not path.exists():
-        return []
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        if isinstance(data, list):
-            return data
-        return []
-    except Exception:
-        return []
+    return storage.load("days")
 
 
-def _save_days(days: List[Dict[str, Any]]) -> None:
-    path = _days_path()
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(days, f, indent=2, ensure_ascii=False)
+def _save_day(day: Dict[str, Any]) -> None:
+    storage.put("days", day)
 
 
 def _track_hash(track: Optional[List[List[float]]]) -> str:
@@ -106,46 +103,18 @@ def _route_id(name: str, track: Optional[List[List[float]]]) -> str:
 
 
 def _get_route_by_id(route_id: str) -> Optional[Dict[str, Any]]:
-    routes = _load_routes()
-    for route in routes:
-        if route.get("id") == route_id:
-            return route
-    return None
+    return storage.get("routes", route_id)
 
 
-def _haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    radius = 6371.0
-    lat1_rad = math.radians(lat1)
-    lon1_rad = math.radians(lon1)
-    lat2_rad = math.radians(lat2)
-    lon2_rad = math.radians(lon2)
-    dlat = lat2_rad - lat1_rad
-    dlon = lon2_rad - lon1_rad
-    a = math.sin(dlat / 2) ** 2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon / 2) ** 2
-    c = 2 * math.asin(math.sqrt(a))
-    return radius * c
+def get_routes(route_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Percorsi con gli id indicati, per id, senza tracce; gli id inesistenti vengono ignorati."""
+    return {route["id"]: route for route in storage.get_many("routes", route_ids)}
 
 
 def _compute_track_stats(track: Optional[List[List[float]]]) -> tuple[Optional[float], Optional[int]]:
     if not track or len(track) < 2:
         return None, None
-    distance_km = 0.0
-    gain_m = 0.0
-    prev = track[0]
-    for point in track[1:]:
-        try:
-            distance_km += _haversine_km(prev[0], prev[1], point[0], point[1])
-        except (TypeError, ValueError, IndexError):
-            pass
-        if len(prev) > 2 and len(point) > 2:
-            try:
-                delta = float(point[2]) - float(prev[2])
-                if delta > 0:
-                    gain_m += delta
-            except (TypeError, ValueError):
-                pass
-        prev = point
-    return round(distance_km, 2), int(round(gain_m))
+    return track_stats.route_stats(track_stats.TrackArrays.from_track(track))
 
 
 def _estimate_hours(distance_km: Optional[float], gain_m: Optional[int]) -> Optional[float]:
@@ -156,12 +125,31 @@ def _estimate_hours(distance_km: Optional[float], gain_m: Optional[int]) -> Opti
     return round(distance_part + gain_part, 2)
 
 
-def list_routes() -> List[Dict[str, Any]]:
-    return _load_routes()
+def list_routes(bbox: Optional[spatial.BBox] = None) -> List[Dict[str, Any]]:
+    """Restituisce i percorsi, solo quelli che intersecano ``bbox`` se indicato."""
+    if bbox is None:
+        return list(_load_routes())
+    return storage.get_many("routes", spatial.query("routes", bbox))
+
+
+def get_route(route_id: str, include_track: bool = False, tolerance_m: float = 0.0) -> Optional[Dict[str, Any]]:
+    route = _get_route_by_id(route_id)
+    if route is None or not include_track:
+        return route
+    return {**route, "track": get_route_track(route, tolerance_m)}
 
 
-def get_route(route_id: str) -> Optional[Dict[str, Any]]:
-    return _get_route_by_id(route_id)
+def get_route_track(route: Dict[str, Any], tolerance_m: float = 0.0) -> List[List[float]]:
+    """Restituisce la traccia del percorso leggendola dall'archivio.
+
+    ``tolerance_m`` chiede una versione semplificata, vedi
+    :func:`scialpi.track_store.load_track`.
+    """
+    if "track" in route:
+        track = route.get("track") or []
+        level = track_store.level_for_tolerance(tolerance_m)
+        return track_store.simplify_track(track, track_store.LOD_TOLERANCES[level])
+    return track_store.load_track(route.get("track_file"), tolerance_m)
 
 
 def upsert_route(
@@ -171,86 +159,133 @@ def upsert_route(
     track: Optional[List[List[float]]] = None,
     route_id: Optional[str] = None,
 ) -> Dict[str, Any]:
-    routes = _load_routes()
-    existing = None
-    if route_id:
-        for route in routes:
-            if route.get("id") == route_id:
-                existing = route
-                break
-    if existing and track:
-        new_hash = _track_hash(track)
-        if existing.get("track_hash") and new_hash and new_hash != existing.get("track_hash"):
-            route_id = None
-            existing = None
-    if not existing:
-        route_id = _route_id(name, track)
-        existing = _get_route_by_id(route_id)
-    if existing:
-        if name:
-            existing["name"] = name
-        if description is not None:
-            existing["description"] = description
-        if difficulty is not None:
-            existing["difficulty"] = difficulty
-        if track:
-            existing["track"] = track
-            existing["track_hash"] = _track_hash(track)
-            distance_km, gain_m = _compute_track_stats(track)
-            existing["distance_km"] = distance_km
-            existing["gain"] = gain_m
+    with storage.transaction():
+        existing = _get_route_by_id(route_id) if route_id else None
+        if existing and track:
+            new_hash = _track_hash(track)
+            if existing.get("track_hash") and new_hash and new_hash != existing.get("track_hash"):
+                route_id = None
+                existing = None
+        if not existing:
+            route_id = _route_id(name, track)
+            existing = _get_route_by_id(route_id)
+        if existing:
+            existing = dict(existing)
+            if name:
+                existing["name"] = name
+            if description is not None:
+                existing["description"] = description
+            if difficulty is not None:
+                existing["difficulty"] = difficulty
             if track:
-                last = track[-1]
-                existing["lat"] = float(last[0])
-                existing["lon"] = float(last[1])
-        _save_routes(routes)
-        return existing
-
-    distance_km, gain_m = _compute_track_stats(track)
-    lat = None
-    lon = None
-    if track:
-        last = track[-1]
-        lat = float(last[0])
-        lon = float(last[1])
-    route = {
-        "id": route_id,
-        "name": name,
-        "description": description,
-        "difficulty": difficulty,
-        "track": track or [],
-        "track_hash": _track_hash(track),
-        "distance_km": distance_km,
-        "gain": gain_m,
-        "lat": lat,
-        "lon": lon,
-    }
-    routes.append(route)
-    _save_routes(routes)
-    return route
+                existing.pop("track", None)
+                existing["track_hash"] = _track_hash(track)
+                existing["track_file"] = track_store.save_track(track)
+                existing["bbox"] = spatial.track_bbox(track)
+                distance_km, gain_m = _compute_track_stats(track)
+                existing["distance_km"] = distance_km
+                existing["gain"] = gain_m
+                if track:
+                    last = track[-1]
+                    existing["lat"] = float(last[0])
+                    existing["lon"] = float(last[1])
+            _save_route(existing)
+            return existing
+
+        distance_km, gain_m = _compute_track_stats(track)
+        lat = None
+        lon = None
+        if track:
+            last = track[-1]
+            lat = float(last[0])
+            lon = float(last[1])
+        route = {
+            "id": route_id,
+            "name": name,
+            "description": description,
+            "difficulty": difficulty,
+            "track_hash": _track_hash(track),
+            "track_file": track_store.save_track(track or []),
+            "bbox": spatial.track_bbox(track) if track else None,
+            "distance_km": distance_km,
+            "gain": gain_m,
+            "lat": lat,
+            "lon": lon,
+        }
+        _save_route(route)
+        return route
+
+
+def list_days(route_id: Optional[str] = None, owner_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    if route_id:
+        days = storage.find("days", "route_id", route_id)
+        if owner_id:
+            days = [day for day in days if day.get("owner_id") == owner_id]
+        return days
+    if owner_id:
+        return storage.find("days", "owner_id", owner_id)
+    return list(_load_days())
 
 
-def list_days(route_id: Optional[str] = None) -> List[Dict[str, Any]]:
-    days = _load_days()
-    if route_id:
-        days = [day for day in days if day.get("route_id") == route_id]
-    return days
+def page_days(
+    limit: int,
+    after: Optional[Tuple[str, Any]] = None,
+    accept: Optional[Callable[[Dict[str, Any]], bool]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[Tuple[str, Any]]]:
+    """Pagina di giornate dalla più recente, vedi :func:`scialpi.storage.page`.
+
+    Le giornate sono ordinate per :func:`day_date_value`, quindi per data
+    qualunque sia il formato salvato; quelle senza una data valida vengono
+    per ultime.
+    """
+    return storage.page("days", "date", limit, after, accept, day_date_value)
+
+
+def day_order_key(day: Dict[str, Any]) -> Tuple[str, Any]:
+    """Chiave di ordinamento di una giornata usata da :func:`page_days`."""
+    return storage.order_key(storage.key_field("days"), "date", day, day_date_value)
+
+
+def days_since(key: Tuple[str, Any]) -> List[Dict[str, Any]]:
+    """Giornate con chiave (vedi :func:`day_order_key`) non minore di ``key``.
+
+    Sono quelle già restituite da :func:`page_days` fino al cursore
+    ``key``; solleva ``ValueError`` se la chiave non è valida.
+    """
+    keys, days = storage.ordered("days", "date", day_date_value)
+    try:
+        return days[bisect_left(keys, tuple(key)) :]
+    except TypeError:
+        raise ValueError("Chiave di paginazione non valida") from None
 
 
 def get_day(day_id: str) -> Optional[Dict[str, Any]]:
-    for day in _load_days():
-        if day.get("id") == day_id:
-            return day
-    return None
+    return storage.get("days", day_id)
+
+
+# Campi della giornata e chiavi corrispondenti di track_stats.activity_stats
+ACTIVITY_FIELDS = (
+    ("activity_distance_km", "distance_km"),
+    ("activity_gain_m", "gain_m"),
+    ("activity_loss_m", "loss_m"),
+    ("activity_duration_h", "duration_h"),
+    ("activity_pace_min_km", "pace_min_km"),
+    ("activity_vam", "vam"),
+    ("activity_up_hours", "up_hours"),
+    ("activity_down_hours", "down_hours"),
+)
+
+
+def _apply_activity_stats(day: Dict[str, Any], activity_stats: Optional[Dict[str, Optional[float]]]) -> None:
+    for field, key in ACTIVITY_FIELDS:
+        day[field] = activity_stats.get(key) if activity_stats else None
 
 
 def _day_id(route_id: str, date: str) -> str:
     base = slugify(f"{date}_{route_id}").lower()
-    days = _load_days()
     candidate = base
     counter = 2
-    existing = {day.get("id") for day in days}
-    while candidate in existing:
+    while get_day(candidate) is not None:
         candidate = f"{base}_{counter}"
         counter += 1
     return candidate
@@ -270,62 +305,55 @@ def upsert_day(
     day_id: Optional[str] = None,
     activity_stats: Optional[Dict[str, Optional[float]]] = None,
 ) -> Dict[str, Any]:
-    days = _load_days()
-    existing = None
-    if day_id:
-        for day in days:
-            if day.get("id") == day_id:
-                existing = day
-                break
-    if existing:
-        existing["route_id"] = route_id
-        existing["date"] = date
-        existing["snow_quality"] = snow_quality
-        existing["description"] = description
-        existing["weather"] = weather
-        existing["avalanches_seen"] = avalanches_seen
-        existing["visibility"] = visibility
-        existing["group_ids"] = group_ids or []
-        existing["people_ids"] = people_ids or []
-        if owner_id:
-            existing["owner_id"] = owner_id
-        if activity_stats:
-            existing["activity_distance_km"] = activity_stats.get("distance_km")
-            existing["activity_gain_m"] = activity_stats.get("gain_m")
-            existing["activity_loss_m"] = activity_stats.get("loss_m")
-            existing["activity_duration_h"] = activity_stats.get("duration_h")
-            existing["activity_pace_min_km"] = activity_stats.get("pace_min_km")
-            existing["activity_vam"] = activity_stats.get("vam")
-            existing["activity_up_hours"] = activity_stats.get("up_hours")
-            existing["activity_down_hours"] = activity_stats.get("down_hours")
-        _save_days(days)
-        return existing
-
-    day_id = _day_id(route_id, date)
-    day = {
-        "id": day_id,
-        "route_id": route_id,
-        "date": date,
-        "snow_quality": snow_quality,
-        "description": description,
-        "weather": weather,
-        "avalanches_seen": avalanches_seen,
-        "visibility": visibility,
-        "group_ids": group_ids or [],
-        "people_ids": people_ids or [],
-        "owner_id": owner_id,
-        "activity_distance_km": activity_stats.get("distance_km") if activity_stats else None,
-        "activity_gain_m": activity_stats.get("gain_m") if activity_stats else None,
-        "activity_loss_m": activity_stats.get("loss_m") if activity_stats else None,
-        "activity_duration_h": activity_stats.get("duration_h") if activity_stats else None,
-        "activity_pace_min_km": activity_stats.get("pace_min_km") if activity_stats else None,
-        "activity_vam": activity_stats.get("vam") if activity_stats else None,
-        "activity_up_hours": activity_stats.get("up_hours") if activity_stats else None,
-        "activity_down_hours": activity_stats.get("down_hours") if activity_stats else None,
-    }
-    days.append(day)
-    _save_days(days)
-    return day
+    with storage.transaction():
+        existing = get_day(day_id) if day_id else None
+        if existing:
+            existing = dict(existing)
+            existing["route_id"] = route_id
+            existing["date"] = date
+            existing["snow_quality"] = snow_quality
+            existing["description"] = description
+            existing["weather"] = weather
+            existing["avalanches_seen"] = avalanches_seen
+            existing["visibility"] = visibility
+            existing["group_ids"] = group_ids or []
+            existing["people_ids"] = people_ids or []
+            if owner_id:
+                existing["owner_id"] = owner_id
+            if activity_stats:
+                _apply_activity_stats(existing, activity_stats)
+            _save_day(existing)
+            return existing
+
+        day_id = _day_id(route_id, date)
+        day = {
+            "id": day_id,
+            "route_id": route_id,
+            "date": date,
+            "snow_quality": snow_quality,
+            "description": description,
+            "weather": weather,
+            "avalanches_seen": avalanches_seen,
+            "visibility": visibility,
+            "group_ids": group_ids or [],
+            "people_ids": people_ids or [],
+            "owner_id": owner_id,
+        }
+        _apply_activity_stats(day, activity_stats)
+        _save_day(day)
+        return day
+
+
+def set_day_activity_stats(day_id: str, activity_stats: Dict[str, Optional[float]]) -> Optional[Dict[str, Any]]:
+    """Aggiorna le statistiche dell'attività registrata di una giornata."""
+    with storage.transaction():
+        day = get_day(day_id)
+        if not day:
+            return None
+        day = dict(day)
+        _apply_activity_stats(day, activity_stats)
+        _save_day(day)
+        return day
 
 
 # Funzioni legacy per la CLI e l'interfaccia esistente.
@@ -369,27 +397,94 @@ def add_trip(
     return day["id"]
 
 
-def list_trips() -> List[Dict[str, Any]]:
-    """Compatibilita: restituisce la lista delle giornate."""
+@lru_cache(maxsize=8192)
+def parse_day_date(value: Optional[str]) -> Optional[date]:
+    """Data di una giornata, salvata come ``YYYY-MM-DD`` o ``DDMMYYYY``; ``None`` se non valida."""
+    if not value:
+        return None
+    text = value.strip()
+    if not text:
+        return None
+    if "-" in text:
+        try:
+            return datetime.fromisoformat(text).date()
+        except ValueError:
+            pass
+    digits = "".join(ch for ch in text if ch.isdigit())
+    if len(digits) >= 8:
+        try:
+            return datetime.strptime(digits[:8], "%d%m%Y").date()
+        except ValueError:
+            return None
+    return None
+
+
+def day_date_value(day: Dict[str, Any]) -> str:
+    """Data di una giornata in formato ISO per ordinarla; ``""`` se non valida."""
+    parsed = parse_day_date(day.get("date"))
+    return parsed.isoformat() if parsed is not None else ""
+
+
+def list_trips(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    limit: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Compatibilita: restituisce la lista delle giornate con i dati del percorso.
+
+    Le giornate sono in ordine decrescente di data, con quelle senza una
+    data valida in fondo, scorse dall'ordinamento in cache di
+    :func:`scialpi.storage.ordered` per :func:`day_date_value`: ``start``
+    ed ``end`` si trovano con una ricerca binaria e ``limit`` si ferma
+    alle più recenti. I percorsi vengono letti con un'unica
+    :func:`scialpi.storage.get_many` e uniti per chiave, senza caricare le
+    tracce.
+
+    Parameters
+    ----------
+    start, end: datetime.date, optional
+        Estremi inclusi dell'intervallo di date; se indicati le giornate
+        senza una data valida vengono escluse.
+    limit: int, optional
+        Numero massimo di gite restituite.
+    """
+    if limit is not None and limit <= 0:
+        return []
+    keys, days = storage.ordered("days", "date", day_date_value)
+    lower, upper = 0, len(days)
+    if start is not None or end is not None:
+        # Le chiavi sono (data ISO, id) e le giornate senza data ("") vengono prima di tutte.
+        lower = bisect_left(keys, (start.isoformat() if start is not None else "0",))
+        if end is not None:
+            upper = bisect_left(keys, (end.isoformat() + "~",))
+    selected: Iterable[Dict[str, Any]] = (days[index] for index in range(upper - 1, lower - 1, -1))
     results: List[Dict[str, Any]] = []
-    for day in _load_days():
-        route = _get_route_by_id(day.get("route_id"))
-        if not route:
-            continue
-        estimate_hours = _estimate_hours(route.get("distance_km"), route.get("gain"))
-        results.append(
-            {
-                "slug": day.get("id"),
-                "date": day.get("date"),
-                "name": route.get("name"),
-                "description": route.get("description"),
-                "route_id": route.get("id"),
-                "distance_km": route.get("distance_km"),
-                "gain": route.get("gain"),
-                "estimate_hours": estimate_hours,
-            }
-        )
-    results.sort(key=lambda item: item.get("date", ""), reverse=True)
+    while limit is None or len(results) < limit:
+        # Con un limite servono solo le giornate mancanti, più altre se qualche percorso non esiste.
+        batch = list(islice(selected, None if limit is None else limit - len(results)))
+        if not batch:
+            break
+        route_ids = {day.get("route_id") for day in batch}
+        routes = {route.get("id"): route for route in storage.get_many("routes", route_ids)}
+        for day in batch:
+            route = routes.get(day.get("route_id"))
+            if not route:
+                continue
+            estimate_hours = _estimate_hours(route.get("distance_km"), route.get("gain"))
+            results.append(
+                {
+                    "slug": day.get("id"),
+                    "date": day.get("date"),
+                    "name": route.get("name"),
+                    "description": route.get("description"),
+                    "route_id": route.get("id"),
+                    "distance_km": route.get("distance_km"),
+                    "gain": route.get("gain"),
+                    "estimate_hours": estimate_hours,
+                }
+            )
+        if limit is None:
+            break
     return results
 
 
@@ -404,6 +499,7 @@ def read_trip(slug: str) -> Optional[Dict[str, Any]]:
     estimate_hours = _estimate_hours(route.get("distance_km"), route.get("gain"))
     result = {
         **route,
+        "track": get_route_track(route),
         "date": day.get("date"),
         "snow_quality": day.get("snow_quality"),
         "day_description": day.get("description"),
@@ -0,0 +1,121 @@
+"""Elaborazione in background dei file caricati dal sito.
+
+Ogni funzione è registrata in :mod:`scialpi.jobs` per un tipo di lavoro e
+riceve il payload preparato dalla richiesta HTTP: i campi del form e il
+nome del file salvato in :func:`scialpi.jobs.uploads_dir`. Qui avvengono
+i passi lenti: lettura del GPX, ricerca delle quote, calcolo delle
+statistiche, scrittura delle tracce e ridimensionamento delle foto.
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List, Optional
+
+from . import gpx, jobs
+from .config import get_base_dir
+from .day_media import add_day_photo
+from .elevation import ensure_elevation
+from .images import make_variants
+from .track_stats import activity_stats
+from .trip_manager import add_trip, set_day_activity_stats, upsert_route
+
+
+def parse_track_points(text: str) -> List[List[float]]:
+    """Traccia da un elenco JSON ``[[lat, lon, ele?], ...]``; i punti non validi vengono scartati."""
+    try:
+        parsed = json.loads(text)
+    except json.JSONDecodeError:
+        return []
+    points: List[List[float]] = []
+    if not isinstance(parsed, list):
+        return points
+    for point in parsed:
+        if (
+            isinstance(point, list)
+            and len(point) >= 2
+            and isinstance(point[0], (int, float))
+            and isinstance(point[1], (int, float))
+        ):
+            if len(point) >= 3 and isinstance(point[2], (int, float)):
+                points.append([float(point[0]), float(point[1]), float(point[2])])
+            else:
+                points.append([float(point[0]), float(point[1])])
+    return points
+
+
+def _read_track(payload: Dict[str, Any]) -> List[List[float]]:
+    name = payload.get("upload")
+    if not name:
+        return []
+    path = jobs.uploads_dir() / name
+    if payload.get("format") == "gpx":
+        with open(path, "rb") as f:
+            track = gpx.read_track(f)
+    else:
+        track = parse_track_points(path.read_text(encoding="utf-8"))
+    if track:
+        track = ensure_elevation(track)
+    return track
+
+
+@jobs.handler("route_upload")
+def process_route_upload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Crea o aggiorna un percorso con la traccia caricata."""
+    track = _read_track(payload)
+    route_id = payload.get("route_id")
+    if not route_id and not track:
+        raise jobs.JobError("Traccia obbligatoria per creare il percorso")
+    route = upsert_route(
+        name=payload.get("name"),
+        description=payload.get("description"),
+        difficulty=payload.get("difficulty"),
+        track=track or None,
+        route_id=route_id,
+    )
+    return {"route": route}
+
+
+@jobs.handler("trip_upload")
+def process_trip_upload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Crea una gita (percorso e giornata) dal form web con la traccia caricata."""
+    track = _read_track(payload)
+    lat: Optional[float] = payload.get("lat")
+    lon: Optional[float] = payload.get("lon")
+    if track and (lat is None or lon is None):
+        lat = float(track[-1][0])
+        lon = float(track[-1][1])
+    fields = dict(payload.get("trip") or {})
+    slug = add_trip(lat=lat, lon=lon, track=track, **fields)
+    return {"slug": slug}
+
+
+@jobs.handler("activity_upload")
+def process_activity_upload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Calcola le statistiche dell'attività registrata di una giornata."""
+    with open(jobs.uploads_dir() / payload["upload"], "rb") as f:
+        points = gpx.read_activity(f)
+    if len(points) < 2:
+        raise jobs.JobError("GPX attivita non valido")
+    day = set_day_activity_stats(payload["day_id"], activity_stats(points))
+    if day is None:
+        raise jobs.JobError("Giornata non trovata")
+    return {"day": day}
+
+
+@jobs.handler("day_photo")
+def process_day_photo(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Registra la foto caricata di una giornata e ne genera le varianti."""
+    filename = payload["filename"]
+    if not (get_base_dir() / "day_photos" / filename).is_file():
+        raise jobs.JobError("Foto non trovata, caricala di nuovo")
+    make_variants("day_photos", filename)
+    record = add_day_photo(payload["day_id"], filename, payload.get("lat"), payload.get("lon"), payload.get("owner_id"))
+    return {"photo": record}
+
+
+@jobs.handler("image_variants")
+def process_image_variants(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Genera le varianti ridimensionate di un'immagine già salvata."""
+    make_variants(payload["folder"], payload["filename"])
+    return {"filename": payload["filename"]}
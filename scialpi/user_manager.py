@@ -1,50 +1,34 @@
 ﻿from __future__ import annotations
 
-import json
 from datetime import datetime
-from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, List, Optional, Set
 from uuid import uuid4
 
 from werkzeug.security import check_password_hash, generate_password_hash
 
+from . import blobs, storage
 from .config import get_base_dir
 
 
 def init_user_data() -> None:
     base_dir = get_base_dir()
     base_dir.mkdir(parents=True, exist_ok=True)
-    for name in ("users.json", "groups.json", "memberships.json", "invites.json", "friends.json", "reset_tokens.json"):
-        path = base_dir / name
-        if not path.exists():
-            path.write_text("[]", encoding="utf-8")
+    for name in ("users", "groups", "memberships", "invites", "friends", "reset_tokens"):
+        storage.ensure_collection(name)
     photos_dir = base_dir / "user_photos"
     photos_dir.mkdir(parents=True, exist_ok=True)
 
 
-def _path(name: str) -> Path:
-    return get_base_dir() / name
+def _load_list(name: str) -> List[Dict[str, Any]]:
+    return storage.load(name)
 
 
-def _load_list(name: str) -> List[Dict[str, Any]]:
-    path = _path(name)
-    if not path.exists():
-        return []
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        if isinstance(data, list):
-            return data
-        return []
-    except Exception:
-        return []
-
-
-def _save_list(name: str, data: List[Dict[str, Any]]) -> None:
-    path = _path(name)
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+def _save_record(name: str, record: Dict[str, Any]) -> None:
+    storage.put(name, record)
+
+
+def _delete_record(name: str, key: Any) -> bool:
+    return storage.delete(name, key)
 
 
 def _now_iso() -> str:
@@ -58,7 +42,6 @@ def create_user(
     is_guide: bool = False,
     cai_courses: Optional[str] = None,
 ) -> Dict[str, Any]:
-    users = _load_list("users.json")
     user = {
         "id": uuid4().hex,
         "name": name,
@@ -70,28 +53,26 @@ def create_user(
         "photo_filename": None,
         "created_at": _now_iso(),
     }
-    users.append(user)
-    _save_list("users.json", users)
+    _save_record("users", user)
     return user
 
 
 def get_user(user_id: str) -> Optional[Dict[str, Any]]:
-    for user in _load_list("users.json"):
-        if user.get("id") == user_id:
-            return user
-    return None
+    return storage.get("users", user_id)
+
+
+def get_users(user_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Utenti con gli id indicati, per id; gli id inesistenti vengono ignorati."""
+    return {user["id"]: user for user in storage.get_many("users", user_ids)}
 
 
 def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
-    email = email.lower()
-    for user in _load_list("users.json"):
-        if user.get("email") == email:
-            return user
-    return None
+    users = storage.find("users", "email", email.lower())
+    return users[0] if users else None
 
 
 def list_users() -> List[Dict[str, Any]]:
-    return _load_list("users.json")
+    return list(_load_list("users"))
 
 
 def authenticate(email: str, password: str) -> Optional[Dict[str, Any]]:
@@ -104,80 +85,85 @@ def authenticate(email: str, password: str) -> Optional[Dict[str, Any]]:
 
 
 def set_password(user_id: str, new_password: str) -> None:
-    users = _load_list("users.json")
-    for user in users:
-        if user.get("id") == user_id:
-            user["password_hash"] = generate_password_hash(new_password)
-            _save_list("users.json", users)
-            return
+    password_hash = generate_password_hash(new_password)
+    with storage.transaction():
+        user = get_user(user_id)
+        if user:
+            user = dict(user)
+            user["password_hash"] = password_hash
+            _save_record("users", user)
 
 
 def set_user_photo(user_id: str, filename: str) -> Optional[Dict[str, Any]]:
-    users = _load_list("users.json")
-    for user in users:
-        if user.get("id") == user_id:
-            user["photo_filename"] = filename
-            _save_list("users.json", users)
-            return user
-    return None
+    with storage.transaction():
+        user = get_user(user_id)
+        if not user:
+            return None
+        user = dict(user)
+        previous = user.get("photo_filename")
+        if previous != filename:
+            blobs.acquire("user_photos", filename)
+            blobs.release("user_photos", previous)
+        user["photo_filename"] = filename
+        _save_record("users", user)
+        return user
 
 
 def create_reset_token(user_id: str) -> str:
-    tokens = _load_list("reset_tokens.json")
     token = uuid4().hex
-    tokens.append({"token": token, "user_id": user_id, "created_at": _now_iso()})
-    _save_list("reset_tokens.json", tokens)
+    _save_record("reset_tokens", {"token": token, "user_id": user_id, "created_at": _now_iso()})
     return token
 
 
 def consume_reset_token(token: str) -> Optional[str]:
-    tokens = _load_list("reset_tokens.json")
-    for entry in tokens:
-        if entry.get("token") == token:
-            user_id = entry.get("user_id")
-            tokens = [t for t in tokens if t.get("token") != token]
-            _save_list("reset_tokens.json", tokens)
-            return user_id
-    return None
+    with storage.transaction():
+        entry = storage.get("reset_tokens", token)
+        if entry is None or not _delete_record("reset_tokens", token):
+            return None
+        return entry.get("user_id")
 
 
 def list_groups() -> List[Dict[str, Any]]:
-    return _load_list("groups.json")
+    return list(_load_list("groups"))
+
+
+def get_group(group_id: str) -> Optional[Dict[str, Any]]:
+    return storage.get("groups", group_id)
 
 
 def list_groups_for_user(user_id: str) -> List[Dict[str, Any]]:
-    memberships = _load_list("memberships.json")
-    group_ids = {m.get("group_id") for m in memberships if m.get("user_id") == user_id}
-    return [g for g in _load_list("groups.json") if g.get("id") in group_ids]
+    group_ids = {m.get("group_id") for m in storage.find("memberships", "user_id", user_id)}
+    return [g for g in _load_list("groups") if g.get("id") in group_ids]
+
+
+def get_group_ids_for_user(user_id: str) -> Set[str]:
+    """Restituisce gli id dei gruppi di cui ``user_id`` fa parte."""
+    return {m.get("group_id") for m in storage.find("memberships", "user_id", user_id)}
 
 
 def is_member(user_id: str, group_id: str) -> bool:
-    for membership in _load_list("memberships.json"):
-        if membership.get("user_id") == user_id and membership.get("group_id") == group_id:
+    for membership in storage.find("memberships", "user_id", user_id):
+        if membership.get("group_id") == group_id:
             return True
     return False
 
 
 def create_group(name: str, owner_id: str, description: Optional[str], is_public: bool) -> Dict[str, Any]:
-    groups = _load_list("groups.json")
-    group = {
-        "id": uuid4().hex,
-        "name": name,
-        "description": description,
-        "is_public": bool(is_public),
-        "owner_id": owner_id,
-        "created_at": _now_iso(),
-    }
-    groups.append(group)
-    _save_list("groups.json", groups)
-    memberships = _load_list("memberships.json")
-    memberships.append({"id": uuid4().hex, "group_id": group["id"], "user_id": owner_id, "role": "owner"})
-    _save_list("memberships.json", memberships)
-    return group
+    with storage.transaction():
+        group = {
+            "id": uuid4().hex,
+            "name": name,
+            "description": description,
+            "is_public": bool(is_public),
+            "owner_id": owner_id,
+            "created_at": _now_iso(),
+        }
+        _save_record("groups", group)
+        _save_record("memberships", {"id": uuid4().hex, "group_id": group["id"], "user_id": owner_id, "role": "owner"})
+        return group
 
 
 def create_invite(group_id: str, email: str, inviter_id: str) -> Dict[str, Any]:
-    invites = _load_list("invites.json")
     invite = {
         "id": uuid4().hex,
         "group_id": group_id,
@@ -186,32 +172,35 @@ def create_invite(group_id: str, email: str, inviter_id: str) -> Dict[str, Any]:
         "status": "pending",
         "created_at": _now_iso(),
     }
-    invites.append(invite)
-    _save_list("invites.json", invites)
+    _save_record("invites", invite)
     return invite
 
 
 def list_invites_for_user(email: str) -> List[Dict[str, Any]]:
     email = email.lower()
-    return [inv for inv in _load_list("invites.json") if inv.get("email") == email]
+    return [inv for inv in _load_list("invites") if inv.get("email") == email]
 
 
 def add_friend(user_id: str, friend_email: str) -> Optional[Dict[str, Any]]:
-    friend = get_user_by_email(friend_email)
-    if not friend:
-        return None
-    friendships = _load_list("friends.json")
-    for entry in friendships:
-        if entry.get("user_id") == user_id and entry.get("friend_id") == friend.get("id"):
-            return entry
-    friendships.append({"id": uuid4().hex, "user_id": user_id, "friend_id": friend.get("id"), "status": "accepted"})
-    friendships.append({"id": uuid4().hex, "user_id": friend.get("id"), "friend_id": user_id, "status": "accepted"})
-    _save_list("friends.json", friendships)
-    return friend
+    with storage.transaction():
+        friend = get_user_by_email(friend_email)
+        if not friend:
+            return None
+        for entry in storage.find("friends", "user_id", user_id):
+            if entry.get("friend_id") == friend.get("id"):
+                return entry
+        _save_record("friends", {"id": uuid4().hex, "user_id": user_id, "friend_id": friend.get("id"), "status": "accepted"})
+        _save_record("friends", {"id": uuid4().hex, "user_id": friend.get("id"), "friend_id": user_id, "status": "accepted"})
+        return friend
 
 
 def is_friend(user_id: str, other_id: str) -> bool:
-    for entry in _load_list("friends.json"):
-        if entry.get("user_id") == user_id and entry.get("friend_id") == other_id:
+    for entry in storage.find("friends", "user_id", user_id):
+        if entry.get("friend_id") == other_id:
             return True
     return False
+
+
+def get_friend_ids(user_id: str) -> Set[str]:
+    """Restituisce gli id degli amici di ``user_id``."""
+    return {entry.get("friend_id") for entry in storage.find("friends", "user_id", user_id)}
@@ -6,6 +6,10 @@ import os
 
 from flask import Flask
 
+from scialpi import extras
+from scialpi.jobs import start_workers
+
+from . import metrics, profiling, storage_budget
 from .routes import bp
 
 
@@ -15,6 +19,16 @@ def create_app() -> Flask:
     app.secret_key = os.environ.get("SCIALPI_SECRET_KEY", "scialpi-dev-key")
     # Registriamo il blueprint che contiene tutte le route
     app.register_blueprint(bp)
+    # Metriche per richiesta ed endpoint /metrics
+    metrics.init_app(app)
+    # Accessi alle collezioni per richiesta (SCIALPI_STORAGE_BUDGET, SCIALPI_STORAGE_DEBUG)
+    storage_budget.init_app(app)
+    # Profili cProfile su richiesta degli utenti in SCIALPI_PROFILE_USERS
+    profiling.init_app(app)
+    # Avvisa se mancano Pillow o numpy (extra "images" e "fast")
+    extras.log_missing()
+    # Worker interni per i caricamenti (SCIALPI_JOB_WORKERS=0 se si usa ``scialpi worker``)
+    start_workers()
     return app
 
 
@@ -0,0 +1,46 @@
+"""Metriche delle richieste HTTP ed endpoint ``/metrics`` per Prometheus.
+
+Ogni richiesta aggiorna in :mod:`scialpi.metrics` il contatore per
+endpoint, metodo e stato, e gli istogrammi di durata e dimensione della
+risposta. Le richieste che non corrispondono a nessuna route finiscono
+sotto l'endpoint ``unmatched``, così gli URL sconosciuti non creano nuove
+serie.
+"""
+
+from __future__ import annotations
+
+import time
+
+from flask import Flask, Response, g, request
+
+from scialpi import metrics
+
+
+def _start_timer() -> None:
+    g.metrics_started = time.perf_counter()
+
+
+def _record_request(response: Response) -> Response:
+    endpoint = request.endpoint or "unmatched"
+    metrics.inc("scialpi_http_requests_total", endpoint=endpoint, method=request.method, status=response.status_code)
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        metrics.observe("scialpi_http_request_duration_seconds", time.perf_counter() - started, endpoint=endpoint)
+    if response.content_length is not None:
+        metrics.observe("scialpi_http_response_size_bytes", response.content_length, endpoint=endpoint)
+    metrics.flush()
+    return response
+
+
+def metrics_view() -> Response:
+    """Metriche di tutti i processi nel formato testuale di Prometheus."""
+    response = Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+def init_app(app: Flask) -> None:
+    """Registra la raccolta delle metriche e l'endpoint ``/metrics``."""
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
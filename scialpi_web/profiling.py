@@ -0,0 +1,95 @@
+"""Profilazione su richiesta delle viste con ``cProfile``.
+
+È attiva solo se ``SCIALPI_PROFILE_USERS`` elenca almeno un utente (id o
+email). Un utente dell'elenco, con la sessione aperta, chiede il profilo
+di una richiesta con l'header ``X-Scialpi-Profile: 1`` o il parametro
+``?profile=1``: la vista viene eseguita sotto ``cProfile``, il profilo
+salvato con :func:`scialpi.profiling.save_profile` e il suo nome restituito
+nell'header ``X-Scialpi-Profile``. ``scialpi profiles`` elenca e riassume i
+profili salvati.
+"""
+
+from __future__ import annotations
+
+import cProfile
+import logging
+import pstats
+import time
+from typing import List
+
+from flask import Flask, Response, g, request, session
+
+from scialpi.config import get_profile_users
+from scialpi.profiling import save_profile
+from scialpi.user_manager import get_user
+
+PROFILE_HEADER = "X-Scialpi-Profile"
+_TRUE = ("1", "true", "yes", "on")
+
+logger = logging.getLogger(__name__)
+
+
+def _requested() -> bool:
+    value = request.headers.get(PROFILE_HEADER) or request.args.get("profile") or ""
+    return value.strip().lower() in _TRUE
+
+
+def _allowed(allowed: List[str]) -> bool:
+    user_id = session.get("user_id")
+    if not user_id:
+        return False
+    if str(user_id).lower() in allowed:
+        return True
+    user = get_user(str(user_id))
+    return bool(user and (user.get("email") or "").lower() in allowed)
+
+
+def _start_profile() -> None:
+    allowed = get_profile_users()
+    if not allowed or not _requested() or not _allowed(allowed):
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Un altro profiler è già attivo nel thread.
+        return
+    g.profiler = profiler
+    g.profile_started = time.perf_counter()
+
+
+def _save_profile(response: Response) -> Response:
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    duration = time.perf_counter() - g.pop("profile_started")
+    info = {
+        "method": request.method,
+        "path": request.full_path.rstrip("?"),
+        "endpoint": request.endpoint,
+        "user_id": session.get("user_id"),
+        "status": response.status_code,
+        "duration_seconds": round(duration, 6),
+    }
+    try:
+        name = save_profile(pstats.Stats(profiler), info)
+    except (OSError, TypeError) as exc:
+        logger.warning("Profilo di %s non salvato: %s", request.path, exc)
+        return response
+    response.headers[PROFILE_HEADER] = name
+    return response
+
+
+def _stop_profile(exc) -> None:
+    # Una vista che solleva un'eccezione non passa da ``after_request``.
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+
+
+def init_app(app: Flask) -> None:
+    """Registra la profilazione delle richieste degli utenti abilitati."""
+    app.before_request(_start_profile)
+    app.after_request(_save_profile)
+    app.teardown_request(_stop_profile)
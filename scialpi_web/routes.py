@@ -2,38 +2,53 @@
 
 from __future__ import annotations
 
+import base64
+import hashlib
 import json
 import math
-import urllib.parse
-import urllib.request
-import xml.etree.ElementTree as ET
+import mimetypes
+import os
 from functools import wraps
 from datetime import datetime, date
-from typing import Any, Dict, List, Optional
-from uuid import uuid4
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+from urllib.parse import quote
 
 from flask import (
     Blueprint,
     abort,
+    current_app,
     jsonify,
+    make_response,
     redirect,
     render_template,
     request,
+    g,
     session,
-    send_from_directory,
     url_for,
 )
-from werkzeug.utils import secure_filename
-
-from scialpi.config import get_base_dir
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+
+from scialpi.blobs import init_blobs, is_blob_name, store as store_blob
+from scialpi.config import get_base_dir, get_media_accel_prefix, get_media_offload
+from scialpi.images import VARIANT_SIZES, image_variant
+from scialpi.spatial import BBox, parse_bbox
+from scialpi.jobs import discard_upload, enqueue, get_job, init_jobs, job_summary, spool, spool_text
+from scialpi.track_store import LOD_TOLERANCES, level_for_tolerance, tolerance_for_zoom
+from scialpi.storage import version as collection_version
 from scialpi.trip_manager import (
     add_trip,
+    days_since,
     get_day,
     get_route,
+    get_routes,
     init_data,
     list_days,
     list_routes,
     list_trips,
+    page_days,
+    parse_day_date,
     read_trip,
     upsert_day,
     upsert_route,
@@ -46,8 +61,11 @@ from scialpi.user_manager import (
     create_reset_token,
     create_user,
     consume_reset_token,
+    get_friend_ids,
+    get_group_ids_for_user,
     get_user,
     get_user_by_email,
+    get_users,
     init_user_data,
     is_friend,
     is_member,
@@ -58,24 +76,32 @@ from scialpi.user_manager import (
     set_user_photo,
     set_password,
 )
-from scialpi.day_media import add_day_photo, init_media_data, list_day_photos
+from scialpi.day_media import init_media_data, list_day_photos
 from scialpi.post_manager import (
     add_comment,
     add_post,
     get_post,
     init_social_data,
-    list_comments,
-    list_posts,
+    list_day_thread,
 )
 from scialpi.avalanche_manager import (
     load_avalanches,
     add_avalanche as _add_avalanche,
     confirm_avalanche as _confirm_avalanche,
     filter_avalanches,
+    page_avalanches,
 )
 
 bp = Blueprint("scialpi", __name__, static_folder="static", static_url_path="/scialpi/static")
 
+# Dimensione predefinita e massima delle pagine per le API con ``limit``/``cursor``
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Durata in secondi della cache delle immagini caricate e, quando manca la variante
+# richiesta, dell'originale inviato al suo posto
+MEDIA_MAX_AGE = 365 * 24 * 3600
+MEDIA_FALLBACK_MAX_AGE = 3600
+
 
 @bp.app_context_processor
 def _inject_user():
@@ -99,42 +125,154 @@ def _login_required(view):
     return wrapper
 
 
+def _collections_etag(collections: Tuple[str, ...]) -> str:
+    parts = [f"{name}:{collection_version(name)}" for name in collections]
+    parts.append(f"viewer:{session.get('user_id') or ''}")
+    parts.extend(f"{key}={value}" for key, value in sorted(request.args.items(multi=True)))
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def _conditional(*collections: str):
+    """Gestisce ETag e ``If-None-Match`` per una API GET.
+
+    L'ETag dipende dalle versioni delle collezioni da cui la risposta è
+    calcolata, dall'utente della sessione e dai parametri della richiesta:
+    se il client ha già la versione corrente riceve un 304 prima di
+    qualsiasi filtro o serializzazione. Le versioni vengono lette prima di
+    calcolare la risposta, quindi una scrittura concorrente produce al più
+    un ETag vecchio, che alla richiesta successiva non corrisponde più.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET":
+                return view(*args, **kwargs)
+            etag = _collections_etag(collections)
+            if request.if_none_match.contains_weak(etag):
+                response = make_response("", 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+
+        return wrapper
+
+    return decorator
+
+
 def _parse_csv_ids(raw: Optional[str]) -> List[str]:
     if not raw:
         return []
     return [item.strip() for item in raw.split(",") if item.strip()]
 
 
-def _parse_filter_date(value: Optional[str]) -> Optional["date"]:
-    if not value:
-        return None
-    text = value.strip()
-    if not text:
+def _encode_cursor(key: Tuple[str, Any]) -> str:
+    raw = json.dumps(list(key), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(value: str) -> Tuple[str, Any]:
+    try:
+        raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+        key = json.loads(raw.decode("utf-8"))
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Cursore non valido") from None
+    if (
+        not isinstance(key, list)
+        or len(key) != 2
+        or not isinstance(key[0], str)
+        or isinstance(key[1], bool)
+        or not isinstance(key[1], (str, int))
+    ):
+        raise ValueError("Cursore non valido")
+    return key[0], key[1]
+
+
+def _parse_limit_arg(raw: Optional[str]) -> Optional[int]:
+    if not raw:
         return None
     try:
-        return datetime.strptime(text, "%Y-%m-%d").date()
+        limit = int(raw)
     except ValueError:
+        raise ValueError("Limite non valido") from None
+    if limit < 1:
+        raise ValueError("Limite non valido")
+    return limit
+
+
+def _parse_date_arg(raw: Optional[str]) -> Optional["date"]:
+    if not raw:
         return None
+    value = parse_day_date(raw)
+    if value is None:
+        raise ValueError("Data non valida")
+    return value
+
+
+def _parse_page_args(args) -> Tuple[Optional[int], Optional[Tuple[str, Any]]]:
+    """Legge ``limit`` e ``cursor``; ``(None, None)`` se la richiesta non è paginata."""
+    raw_limit = args.get("limit")
+    raw_cursor = args.get("cursor")
+    if not raw_limit and not raw_cursor:
+        return None, None
+    limit = PAGE_SIZE
+    if raw_limit:
+        limit = min(_parse_limit_arg(raw_limit), MAX_PAGE_SIZE)
+    cursor = _decode_cursor(raw_cursor) if raw_cursor else None
+    return limit, cursor
+
+
+def _parse_bbox_arg(args) -> Optional[BBox]:
+    """Legge ``bbox=min_lon,min_lat,max_lon,max_lat``; ``None`` se assente."""
+    raw = args.get("bbox")
+    return parse_bbox(raw) if raw else None
+
+
+def _parse_track_tolerance(args, route: Dict[str, Any]) -> float:
+    """Tolleranza in metri chiesta con ``tolerance`` o ricavata da ``zoom``."""
+    raw_tolerance = args.get("tolerance")
+    raw_zoom = args.get("zoom")
+    if raw_tolerance:
+        try:
+            tolerance_m = float(raw_tolerance)
+        except ValueError:
+            raise ValueError("Tolleranza non valida") from None
+        if not math.isfinite(tolerance_m) or tolerance_m < 0:
+            raise ValueError("Tolleranza non valida")
+        return tolerance_m
+    if raw_zoom:
+        try:
+            zoom = float(raw_zoom)
+        except ValueError:
+            raise ValueError("Zoom non valido") from None
+        if not 0 <= zoom <= 30:
+            raise ValueError("Zoom non valido")
+        lat = route.get("lat") if isinstance(route.get("lat"), (int, float)) else 0.0
+        return tolerance_for_zoom(zoom, lat)
+    return 0.0
+
+
+def _page_response(payload: List[Dict[str, Any]], next_key: Optional[Tuple[str, Any]]) -> Any:
+    response = jsonify(payload)
+    if next_key is not None:
+        response.headers["X-Next-Cursor"] = _encode_cursor(next_key)
+    return response
 
 
-def _parse_day_date(value: Optional[str]) -> Optional["date"]:
+def _parse_filter_date(value: Optional[str]) -> Optional["date"]:
     if not value:
         return None
     text = value.strip()
     if not text:
         return None
-    if "-" in text:
-        try:
-            return datetime.fromisoformat(text).date()
-        except ValueError:
-            pass
-    digits = "".join(ch for ch in text if ch.isdigit())
-    if len(digits) >= 8:
-        try:
-            return datetime.strptime(digits[:8], "%d%m%Y").date()
-        except ValueError:
-            return None
-    return None
+    try:
+        return datetime.strptime(text, "%Y-%m-%d").date()
+    except ValueError:
+        return None
 
 
 def _build_day_cards(days: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -146,14 +284,15 @@ def _build_day_cards(days: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         day_id = photo.get("day_id")
         if day_id and day_id not in photo_map:
             photo_map[day_id] = photo.get("filename")
+    routes = get_routes({day.get("route_id") for day in days})
     cards = []
     for day in days:
-        route = get_route(day.get("route_id"))
+        route = routes.get(day.get("route_id"))
         if not route:
             continue
         photo_filename = photo_map.get(day.get("id"))
         photo_url = (
-            url_for("scialpi.day_photo_file", filename=photo_filename)
+            url_for("scialpi.day_photo_file", filename=photo_filename, size="card")
             if photo_filename
             else None
         )
@@ -227,23 +366,58 @@ def _route_matches(route: Dict[str, Any], filters: Dict[str, Any]) -> bool:
     return True
 
 
+class VisibilityContext:
+    """Amicizie e gruppi del visitatore, per i controlli di visibilità.
+
+    Viene costruito una sola volta per richiesta da :func:`_visibility`: i
+    controlli sulle singole giornate diventano ricerche in insiemi, senza
+    rileggere amicizie, iscrizioni e gruppi per ogni giornata.
+    """
+
+    def __init__(self, user: Optional[Dict[str, Any]]) -> None:
+        self.user = user
+        self.user_id = user.get("id") if user else None
+        self.friend_ids = get_friend_ids(self.user_id) if self.user_id else set()
+        self.member_group_ids = get_group_ids_for_user(self.user_id) if self.user_id else set()
+        self.public_group_ids = {group.get("id") for group in list_groups() if group.get("is_public")}
+
+    def is_friend(self, owner_id: Optional[str]) -> bool:
+        return bool(owner_id and owner_id in self.friend_ids)
+
+    def is_member(self, group_id: str) -> bool:
+        return group_id in self.member_group_ids
+
+    def is_public_group(self, group_id: str) -> bool:
+        return group_id in self.public_group_ids
+
+
+def _visibility(user: Optional[Dict[str, Any]]) -> VisibilityContext:
+    contexts = g.setdefault("visibility_contexts", {})
+    user_id = user.get("id") if user else None
+    context = contexts.get(user_id)
+    if context is None:
+        context = contexts[user_id] = VisibilityContext(user)
+    return context
+
+
 def _day_matches(day: Dict[str, Any], user: Optional[Dict[str, Any]], filters: Dict[str, Any]) -> bool:
     visibility_filter = filters.get("visibility", "all")
     selected_group_ids = filters.get("group_ids") or []
     filter_date = filters.get("date")
     if filter_date:
-        day_date = _parse_day_date(day.get("date"))
+        day_date = parse_day_date(day.get("date"))
         if not day_date or day_date != filter_date:
             return False
+    context = _visibility(user)
     if visibility_filter == "all":
         return _is_day_visible(day, user)
     if visibility_filter == "friends":
-        if not user:
+        if not context.user_id:
             return False
         owner_id = day.get("owner_id")
-        if owner_id and owner_id == user.get("id"):
+        if owner_id and owner_id == context.user_id:
             return True
-        return bool(owner_id and is_friend(user.get("id"), owner_id))
+        return context.is_friend(owner_id)
     if visibility_filter == "groups":
         if day.get("visibility") != "groups":
             return False
@@ -254,15 +428,21 @@ def _day_matches(day: Dict[str, Any], user: Optional[Dict[str, Any]], filters: D
         if not day_groups:
             return False
         for group_id in day_groups:
-            group = next((g for g in list_groups() if g.get("id") == group_id), None)
-            if group and group.get("is_public"):
+            if context.is_public_group(group_id):
                 return True
-            if user and is_member(user.get("id"), group_id):
+            if context.user_id and context.is_member(group_id):
                 return True
         return False
     return _is_day_visible(day, user)
 
 
+def _filter_days(
+    days: List[Dict[str, Any]], user: Optional[Dict[str, Any]], filters: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    """Restituisce le giornate visibili a ``user`` che rispettano ``filters``."""
+    return [day for day in days if _day_matches(day, user, filters)]
+
+
 def _is_day_visible(day: Dict[str, Any], user: Optional[Dict[str, Any]]) -> bool:
     visibility = day.get("visibility") or "public"
     owner_id = day.get("owner_id")
@@ -272,216 +452,52 @@ def _is_day_visible(day: Dict[str, Any], user: Optional[Dict[str, Any]]) -> bool
         return True
     if visibility == "private":
         return False
+    context = _visibility(user)
     if visibility == "friends":
         if not user:
             return False
-        return bool(owner_id and is_friend(user.get("id"), owner_id))
+        return context.is_friend(owner_id)
     if visibility == "people":
         if not user:
             return False
         return user.get("id") in (day.get("people_ids") or [])
     if visibility == "groups":
         group_ids = day.get("group_ids") or []
-        for group_id in group_ids:
-            group = next((g for g in list_groups() if g.get("id") == group_id), None)
-            if group and group.get("is_public"):
-                return True
+        if any(context.is_public_group(group_id) for group_id in group_ids):
+            return True
         if not user:
             return False
-        for group_id in group_ids:
-            group = next((g for g in list_groups() if g.get("id") == group_id), None)
-            if group and group.get("is_public"):
-                return True
-            if is_member(user.get("id"), group_id):
-                return True
-        return False
+        return any(context.is_member(group_id) for group_id in group_ids)
     return False
 
 
-def _parse_gpx(file_storage) -> List[List[float]]:
-    try:
-        content = file_storage.read()
-        root = ET.fromstring(content)
-    except Exception:
-        return []
-    points: List[List[float]] = []
-    for elem in root.findall(".//{*}trkpt") + root.findall(".//{*}rtept"):
-        try:
-            lat = float(elem.attrib.get("lat"))
-            lon = float(elem.attrib.get("lon"))
-        except (TypeError, ValueError):
-            continue
-        ele = None
-        ele_node = elem.find(".//{*}ele")
-        if ele_node is not None and ele_node.text:
-            try:
-                ele = float(ele_node.text.strip())
-            except (TypeError, ValueError):
-                ele = None
-        if ele is not None:
-            points.append([lat, lon, ele])
-        else:
-            points.append([lat, lon])
-    return points
-
-
-def _fetch_elevations(points: List[List[float]]) -> List[List[float]]:
-    if not points:
-        return []
-    results: List[List[float]] = []
-    chunk_size = 100
-    for i in range(0, len(points), chunk_size):
-        chunk = points[i : i + chunk_size]
-        locations = "|".join(f"{p[0]},{p[1]}" for p in chunk)
-        url = (
-            "https://api.open-elevation.com/api/v1/lookup?locations="
-            + urllib.parse.quote(locations)
-        )
-        try:
-            with urllib.request.urlopen(url, timeout=10) as resp:
-                payload = json.loads(resp.read().decode("utf-8"))
-            data = payload.get("results", [])
-            if len(data) != len(chunk):
-                return points
-            for point, item in zip(chunk, data):
-                elev = item.get("elevation")
-                if elev is None:
-                    results.append(point)
-                else:
-                    results.append([point[0], point[1], float(elev)])
-        except Exception:
-            return points
-    return results
-
-
-def _ensure_elevation(points: List[List[float]]) -> List[List[float]]:
-    if not points:
-        return points
-    needs = any(len(p) < 3 or p[2] is None for p in points)
-    if not needs:
-        return points
-    fetched = _fetch_elevations(points)
-    enriched: List[List[float]] = []
-    for original, fetched_point in zip(points, fetched):
-        if len(original) > 2 and original[2] is not None:
-            enriched.append([original[0], original[1], float(original[2])])
-        elif len(fetched_point) > 2:
-            enriched.append([fetched_point[0], fetched_point[1], float(fetched_point[2])])
-        else:
-            enriched.append(original)
-    return enriched
-
+def _spool_track(gpx_file, track_points_raw: Any) -> Optional[Dict[str, Any]]:
+    """Salva la traccia caricata per il lavoro in background.
+
+    Restituisce la parte del payload che la descrive, ``None`` se la
+    richiesta non contiene né un GPX né ``track_points``.
+    """
+    if gpx_file and gpx_file.filename:
+        upload = spool(gpx_file, ".gpx")
+        return {"upload": upload, "format": "gpx", "files": [upload]}
+    if track_points_raw:
+        if not isinstance(track_points_raw, str):
+            track_points_raw = json.dumps(track_points_raw)
+        upload = spool_text(track_points_raw, ".json")
+        return {"upload": upload, "format": "json", "files": [upload]}
+    return None
 
-def _parse_iso_time(value: Optional[str]) -> Optional["datetime"]:
-    if not value:
-        return None
-    text = value.strip()
-    if not text:
-        return None
-    if text.endswith("Z"):
-        text = text[:-1] + "+00:00"
-    try:
-        return datetime.fromisoformat(text)
-    except ValueError:
-        return None
 
+def _job_accepted(job: Dict[str, Any], body: Optional[Dict[str, Any]] = None) -> Any:
+    """Risposta ``202`` per un caricamento accodato, con l'indirizzo per seguirlo."""
+    payload = dict(body or {})
+    payload["job"] = job_summary(job)
+    payload.setdefault("status", job.get("status"))
+    response = jsonify(payload)
+    response.status_code = 202
+    response.headers["Location"] = url_for("scialpi.job_api", job_id=job["id"])
+    return response
 
-def _parse_activity_gpx(file_storage) -> List[Dict[str, Any]]:
-    try:
-        content = file_storage.read()
-        root = ET.fromstring(content)
-    except Exception:
-        return []
-    points: List[Dict[str, Any]] = []
-    for elem in root.findall(".//{*}trkpt") + root.findall(".//{*}rtept"):
-        try:
-            lat = float(elem.attrib.get("lat"))
-            lon = float(elem.attrib.get("lon"))
-        except (TypeError, ValueError):
-            continue
-        ele = None
-        ele_node = elem.find(".//{*}ele")
-        if ele_node is not None and ele_node.text:
-            try:
-                ele = float(ele_node.text.strip())
-            except (TypeError, ValueError):
-                ele = None
-        time_node = elem.find(".//{*}time")
-        ts = _parse_iso_time(time_node.text.strip()) if time_node is not None and time_node.text else None
-        points.append({"lat": lat, "lon": lon, "ele": ele, "time": ts})
-    return points
-
-
-def haversine_meters(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    radius = 6371000.0
-    lat1_rad = math.radians(lat1)
-    lon1_rad = math.radians(lon1)
-    lat2_rad = math.radians(lat2)
-    lon2_rad = math.radians(lon2)
-    dlat = lat2_rad - lat1_rad
-    dlon = lon2_rad - lon1_rad
-    a = math.sin(dlat / 2) ** 2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon / 2) ** 2
-    c = 2 * math.asin(math.sqrt(a))
-    return radius * c
-
-
-def _compute_activity_stats(points: List[Dict[str, Any]]) -> Dict[str, Optional[float]]:
-    if not points or len(points) < 2:
-        return {
-            "distance_km": None,
-            "gain_m": None,
-            "loss_m": None,
-            "duration_h": None,
-            "pace_min_km": None,
-            "vam": None,
-            "up_hours": None,
-            "down_hours": None,
-        }
-    distance_m = 0.0
-    gain_m = 0.0
-    loss_m = 0.0
-    total_seconds = 0.0
-    up_seconds = 0.0
-    down_seconds = 0.0
-    prev = points[0]
-    for point in points[1:]:
-        distance_m += haversine_meters(prev["lat"], prev["lon"], point["lat"], point["lon"])
-        if prev.get("ele") is not None and point.get("ele") is not None:
-            delta = float(point["ele"]) - float(prev["ele"])
-            if delta > 0:
-                gain_m += delta
-            elif delta < 0:
-                loss_m += abs(delta)
-        if prev.get("time") and point.get("time"):
-            delta_t = (point["time"] - prev["time"]).total_seconds()
-            if delta_t > 0:
-                total_seconds += delta_t
-                if point.get("ele") is not None and prev.get("ele") is not None:
-                    if delta > 0:
-                        up_seconds += delta_t
-                    elif delta < 0:
-                        down_seconds += delta_t
-        prev = point
-    distance_km = round(distance_m / 1000, 2) if distance_m > 0 else None
-    duration_h = round(total_seconds / 3600, 2) if total_seconds > 0 else None
-    pace_min_km = None
-    if distance_km and total_seconds > 0:
-        pace_min_km = round((total_seconds / 60) / distance_km, 1)
-    vam = None
-    if duration_h and gain_m > 0:
-        vam = round(gain_m / duration_h, 0)
-    up_hours = round(up_seconds / 3600, 2) if up_seconds > 0 else None
-    down_hours = round(down_seconds / 3600, 2) if down_seconds > 0 else None
-    return {
-        "distance_km": distance_km,
-        "gain_m": int(round(gain_m)) if gain_m else None,
-        "loss_m": int(round(loss_m)) if loss_m else None,
-        "duration_h": duration_h,
-        "pace_min_km": pace_min_km,
-        "vam": vam,
-        "up_hours": up_hours,
-        "down_hours": down_hours,
-    }
 
 @bp.record_once
 def _ensure_data_dir(_state) -> None:
@@ -490,6 +506,8 @@ def _ensure_data_dir(_state) -> None:
     init_user_data()
     init_media_data()
     init_social_data()
+    init_jobs()
+    init_blobs()
 
 
 @bp.route("/")
@@ -507,12 +525,12 @@ def activities_page() -> str:
 @_login_required
 def profile_page() -> str:
     user = _current_user()
-    days = [day for day in list_days() if day.get("owner_id") == user.get("id")]
+    days = list_days(owner_id=user.get("id"))
     days.sort(key=lambda item: item.get("date", ""), reverse=True)
     public_days = [day for day in days if _is_day_visible(day, None)]
     photo_filename = user.get("photo_filename") if user else None
     photo_url = (
-        url_for("scialpi.user_photo_file", filename=photo_filename)
+        url_for("scialpi.user_photo_file", filename=photo_filename, size="card")
         if photo_filename
         else None
     )
@@ -532,21 +550,65 @@ def profile_photo_upload() -> Any:
     image = request.files.get("photo")
     if not image or not image.filename:
         return redirect(url_for("scialpi.profile_page"))
-    base_dir = get_base_dir()
-    upload_dir = base_dir / "user_photos"
-    upload_dir.mkdir(parents=True, exist_ok=True)
-    safe_name = secure_filename(image.filename)
-    filename = f"{uuid4().hex}_{safe_name}"
-    image.save(upload_dir / filename)
+    filename = store_blob(image.stream, "user_photos", image.filename)
     set_user_photo(user.get("id"), filename)
+    enqueue("image_variants", {"folder": "user_photos", "filename": filename})
     return redirect(url_for("scialpi.profile_page"))
 
 
+def _send_media(directory: Path, filename: str, etag: Union[bool, str], max_age: int) -> Any:
+    """Invia un file dei dati con cache, ETag e ``Range``, o ne affida l'invio al proxy."""
+    path = safe_join(str(directory), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    offload = get_media_offload()
+    if offload == "x-accel-redirect":
+        relative = Path(path).relative_to(get_base_dir()).as_posix()
+        response = current_app.response_class(
+            mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        )
+        response.headers["X-Accel-Redirect"] = get_media_accel_prefix() + quote(relative)
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        if isinstance(etag, str):
+            response.set_etag(etag)
+        response.make_conditional(request)
+    else:
+        response = send_file(
+            path,
+            request.environ,
+            etag=etag,
+            max_age=max_age,
+            use_x_sendfile=offload == "x-sendfile",
+        )
+    response.cache_control.immutable = max_age >= MEDIA_MAX_AGE
+    return response
+
+
+def _send_image(folder: str, filename: str) -> Any:
+    """Invia un'immagine caricata o, con ``?size=``, una sua variante ridotta.
+
+    I nomi dei file caricati non vengono mai riusati per un contenuto
+    diverso, quindi le risposte sono cacheabili per sempre. Per i file
+    dell'archivio per contenuto l'ETag è l'hash stesso.
+    """
+    digest = filename.split(".", 1)[0] if is_blob_name(filename) else None
+    size = request.args.get("size")
+    if size:
+        if size not in VARIANT_SIZES:
+            abort(400)
+        variant = image_variant(folder, filename, size)
+        if variant is not None:
+            etag = f"{digest}-{size}" if digest else True
+            return _send_media(variant.parent, variant.name, etag, MEDIA_MAX_AGE)
+        # Senza variante si invia l'originale, ma la variante potrebbe arrivare in seguito.
+        return _send_media(get_base_dir() / folder, filename, digest or True, MEDIA_FALLBACK_MAX_AGE)
+    return _send_media(get_base_dir() / folder, filename, digest or True, MEDIA_MAX_AGE)
+
+
 @bp.route("/users/photos/<path:filename>")
 def user_photo_file(filename: str):
-    base_dir = get_base_dir()
-    upload_dir = base_dir / "user_photos"
-    return send_from_directory(upload_dir, filename)
+    return _send_image("user_photos", filename)
 
 
 @bp.route("/people")
@@ -563,7 +625,7 @@ def people_page() -> str:
             continue
         photo_filename = entry.get("photo_filename")
         photo_url = (
-            url_for("scialpi.user_photo_file", filename=photo_filename)
+            url_for("scialpi.user_photo_file", filename=photo_filename, size="thumb")
             if photo_filename
             else None
         )
@@ -588,15 +650,11 @@ def people_profile(user_id: str) -> str:
         abort(404)
     view_mode = (request.args.get("view") or "").lower()
     viewer = None if view_mode == "public" else _current_user()
-    days = [
-        day
-        for day in list_days()
-        if day.get("owner_id") == user_id and _is_day_visible(day, viewer)
-    ]
+    days = [day for day in list_days(owner_id=user_id) if _is_day_visible(day, viewer)]
     days.sort(key=lambda item: item.get("date", ""), reverse=True)
     photo_filename = person.get("photo_filename")
     photo_url = (
-        url_for("scialpi.user_photo_file", filename=photo_filename)
+        url_for("scialpi.user_photo_file", filename=photo_filename, size="card")
         if photo_filename
         else None
     )
@@ -617,41 +675,21 @@ def activity_detail(day_id: str) -> str:
         abort(404)
     if not _is_day_visible(day, _current_user()):
         abort(403)
+    day = dict(day)
     people_emails = []
     for person_id in day.get("people_ids") or []:
         person = get_user(person_id)
         if person and person.get("email"):
             people_emails.append(person.get("email"))
     day["people_emails"] = people_emails
-    route = get_route(day.get("route_id"))
+    route = get_route(day.get("route_id"), include_track=True)
     photos = list_day_photos([day_id])
-    posts = list_posts(day_id)
-    enriched_posts = []
-    for post in posts:
-        author = get_user(post.get("user_id")) if post.get("user_id") else None
-        comments = list_comments(post.get("id"))
-        enriched_comments = []
-        for comment in comments:
-            comment_author = get_user(comment.get("user_id")) if comment.get("user_id") else None
-            enriched_comments.append(
-                {
-                    **comment,
-                    "author_name": comment_author.get("name") if comment_author else "Utente",
-                }
-            )
-        enriched_posts.append(
-            {
-                **post,
-                "author_name": author.get("name") if author else "Utente",
-                "comments": enriched_comments,
-            }
-        )
     return render_template(
         "activity_detail.html",
         day=day,
         route=route,
         photos=photos,
-        posts=enriched_posts,
+        posts=list_day_thread(day_id),
     )
 
 
@@ -779,8 +817,6 @@ def trip_create() -> str:
         snow = request.form.get("snow") or None
         weather = request.form.get("weather") or None
         notes = request.form.get("notes") or None
-        track_points_raw = request.form.get("track_points") or ""
-        gpx_file = request.files.get("gpx")
         # Converte alcuni campi
         try:
             lat_float = float(lat) if lat else None
@@ -791,49 +827,26 @@ def trip_create() -> str:
         gain_int = int(gain) if gain else None
         distance_float = float(distance_km) if distance_km else None
         avalanche_int = int(avalanche) if avalanche else None
-        track_points: List[List[float]] = []
-        if gpx_file and gpx_file.filename:
-            track_points = _parse_gpx(gpx_file)
-        elif track_points_raw:
-            try:
-                parsed = json.loads(track_points_raw)
-                if isinstance(parsed, list):
-                    for point in parsed:
-                        if (
-                            isinstance(point, list)
-                            and len(point) >= 2
-                            and isinstance(point[0], (int, float))
-                            and isinstance(point[1], (int, float))
-                        ):
-                            if len(point) >= 3 and isinstance(point[2], (int, float)):
-                                track_points.append([float(point[0]), float(point[1]), float(point[2])])
-                            else:
-                                track_points.append([float(point[0]), float(point[1])])
-            except json.JSONDecodeError:
-                track_points = []
-        if track_points:
-            track_points = _ensure_elevation(track_points)
-            if lat_float is None or lon_float is None:
-                last_point = track_points[-1]
-                lat_float = float(last_point[0])
-                lon_float = float(last_point[1])
-        slug = add_trip(
-            date=date,
-            title=title,
-            area=area,
-            lat=lat_float,
-            lon=lon_float,
-            gain=gain_int,
-            distance_km=distance_float,
-            duration=duration,
-            difficulty=difficulty,
-            specs=specs,
-            track=track_points,
-            avalanche=avalanche_int,
-            snow=snow,
-            weather=weather,
-            notes=notes,
-        )
+        trip = {
+            "date": date,
+            "title": title,
+            "area": area,
+            "gain": gain_int,
+            "distance_km": distance_float,
+            "duration": duration,
+            "difficulty": difficulty,
+            "specs": specs,
+            "avalanche": avalanche_int,
+            "snow": snow,
+            "weather": weather,
+            "notes": notes,
+        }
+        upload = _spool_track(request.files.get("gpx"), request.form.get("track_points"))
+        if upload:
+            # Lettura della traccia e quote in background
+            job = enqueue("trip_upload", dict(upload, trip=trip, lat=lat_float, lon=lon_float))
+            return redirect(url_for("scialpi.job_page", job_id=job["id"]))
+        slug = add_trip(lat=lat_float, lon=lon_float, track=[], **trip)
         return redirect(url_for("scialpi.trip_detail", slug=slug))
     return redirect(url_for("scialpi.trips_map"))
 
@@ -845,13 +858,25 @@ def trips_map() -> str:
 
 
 @bp.route("/api/trips")
+@_conditional("days", "routes")
 def trips_api() -> Any:
-    """API per leggere le gite registrate (usata dalla mappa)."""
-    trips = list_trips()
+    """API per leggere le gite registrate (usata dalla mappa).
+
+    ``start`` ed ``end`` limitano l'intervallo di date, ``limit`` il numero
+    di gite restituite.
+    """
+    try:
+        start = _parse_date_arg(request.args.get("start"))
+        end = _parse_date_arg(request.args.get("end"))
+        limit = _parse_limit_arg(request.args.get("limit"))
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    trips = list_trips(start=start, end=end, limit=limit)
     return jsonify(trips)
 
 
 @bp.route("/api/routes", methods=["GET", "POST"])
+@_conditional("routes", "days", "friends", "memberships", "groups")
 def routes_api() -> Any:
     """API per leggere o creare percorsi."""
     if request.method == "POST":
@@ -862,82 +887,125 @@ def routes_api() -> Any:
         name = data.get("name") or None
         description = data.get("description") or None
         difficulty = data.get("difficulty") or None
-        track_points: List[List[float]] = []
-        gpx_file = request.files.get("gpx")
-        track_points_raw = data.get("track_points") or ""
-        if gpx_file and gpx_file.filename:
-            track_points = _parse_gpx(gpx_file)
-        elif track_points_raw:
-            try:
-                parsed = json.loads(track_points_raw)
-                if isinstance(parsed, list):
-                    for point in parsed:
-                        if (
-                            isinstance(point, list)
-                            and len(point) >= 2
-                            and isinstance(point[0], (int, float))
-                            and isinstance(point[1], (int, float))
-                        ):
-                            if len(point) >= 3 and isinstance(point[2], (int, float)):
-                                track_points.append([float(point[0]), float(point[1]), float(point[2])])
-                            else:
-                                track_points.append([float(point[0]), float(point[1])])
-            except json.JSONDecodeError:
-                track_points = []
-        if track_points:
-            track_points = _ensure_elevation(track_points)
-        if not route_id and not track_points:
+        upload = _spool_track(request.files.get("gpx"), data.get("track_points"))
+        if not route_id and not upload:
             return jsonify({"error": "Traccia obbligatoria per creare il percorso"}), 400
         if not name:
+            if upload:
+                discard_upload(upload)
             return jsonify({"error": "Nome percorso obbligatorio"}), 400
+        if upload:
+            payload = dict(upload, route_id=route_id, name=name, description=description, difficulty=difficulty)
+            job = enqueue("route_upload", payload, owner_id=_current_user().get("id"))
+            return _job_accepted(job)
         route = upsert_route(
             name=name,
             description=description,
             difficulty=difficulty,
-            track=track_points or None,
+            track=None,
             route_id=route_id,
         )
         return jsonify(route), 201
     filters = _parse_route_filters(request.args)
+    try:
+        limit, cursor = _parse_page_args(request.args)
+        bbox = _parse_bbox_arg(request.args)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
 
-    routes = list_routes()
     user = _current_user()
+    routes = list_routes(bbox)
+    if limit is not None:
+        return _routes_page(user, filters, limit, cursor, routes)
+    visible_route_ids = {day.get("route_id") for day in _filter_days(list_days(), user, filters)}
     payload = []
     for route in routes:
-        days = list_days(route.get("id"))
-        visible_days = [day for day in days if _day_matches(day, user, filters)]
-        if not visible_days:
+        if route.get("id") not in visible_route_ids:
             continue
         if not _route_matches(route, filters):
             continue
-        payload.append(
-            {
-                "id": route.get("id"),
-                "name": route.get("name"),
-                "description": route.get("description"),
-                "difficulty": route.get("difficulty"),
-                "gain": route.get("gain"),
-                "distance_km": route.get("distance_km"),
-                "lat": route.get("lat"),
-                "lon": route.get("lon"),
-            }
-        )
+        payload.append(_route_summary(route))
     return jsonify(payload)
 
 
+def _route_summary(route: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": route.get("id"),
+        "name": route.get("name"),
+        "description": route.get("description"),
+        "difficulty": route.get("difficulty"),
+        "gain": route.get("gain"),
+        "distance_km": route.get("distance_km"),
+        "lat": route.get("lat"),
+        "lon": route.get("lon"),
+    }
+
+
+def _routes_page(
+    user: Optional[Dict[str, Any]],
+    filters: Dict[str, Any],
+    limit: int,
+    cursor: Optional[Tuple[str, Any]],
+    routes: List[Dict[str, Any]],
+) -> Any:
+    """Percorsi ordinati per la giornata visibile più recente.
+
+    Si scorrono le giornate dalla più recente e ogni percorso compare alla
+    sua prima giornata visibile. Il cursore è la chiave di quella giornata:
+    un percorso con una giornata visibile non più vecchia del cursore è già
+    stato restituito in una pagina precedente. ``routes`` sono i percorsi
+    candidati, ai quali si applicano i filtri.
+    """
+    matching = {route.get("id"): route for route in routes if _route_matches(route, filters)}
+    seen: set = set()
+
+    def accept(day: Dict[str, Any]) -> bool:
+        route_id = day.get("route_id")
+        if route_id not in matching or route_id in seen or not _day_matches(day, user, filters):
+            return False
+        seen.add(route_id)
+        return True
+
+    try:
+        if cursor is not None:
+            # I percorsi con una giornata visibile dal cursore in poi sono
+            # già stati restituiti: un solo passaggio sulle giornate più recenti.
+            seen.update(
+                day.get("route_id")
+                for day in days_since(cursor)
+                if day.get("route_id") in matching and _day_matches(day, user, filters)
+            )
+        days, next_key = page_days(limit, cursor, accept)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    return _page_response([_route_summary(matching[day.get("route_id")]) for day in days], next_key)
+
+
 @bp.route("/api/routes/<route_id>")
 def route_detail_api(route_id: str) -> Any:
-    """API per i dettagli di un percorso."""
+    """API per i dettagli di un percorso.
+
+    ``tolerance`` (metri) oppure ``zoom`` (livello della mappa) chiedono la
+    traccia semplificata adatta alla scala di visualizzazione.
+    """
     route = get_route(route_id)
     if not route:
         return jsonify({"error": "Percorso non trovato"}), 404
+    try:
+        tolerance_m = _parse_track_tolerance(request.args, route)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    route = get_route(route_id, include_track=True, tolerance_m=tolerance_m)
+    if tolerance_m:
+        route["track_tolerance_m"] = LOD_TOLERANCES[level_for_tolerance(tolerance_m)]
     user = _current_user()
-    days = [day for day in list_days(route_id) if _is_day_visible(day, user)]
+    days = [dict(day) for day in list_days(route_id) if _is_day_visible(day, user)]
     days.sort(key=lambda item: item.get("date", ""), reverse=True)
+    people = get_users({person_id for day in days for person_id in day.get("people_ids") or []})
     for day in days:
         people_emails = []
         for person_id in day.get("people_ids") or []:
-            person = get_user(person_id)
+            person = people.get(person_id)
             if person and person.get("email"):
                 people_emails.append(person.get("email"))
         day["people_emails"] = people_emails
@@ -998,66 +1066,85 @@ def friends_api() -> Any:
     return jsonify(friend), 201
 
 
+def _day_summary(
+    day: Dict[str, Any],
+    route: Dict[str, Any],
+    photo_map: Dict[str, str],
+    owners: Dict[str, Dict[str, Any]],
+) -> Dict[str, Any]:
+    owner_name = None
+    owner = owners.get(day.get("owner_id"))
+    if owner:
+        owner_name = owner.get("name")
+    photo_filename = photo_map.get(day.get("id"))
+    photo_url = (
+        url_for("scialpi.day_photo_file", filename=photo_filename, size="card")
+        if photo_filename
+        else None
+    )
+    return {
+        "id": day.get("id"),
+        "route_id": day.get("route_id"),
+        "date": day.get("date"),
+        "snow_quality": day.get("snow_quality"),
+        "description": day.get("description"),
+        "weather": day.get("weather"),
+        "avalanches_seen": day.get("avalanches_seen"),
+        "activity_distance_km": day.get("activity_distance_km"),
+        "activity_gain_m": day.get("activity_gain_m"),
+        "activity_loss_m": day.get("activity_loss_m"),
+        "activity_duration_h": day.get("activity_duration_h"),
+        "activity_pace_min_km": day.get("activity_pace_min_km"),
+        "activity_vam": day.get("activity_vam"),
+        "activity_up_hours": day.get("activity_up_hours"),
+        "activity_down_hours": day.get("activity_down_hours"),
+        "route_name": route.get("name"),
+        "route_difficulty": route.get("difficulty"),
+        "route_gain": route.get("gain"),
+        "route_distance_km": route.get("distance_km"),
+        "lat": route.get("lat"),
+        "lon": route.get("lon"),
+        "owner_name": owner_name,
+        "photo_filename": photo_filename,
+        "photo_url": photo_url,
+    }
+
+
 @bp.route("/api/days", methods=["GET", "POST"])
+@_conditional("days", "routes", "users", "day_photos", "friends", "memberships", "groups")
 def days_api() -> Any:
     """API per creare o modificare una giornata."""
     if request.method == "GET":
         filters = _parse_route_filters(request.args)
+        try:
+            limit, cursor = _parse_page_args(request.args)
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 400
         user = _current_user()
-        days_source = list_days()
+        # I filtri sui percorsi si applicano una volta sola a tutti i percorsi.
+        routes = {route.get("id"): route for route in list_routes() if _route_matches(route, filters)}
+
+        def accept(day: Dict[str, Any]) -> bool:
+            return day.get("route_id") in routes and _day_matches(day, user, filters)
+
+        next_key = None
+        if limit is None:
+            days = [day for day in list_days() if accept(day)]
+        else:
+            try:
+                days, next_key = page_days(limit, cursor, accept)
+            except ValueError as exc:
+                return jsonify({"error": str(exc)}), 400
         photo_map: Dict[str, str] = {}
-        for photo in list_day_photos([day.get("id") for day in days_source]):
+        for photo in list_day_photos([day.get("id") for day in days]):
             day_id = photo.get("day_id")
             if day_id and day_id not in photo_map:
                 photo_map[day_id] = photo.get("filename")
-        payload = []
-        for day in days_source:
-            if not _day_matches(day, user, filters):
-                continue
-            route = get_route(day.get("route_id"))
-            if not route or not _route_matches(route, filters):
-                continue
-            owner_name = None
-            if day.get("owner_id"):
-                owner = get_user(day.get("owner_id"))
-                if owner:
-                    owner_name = owner.get("name")
-            photo_filename = photo_map.get(day.get("id"))
-            photo_url = (
-                url_for("scialpi.day_photo_file", filename=photo_filename)
-                if photo_filename
-                else None
-            )
-            payload.append(
-                {
-                    "id": day.get("id"),
-                    "route_id": day.get("route_id"),
-                    "date": day.get("date"),
-                    "snow_quality": day.get("snow_quality"),
-                    "description": day.get("description"),
-                    "weather": day.get("weather"),
-                    "avalanches_seen": day.get("avalanches_seen"),
-                    "activity_distance_km": day.get("activity_distance_km"),
-                    "activity_gain_m": day.get("activity_gain_m"),
-                    "activity_loss_m": day.get("activity_loss_m"),
-                    "activity_duration_h": day.get("activity_duration_h"),
-                    "activity_pace_min_km": day.get("activity_pace_min_km"),
-                    "activity_vam": day.get("activity_vam"),
-                    "activity_up_hours": day.get("activity_up_hours"),
-                    "activity_down_hours": day.get("activity_down_hours"),
-                    "route_name": route.get("name"),
-                    "route_difficulty": route.get("difficulty"),
-                    "route_gain": route.get("gain"),
-                    "route_distance_km": route.get("distance_km"),
-                    "lat": route.get("lat"),
-                    "lon": route.get("lon"),
-                    "owner_name": owner_name,
-                    "photo_filename": photo_filename,
-                    "photo_url": photo_url,
-                }
-            )
-        payload.sort(key=lambda item: item.get("date", ""), reverse=True)
-        return jsonify(payload)
+        owners = get_users({day.get("owner_id") for day in days if day.get("owner_id")})
+        payload = [_day_summary(day, routes[day.get("route_id")], photo_map, owners) for day in days]
+        if limit is None:
+            payload.sort(key=lambda item: item.get("date", ""), reverse=True)
+        return _page_response(payload, next_key)
 
     data = request.form or request.get_json(silent=True) or {}
     user = _current_user()
@@ -1092,13 +1179,6 @@ def days_api() -> Any:
             person = get_user_by_email(email)
             if person:
                 people_ids.append(person.get("id"))
-    activity_stats = None
-    activity_gpx = request.files.get("activity_gpx")
-    if activity_gpx and activity_gpx.filename:
-        points = _parse_activity_gpx(activity_gpx)
-        if len(points) < 2:
-            return jsonify({"error": "GPX attivita non valido"}), 400
-        activity_stats = _compute_activity_stats(points)
     day = upsert_day(
         route_id=route_id,
         date=date,
@@ -1111,8 +1191,13 @@ def days_api() -> Any:
         people_ids=people_ids,
         owner_id=user.get("id"),
         day_id=day_id,
-        activity_stats=activity_stats,
     )
+    activity_gpx = request.files.get("activity_gpx")
+    if activity_gpx and activity_gpx.filename:
+        # Le statistiche dell'attività arrivano quando il lavoro è concluso.
+        upload = spool(activity_gpx, ".gpx")
+        job = enqueue("activity_upload", {"day_id": day["id"], "upload": upload, "files": [upload]}, owner_id=user.get("id"))
+        return _job_accepted(job, day)
     return jsonify(day), 201
 
 
@@ -1124,6 +1209,7 @@ def day_detail_api(day_id: str) -> Any:
         return jsonify({"error": "Giornata non trovata"}), 404
     if not _is_day_visible(day, _current_user()):
         return jsonify({"error": "Non autorizzato"}), 403
+    day = dict(day)
     people_emails = []
     for person_id in day.get("people_ids") or []:
         person = get_user(person_id)
@@ -1133,6 +1219,18 @@ def day_detail_api(day_id: str) -> Any:
     return jsonify(day)
 
 
+@bp.route("/api/days/<day_id>/posts")
+@_conditional("days", "posts", "comments", "users", "friends", "memberships", "groups")
+def day_posts_api(day_id: str) -> Any:
+    """API per i post di una giornata, con commenti e nomi degli autori."""
+    day = get_day(day_id)
+    if not day:
+        return jsonify({"error": "Giornata non trovata"}), 404
+    if not _is_day_visible(day, _current_user()):
+        return jsonify({"error": "Non autorizzato"}), 403
+    return jsonify(list_day_thread(day_id))
+
+
 @bp.route("/api/trips/<slug>")
 def trip_detail_api(slug: str) -> Any:
     """API per leggere i dettagli di una gita."""
@@ -1168,6 +1266,7 @@ def avalanches_page() -> str:
 
 
 @bp.route("/api/avalanches", methods=["GET", "POST"])
+@_conditional("avalanches")
 def avalanches_api() -> Any:
     """API per creare e leggere le segnalazioni di valanghe."""
     if request.method == "POST":
@@ -1196,12 +1295,8 @@ def avalanches_api() -> Any:
             return jsonify({"error": "Pendenza non valida"}), 400
         image = request.files.get("image")
         if image and image.filename:
-            base_dir = get_base_dir()
-            upload_dir = base_dir / "avalanche_images"
-            upload_dir.mkdir(parents=True, exist_ok=True)
-            safe_name = secure_filename(image.filename)
-            image_filename = f"{uuid4().hex}_{safe_name}"
-            image.save(upload_dir / image_filename)
+            image_filename = store_blob(image.stream, "avalanche_images", image.filename)
+            enqueue("image_variants", {"folder": "avalanche_images", "filename": image_filename})
         user = _current_user()
         record = _add_avalanche(
             lat,
@@ -1217,11 +1312,20 @@ def avalanches_api() -> Any:
     # GET: filtra per intervallo temporale
     start_param = request.args.get("start")
     end_param = request.args.get("end")
+    try:
+        bbox = _parse_bbox_arg(request.args)
+        limit, cursor = _parse_page_args(request.args)
+        if limit is not None:
+            if cursor is not None and not isinstance(cursor[1], int):
+                raise ValueError("Cursore non valido")
+            return _page_response(*page_avalanches(limit, cursor, start_param, end_param, bbox))
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
     avalanches: List[Dict[str, Any]]
     if start_param or end_param:
-        avalanches = filter_avalanches(start_param, end_param)
+        avalanches = filter_avalanches(start_param, end_param, bbox)
     else:
-        avalanches = load_avalanches()
+        avalanches = load_avalanches(bbox)
         avalanches.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
     return jsonify(avalanches)
 
@@ -1243,9 +1347,7 @@ def avalanches_confirm_api(avalanche_id: int) -> Any:
 @bp.route("/avalanches/images/<path:filename>")
 def avalanches_image(filename: str):
     """Serve le immagini salvate per le segnalazioni di valanghe."""
-    base_dir = get_base_dir()
-    upload_dir = base_dir / "avalanche_images"
-    return send_from_directory(upload_dir, filename)
+    return _send_image("avalanche_images", filename)
 
 
 @bp.route("/api/days/<day_id>/photos", methods=["POST"])
@@ -1282,18 +1384,50 @@ def day_photos_api(day_id: str) -> Any:
     except (TypeError, ValueError):
         lat = None
         lon = None
-    base_dir = get_base_dir()
-    upload_dir = base_dir / "day_photos"
-    upload_dir.mkdir(parents=True, exist_ok=True)
-    safe_name = secure_filename(image.filename)
-    filename = f"{uuid4().hex}_{safe_name}"
-    image.save(upload_dir / filename)
-    record = add_day_photo(day_id, filename, lat, lon, user.get("id"))
-    return jsonify(record), 201
+    payload = {
+        "day_id": day_id,
+        "filename": store_blob(image.stream, "day_photos", image.filename),
+        "lat": lat,
+        "lon": lon,
+        "owner_id": user.get("id"),
+    }
+    return _job_accepted(enqueue("day_photo", payload, owner_id=user.get("id")))
+
+
+def _visible_job(job_id: str) -> Optional[Dict[str, Any]]:
+    job = get_job(job_id)
+    if not job:
+        return None
+    owner_id = job.get("owner_id")
+    user = _current_user()
+    if owner_id and (not user or user.get("id") != owner_id):
+        return None
+    return job
+
+
+@bp.route("/api/jobs/<job_id>")
+def job_api(job_id: str) -> Any:
+    """Stato di un caricamento in elaborazione."""
+    job = _visible_job(job_id)
+    if not job:
+        return jsonify({"error": "Lavoro non trovato"}), 404
+    response = jsonify(job_summary(job))
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+@bp.route("/jobs/<job_id>")
+def job_page(job_id: str) -> Any:
+    """Pagina di attesa dei caricamenti dal form web: rimanda alla gita quando è pronta."""
+    job = _visible_job(job_id)
+    if not job:
+        abort(404)
+    result = job.get("result") or {}
+    if job.get("status") == "done" and result.get("slug"):
+        return redirect(url_for("scialpi.trip_detail", slug=result["slug"]))
+    return render_template("job.html", job=job_summary(job))
 
 
 @bp.route("/days/photos/<path:filename>")
 def day_photo_file(filename: str):
-    base_dir = get_base_dir()
-    upload_dir = base_dir / "day_photos"
-    return send_from_directory(upload_dir, filename)
+    return _send_image("day_photos", filename)
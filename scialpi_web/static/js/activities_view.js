@@ -196,7 +196,7 @@ document.addEventListener('DOMContentLoaded', () => {
   function photoUrl(item) {
     if (item.photo_url) return item.photo_url;
     if (!item.photo_filename) return null;
-    return `/days/photos/${encodeURIComponent(item.photo_filename)}`;
+    return `/days/photos/${encodeURIComponent(item.photo_filename)}?size=card`;
   }
 
   function updateDetails(item) {
@@ -55,7 +55,7 @@ document.addEventListener('DOMContentLoaded', () => {
     if (item.slope) parts.push(`Pendenza: ${item.slope} deg`);
     parts.push(`Conferme: ${item.confirmations}`);
     if (item.image) {
-      const url = `/avalanches/images/${item.image}`;
+      const url = `/avalanches/images/${item.image}?size=full`;
       parts.push(`<a href="${url}" target="_blank" rel="noopener">Immagine</a>`);
     }
     return parts.join('<br>');
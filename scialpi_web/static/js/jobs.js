@@ -0,0 +1,48 @@
+// Attesa dei caricamenti elaborati in background (vedi /api/jobs/<id>)
+(function () {
+  const POLL_MS = 1000;
+
+  // Restituisce una promise risolta con il lavoro concluso, rifiutata se fallisce.
+  function waitForJob(job) {
+    return new Promise((resolve, reject) => {
+      const check = (current) => {
+        if (!current || current.status === 'done') {
+          resolve(current);
+          return;
+        }
+        if (current.status === 'failed') {
+          reject(new Error(current.error || 'Errore durante l\'elaborazione.'));
+          return;
+        }
+        setTimeout(() => {
+          fetch(`/api/jobs/${current.id}`)
+            .then((res) => {
+              if (!res.ok) {
+                throw new Error('Stato del caricamento non disponibile.');
+              }
+              return res.json();
+            })
+            .then(check)
+            .catch(reject);
+        }, POLL_MS);
+      };
+      check(job);
+    });
+  }
+
+  // Legge la risposta di un caricamento: se è stato accodato (202) aspetta il lavoro.
+  function handleUploadResponse(res) {
+    return res.json().then((payload) => {
+      if (!res.ok) {
+        throw new Error(payload.error || 'Errore nel caricamento.');
+      }
+      if (res.status === 202 && payload.job) {
+        return waitForJob(payload.job).then((job) => ({ payload, result: job ? job.result || {} : {} }));
+      }
+      return { payload, result: null };
+    });
+  }
+
+  window.waitForJob = waitForJob;
+  window.handleUploadResponse = handleUploadResponse;
+})();
@@ -632,14 +632,7 @@ document.addEventListener('DOMContentLoaded', () => {
         method: 'POST',
         body: formData
       })
-        .then((res) => {
-          if (!res.ok) {
-            return res.json().then((payload) => {
-              throw new Error(payload.error || 'Errore nel caricamento.');
-            });
-          }
-          return res.json();
-        })
+        .then(handleUploadResponse)
         .then(() => {
           index += 1;
           if (index < total) {
@@ -677,7 +670,7 @@ document.addEventListener('DOMContentLoaded', () => {
       return;
     }
     photos.forEach((photo) => {
-      const url = `/days/photos/${encodeURIComponent(photo.filename)}`;
+      const url = `/days/photos/${encodeURIComponent(photo.filename)}?size=thumb`;
       if (typeof photo.lat === 'number' && typeof photo.lon === 'number') {
         const marker = L.circleMarker([photo.lat, photo.lon], {
           radius: 5,
@@ -1128,17 +1121,18 @@ document.addEventListener('DOMContentLoaded', () => {
         method: 'POST',
         body: formData
       })
-        .then((res) => res.json())
-        .then((route) => {
+        .then(handleUploadResponse)
+        .then(({ payload, result }) => {
           routeStatusEl.textContent = 'Percorso salvato.';
+          const route = result && result.route ? result.route : payload;
           if (route && route.id) {
             loadRoutes(route.id);
           } else {
             loadRoutes();
           }
         })
-        .catch(() => {
-          routeStatusEl.textContent = 'Errore nel salvataggio.';
+        .catch((err) => {
+          routeStatusEl.textContent = err.message || 'Errore nel salvataggio.';
         });
     });
   }
@@ -1157,15 +1151,8 @@ document.addEventListener('DOMContentLoaded', () => {
         method: 'POST',
         body: formData
       })
-        .then((res) => {
-          if (!res.ok) {
-            return res.json().then((payload) => {
-              throw new Error(payload.error || 'Errore nel salvataggio.');
-            });
-          }
-          return res.json();
-        })
-        .then((day) => {
+        .then(handleUploadResponse)
+        .then(({ payload: day }) => {
           dayStatusEl.textContent = 'Giornata salvata.';
           if (day && day.route_id) {
             selectRoute(day.route_id, day.id);
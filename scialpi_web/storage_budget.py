@@ -0,0 +1,67 @@
+"""Conteggio degli accessi alle collezioni per ogni richiesta.
+
+Ogni richiesta viene eseguita dentro :func:`scialpi.storage.track_accesses`.
+Se una collezione viene letta più di ``SCIALPI_STORAGE_BUDGET`` volte
+(vedi :mod:`scialpi.config`) si registra un avviso con l'endpoint, i
+conteggi e lo stack della chiamata che ha superato il limite: è il segno
+di una vista che chiama ``get_user``, ``get_route`` o ``is_member`` in un
+ciclo. Con ``SCIALPI_STORAGE_DEBUG=1`` le risposte riportano i conteggi
+negli header ``X-Scialpi-Storage`` e ``X-Scialpi-Storage-Loads``.
+"""
+
+from __future__ import annotations
+
+import logging
+from contextlib import ExitStack
+from typing import Optional
+
+from flask import Flask, Response, g, request
+
+from scialpi import storage
+from scialpi.config import get_storage_budget, get_storage_debug
+
+logger = logging.getLogger(__name__)
+
+
+def _start_tracking() -> None:
+    stack = ExitStack()
+    g.storage_accesses = stack.enter_context(storage.track_accesses(get_storage_budget()))
+    g.storage_tracking = stack
+
+
+def _add_headers(response: Response) -> Response:
+    log = g.get("storage_accesses")
+    if log is not None and get_storage_debug():
+        response.headers["X-Scialpi-Storage"] = log.summary()
+        if log.loads:
+            response.headers["X-Scialpi-Storage-Loads"] = ", ".join(
+                f"{name}={count}" for name, count in sorted(log.loads.items())
+            )
+    return response
+
+
+def _stop_tracking(exc: Optional[BaseException]) -> None:
+    stack = g.pop("storage_tracking", None)
+    log = g.pop("storage_accesses", None)
+    if stack is None:
+        return
+    stack.close()
+    for name, count in sorted(log.over_budget().items()):
+        logger.warning(
+            "%s %s (%s): %d accessi a %s, limite %d [%s]\n  %s",
+            request.method,
+            request.path,
+            request.endpoint or "unmatched",
+            count,
+            name,
+            log.budget,
+            log.summary(),
+            "\n  ".join(log.stacks.get(name, [])),
+        )
+
+
+def init_app(app: Flask) -> None:
+    """Registra il conteggio degli accessi alle collezioni per ogni richiesta."""
+    app.before_request(_start_tracking)
+    app.after_request(_add_headers)
+    app.teardown_request(_stop_tracking)
@@ -0,0 +1,32 @@
+"""Fixture comuni dei test: ogni test lavora in una directory dati temporanea."""
+
+from __future__ import annotations
+
+import os
+
+import pytest
+
+from scialpi import storage
+from scialpi.config import DATA_ENV, STORAGE_ENV
+
+
+@pytest.fixture(autouse=True, scope="session")
+def _default_home(tmp_path_factory):
+    # Le metriche salvate all'uscita dell'interprete non finiscono in data/.
+    os.environ[DATA_ENV] = str(tmp_path_factory.mktemp("home"))
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def backend(request) -> str:
+    return request.param
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch, request):
+    """Directory dati vuota, con il backend del parametro ``backend`` se richiesto."""
+    monkeypatch.setenv(DATA_ENV, str(tmp_path))
+    kind = request.getfixturevalue("backend") if "backend" in request.fixturenames else "json"
+    monkeypatch.setenv(STORAGE_ENV, kind)
+    storage.invalidate()
+    yield tmp_path
+    storage.invalidate()
@@ -0,0 +1,85 @@
+"""Test di :mod:`scialpi.blobs`: riferimenti e pulizia dei file caricati."""
+
+from __future__ import annotations
+
+import io
+from datetime import datetime, timedelta
+
+import pytest
+
+from scialpi import blobs, jobs, storage
+from scialpi.config import JOB_WORKERS_ENV
+
+
+@pytest.fixture(autouse=True)
+def no_workers(monkeypatch):
+    # I lavori vengono eseguiti dal test, come con un ``scialpi worker`` separato.
+    monkeypatch.setenv(JOB_WORKERS_ENV, "0")
+
+
+def _later(hours: float = 2) -> datetime:
+    return datetime.utcnow() + timedelta(hours=hours)
+
+
+def test_store_deduplicates(data_dir):
+    first = blobs.store(io.BytesIO(b"foto"), "day_photos", "a.JPEG")
+    second = blobs.store(io.BytesIO(b"foto"), "day_photos", "b.jpg")
+    assert first == second
+    assert first.endswith(".jpg")
+    assert [path.name for path in (data_dir / "day_photos").iterdir()] == [first]
+    assert (data_dir / "day_photos" / first).stat().st_mode & 0o777 == 0o644
+
+
+def test_unreferenced_blob_collected_after_grace(data_dir):
+    name = blobs.store(io.BytesIO(b"foto"), "day_photos", "a.jpg")
+    assert blobs.collect()["files"] == 0
+    assert blobs.collect(now=_later())["files"] == 1
+    assert not (data_dir / "day_photos" / name).exists()
+    assert storage.load("blobs") == []
+
+
+def test_gc_between_enqueue_and_job_keeps_photo(data_dir):
+    name = blobs.store(io.BytesIO(b"foto"), "day_photos", "a.jpg")
+    job = jobs.enqueue("day_photo", {"day_id": "d1", "filename": name, "owner_id": "u1"}, owner_id="u1")
+    variant = jobs.enqueue("image_variants", {"folder": "day_photos", "filename": name})
+
+    # Il worker è fermo per ore e nel frattempo gira ``scialpi gc``.
+    assert blobs.collect(now=_later())["files"] == 0
+    assert (data_dir / "day_photos" / name).is_file()
+    assert storage.get("blobs", f"day_photos/{name}") is not None
+
+    assert jobs.run_pending() == 2
+    assert jobs.get_job(job["id"])["status"] == jobs.DONE
+    assert jobs.get_job(variant["id"])["status"] == jobs.DONE
+    photos = storage.find("day_photos", "day_id", "d1")
+    assert [photo["filename"] for photo in photos] == [name]
+    assert storage.get("blobs", f"day_photos/{name}")["refs"] == 1
+
+    assert blobs.collect(now=_later(4))["files"] == 0
+    assert (data_dir / "day_photos" / name).is_file()
+
+
+def test_failed_job_releases_photo(data_dir):
+    name = blobs.store(io.BytesIO(b"foto"), "day_photos", "a.jpg")
+    job = jobs.enqueue("day_photo", {"day_id": "d1", "filename": name}, owner_id="u1")
+    claimed = jobs.claim("test")
+    assert claimed["id"] == job["id"]
+    assert blobs.collect(now=_later())["files"] == 0
+
+    # Finito il lavoro senza creare la foto, il file torna eliminabile.
+    with storage.transaction():
+        failed = dict(jobs.get_job(job["id"]), status=jobs.FAILED)
+        storage.put("jobs", failed)
+    assert blobs.collect(now=_later())["files"] == 1
+    assert not (data_dir / "day_photos" / name).exists()
+
+
+def test_job_reports_missing_photo(data_dir):
+    name = blobs.store(io.BytesIO(b"foto"), "day_photos", "a.jpg")
+    (data_dir / "day_photos" / name).unlink()
+    job = jobs.enqueue("day_photo", {"day_id": "d1", "filename": name}, owner_id="u1")
+    jobs.run_pending()
+    job = jobs.get_job(job["id"])
+    assert job["status"] == jobs.FAILED
+    assert job["error"] == "Foto non trovata, caricala di nuovo"
+    assert storage.find("day_photos", "day_id", "d1") == []
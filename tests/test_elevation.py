@@ -0,0 +1,150 @@
+"""Test di :class:`scialpi.elevation.HttpProvider` contro un servizio locale."""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from scialpi import elevation
+from scialpi.config import ELEVATION_CACHE_ENV, ELEVATION_ENV, ELEVATION_URL_ENV
+
+
+def _elevation(lat: float, lon: float) -> float:
+    return round(lat * 100 + lon, 2)
+
+
+class StandIn:
+    """Stato del servizio: ritardo, errori da restituire e richieste ricevute."""
+
+    def __init__(self) -> None:
+        self.delay = 0.0
+        # Primo punto del blocco -> numero di errori da restituire, -1 per sempre
+        self.failures = {}
+        self.error_status = 503
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+
+@pytest.fixture
+def service():
+    state = StandIn()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):  # noqa: N802
+            query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+            points = [tuple(map(float, item.split(","))) for item in query["locations"][0].split("|")]
+            with state.lock:
+                state.requests.append(points)
+                state.in_flight += 1
+                state.max_in_flight = max(state.max_in_flight, state.in_flight)
+                remaining = state.failures.get(points[0], 0)
+                if remaining > 0:
+                    state.failures[points[0]] = remaining - 1
+            try:
+                time.sleep(state.delay)
+                if remaining:
+                    self._send(state.error_status, b"{}")
+                else:
+                    results = [
+                        {"latitude": lat, "longitude": lon, "elevation": _elevation(lat, lon)} for lat, lon in points
+                    ]
+                    self._send(200, json.dumps({"results": results}).encode("utf-8"))
+            finally:
+                with state.lock:
+                    state.in_flight -= 1
+
+        def _send(self, status, body):
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    state.url = f"http://127.0.0.1:{server.server_address[1]}/api/v1/lookup"
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def _coords(count: int):
+    return [(45.0 + index / 1000, 7.0 + index / 1000) for index in range(count)]
+
+
+def _provider(service, **options):
+    options = {"chunk_size": 10, "workers": 4, "retries": 2, "backoff": 0.01, "timeout": 5, **options}
+    return elevation.HttpProvider(service.url, **options)
+
+
+def test_chunks_fetched_concurrently(service):
+    service.delay = 0.2
+    coords = _coords(40)
+    started = time.perf_counter()
+    values = _provider(service).lookup(coords)
+    elapsed = time.perf_counter() - started
+
+    assert values == [_elevation(lat, lon) for lat, lon in coords]
+    assert len(service.requests) == 4
+    assert service.max_in_flight > 1
+    # In sequenza servirebbero almeno 0,8 secondi.
+    assert elapsed < 0.6
+
+
+def test_failing_chunk_is_retried(service):
+    coords = _coords(30)
+    service.failures[coords[10]] = 2
+    values = _provider(service).lookup(coords)
+
+    assert values == [_elevation(lat, lon) for lat, lon in coords]
+    assert sum(1 for points in service.requests if points[0] == coords[10]) == 3
+    assert len(service.requests) == 5
+
+
+def test_chunk_failing_for_good_keeps_other_chunks(service):
+    coords = _coords(30)
+    service.failures[coords[10]] = -1
+    values = _provider(service).lookup(coords)
+
+    assert values[10:20] == [None] * 10
+    expected = [_elevation(lat, lon) for lat, lon in coords]
+    assert values[:10] == expected[:10]
+    assert values[20:] == expected[20:]
+    # Un tentativo più i due ripetuti.
+    assert sum(1 for points in service.requests if points[0] == coords[10]) == 3
+
+
+def test_client_error_not_retried(service):
+    coords = _coords(5)
+    service.failures[coords[0]] = -1
+    service.error_status = 400
+    assert _provider(service).lookup(coords) == [None] * 5
+    assert len(service.requests) == 1
+
+
+def test_ensure_elevation_uses_cache(service, data_dir, monkeypatch):
+    monkeypatch.setenv(ELEVATION_ENV, "http")
+    monkeypatch.setenv(ELEVATION_URL_ENV, service.url)
+    monkeypatch.setenv(ELEVATION_CACHE_ENV, "1000")
+    track = [[lat, lon] for lat, lon in _coords(3)] + [[45.5, 7.5, 1234.0]]
+
+    enriched = elevation.ensure_elevation(track)
+    assert enriched == [[lat, lon, _elevation(lat, lon)] for lat, lon in _coords(3)] + [[45.5, 7.5, 1234.0]]
+    assert len(service.requests) == 1
+
+    assert elevation.ensure_elevation(track) == enriched
+    assert len(service.requests) == 1
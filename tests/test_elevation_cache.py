@@ -0,0 +1,79 @@
+"""Test di :class:`scialpi.elevation_cache.ElevationCache`."""
+
+from __future__ import annotations
+
+import sqlite3
+
+from scialpi.elevation_cache import ElevationCache
+
+
+def _point(index: int):
+    return (45.0 + index * 0.001, 7.0, 1000.0 + index)
+
+
+def _counts(path):
+    conn = sqlite3.connect(str(path))
+    try:
+        (rows,) = conn.execute("SELECT COUNT(*) FROM elevations").fetchone()
+        (cells,) = conn.execute("SELECT cells FROM elevation_count").fetchone()
+    finally:
+        conn.close()
+    return rows, cells
+
+
+def test_get_and_put(tmp_path):
+    cache = ElevationCache(tmp_path / "cache.sqlite3", 100)
+    cache.put_many([_point(0), _point(1)])
+    assert cache.get_many([_point(1)[:2], _point(2)[:2], _point(0)[:2]]) == [1001.0, None, 1000.0]
+    # Un punto già in cache non cambia quota né conteggio.
+    cache.put_many([(45.0, 7.0, 5.0)])
+    assert cache.get_many([(45.0, 7.0)]) == [1000.0]
+    assert _counts(tmp_path / "cache.sqlite3") == (2, 2)
+
+
+def test_evicts_least_recently_used_in_batches(tmp_path):
+    path = tmp_path / "cache.sqlite3"
+    cache = ElevationCache(path, 200)
+    cache.put_many([_point(index) for index in range(200)])
+    # La prima cella viene usata: l'eliminazione tocca la seconda.
+    cache.get_many([_point(0)[:2]])
+    cache.put_many([_point(200)])
+
+    rows, cells = _counts(path)
+    assert rows == cells == 198
+    assert cache.get_many([_point(0)[:2], _point(1)[:2], _point(2)[:2], _point(200)[:2]]) == [
+        1000.0,
+        None,
+        None,
+        1200.0,
+    ]
+    # Sotto il limite non si elimina nulla.
+    cache.put_many([_point(201)])
+    assert _counts(path) == (199, 199)
+
+
+def test_count_shared_between_processes(tmp_path):
+    path = tmp_path / "cache.sqlite3"
+    first = ElevationCache(path, 10)
+    second = ElevationCache(path, 10)
+    first.put_many([_point(index) for index in range(6)])
+    # 11 celle: si torna sotto il limite di una cella in più.
+    second.put_many([_point(index) for index in range(3, 11)])
+    assert _counts(path) == (9, 9)
+    first.put_many([_point(11)])
+    assert _counts(path) == (10, 10)
+
+
+def test_counts_existing_database(tmp_path):
+    path = tmp_path / "cache.sqlite3"
+    conn = sqlite3.connect(str(path))
+    conn.execute("CREATE TABLE elevations (cell INTEGER PRIMARY KEY, elevation REAL NOT NULL, used REAL NOT NULL)")
+    conn.executemany("INSERT INTO elevations VALUES (?, ?, ?)", [(index, 1.0, 0.0) for index in range(5)])
+    conn.commit()
+    conn.close()
+
+    cache = ElevationCache(path, 6)
+    cache.put_many([_point(0)])
+    assert _counts(path) == (6, 6)
+    cache.put_many([_point(1)])
+    assert _counts(path) == (5, 5)
@@ -0,0 +1,51 @@
+"""Test della lettura dei file GPX di :mod:`scialpi.gpx`."""
+
+from __future__ import annotations
+
+import io
+
+from scialpi import gpx
+
+GPX = b"""<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1" xmlns:x="urn:example">
+  <rte>
+    <rtept lat="46.0" lon="8.0"><ele>900</ele></rtept>
+  </rte>
+  <trk><trkseg>
+    <trkpt lat="45.0" lon="7.0"><ele>1000.5</ele><time>2024-01-01T08:00:00Z</time></trkpt>
+    <trkpt lat="45.001" lon="7.001">
+      <extensions><x:data><ele>1010</ele><time>2024-01-01T08:01:00Z</time></x:data></extensions>
+    </trkpt>
+    <trkpt lat="45.002" lon="7.002"><ele>1020</ele><extensions><ele>1</ele></extensions></trkpt>
+    <trkpt lat="x" lon="7.003"><ele>1030</ele></trkpt>
+    <trkpt lat="45.004" lon="7.004"/>
+  </trkseg></trk>
+</gpx>
+"""
+
+
+def test_read_track_puts_track_points_first():
+    assert gpx.read_track(io.BytesIO(GPX)) == [
+        [45.0, 7.0, 1000.5],
+        [45.001, 7.001, 1010.0],
+        [45.002, 7.002, 1020.0],
+        [45.004, 7.004],
+        [46.0, 8.0, 900.0],
+    ]
+
+
+def test_nested_elevation_and_time():
+    points = list(gpx.iter_points(io.BytesIO(GPX), with_time=True))
+    assert points[2] == (45.001, 7.001, 1010.0, gpx.parse_time("2024-01-01T08:01:00Z"))
+    # Vale il primo elemento nell'ordine del documento.
+    assert points[3][2] == 1020.0
+
+
+def test_read_activity():
+    arrays = gpx.read_activity(io.BytesIO(GPX))
+    assert len(arrays) == 5
+
+
+def test_invalid_document():
+    assert gpx.read_track(io.BytesIO(b"<gpx><trk>")) == []
+    assert len(gpx.read_activity(io.BytesIO(b"not xml"))) == 0
@@ -0,0 +1,49 @@
+"""Test delle varianti ridimensionate di :mod:`scialpi.images` (serve Pillow)."""
+
+from __future__ import annotations
+
+import pytest
+
+from scialpi import images
+
+Image = pytest.importorskip("PIL.Image")
+ImageCms = pytest.importorskip("PIL.ImageCms")
+
+
+def _profile() -> bytes:
+    return ImageCms.ImageCmsProfile(ImageCms.createProfile("LAB")).tobytes()
+
+
+def _save(data_dir, name, image, image_format, **options):
+    folder = data_dir / "day_photos"
+    folder.mkdir(exist_ok=True)
+    image.save(folder / name, image_format, **options)
+
+
+@pytest.mark.parametrize("image_format, name", [("JPEG", "a.jpg"), ("PNG", "a.png"), ("WEBP", "a.webp")])
+def test_variant_keeps_icc_profile_and_drops_exif(data_dir, image_format, name):
+    profile = _profile()
+    exif = Image.Exif()
+    exif[0x010F] = "Fotocamera"
+    exif[0x0112] = 6
+    _save(data_dir, name, Image.new("RGB", (800, 400), (200, 30, 30)), image_format, icc_profile=profile, exif=exif)
+
+    path = images.image_variant("day_photos", name, "thumb")
+    with Image.open(path) as variant:
+        assert variant.info.get("icc_profile") == profile
+        assert not variant.getexif()
+        # L'orientamento EXIF è già applicato ai pixel.
+        assert variant.size == (160, 320)
+
+
+def test_variant_without_profile(data_dir):
+    _save(data_dir, "b.jpg", Image.new("RGB", (100, 100)), "JPEG")
+    with Image.open(images.image_variant("day_photos", "b.jpg", "thumb")) as variant:
+        assert "icc_profile" not in variant.info
+
+
+def test_cmyk_profile_dropped_after_conversion(data_dir):
+    _save(data_dir, "c.jpg", Image.new("CMYK", (100, 100)), "JPEG", icc_profile=b"profilo CMYK")
+    with Image.open(images.image_variant("day_photos", "c.jpg", "thumb")) as variant:
+        assert variant.mode == "RGB"
+        assert "icc_profile" not in variant.info
@@ -0,0 +1,174 @@
+"""Test della coda dei lavori di :mod:`scialpi.jobs`."""
+
+from __future__ import annotations
+
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from scialpi import jobs
+from scialpi.config import JOB_WORKERS_ENV
+
+_calls = []
+
+
+@jobs.handler("test_echo")
+def _echo(payload):
+    _calls.append(payload)
+    if payload.get("sleep"):
+        time.sleep(payload["sleep"])
+    return {"echo": payload.get("value")}
+
+
+@jobs.handler("test_flaky")
+def _flaky(payload):
+    _calls.append(payload)
+    if len(_calls) <= payload.get("failures", 0):
+        raise OSError("rete non raggiungibile")
+    if payload.get("user_error"):
+        raise jobs.JobError("Traccia non valida")
+    return {"calls": len(_calls)}
+
+
+@pytest.fixture(autouse=True)
+def no_workers(monkeypatch):
+    monkeypatch.setenv(JOB_WORKERS_ENV, "0")
+    _calls.clear()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Orologio dei lavori spostabile in avanti con ``clock.advance(secondi)``."""
+
+    class Clock:
+        now = datetime.utcnow()
+
+        def advance(self, seconds: float) -> None:
+            self.now += timedelta(seconds=seconds)
+
+    value = Clock()
+    monkeypatch.setattr(jobs, "_now", lambda: value.now)
+    return value
+
+
+def _upload(name: str = "upload.gpx") -> str:
+    jobs.uploads_dir().mkdir(parents=True, exist_ok=True)
+    (jobs.uploads_dir() / name).write_text("<gpx/>", encoding="utf-8")
+    return name
+
+
+def test_run_job_saves_result_and_discards_upload(data_dir):
+    name = _upload()
+    job = jobs.enqueue("test_echo", {"value": 1, "files": [name]})
+    assert jobs.run_pending("w1") == 1
+    job = jobs.get_job(job["id"])
+    assert job["status"] == jobs.DONE
+    assert job["result"] == {"echo": 1}
+    assert not (jobs.uploads_dir() / name).exists()
+
+
+def test_slow_job_requeued_does_not_overwrite_new_attempt(data_dir, clock):
+    name = _upload()
+    job = jobs.enqueue("test_echo", {"value": 1, "files": [name]})
+    first = jobs.claim("w1")
+    clock.advance(jobs.JOB_TIMEOUT_SECONDS + 1)
+    second = jobs.claim("w2")
+    assert second["id"] == job["id"]
+    assert second["attempts"] == 2
+
+    # Il primo worker finisce tardi: l'esito va scartato e il file resta.
+    outcome = jobs.run_job(first)
+    assert outcome["status"] == jobs.RUNNING
+    assert outcome["worker"] == "w2"
+    assert (jobs.uploads_dir() / name).exists()
+
+    outcome = jobs.run_job(second)
+    assert outcome["status"] == jobs.DONE
+    assert not (jobs.uploads_dir() / name).exists()
+
+
+def test_heartbeat_keeps_slow_job(data_dir, monkeypatch):
+    monkeypatch.setattr(jobs, "HEARTBEAT_SECONDS", 0.02)
+    jobs.enqueue("test_echo", {"sleep": 0.2})
+    job = jobs.claim("w1")
+    jobs.run_job(job)
+    current = jobs.get_job(job["id"])
+    assert current["status"] == jobs.DONE
+    assert current["heartbeat_at"] > current["started_at"]
+
+
+def test_heartbeat_refreshes_lease(data_dir, clock):
+    jobs.enqueue("test_echo", {})
+    job = jobs.claim("w1")
+    clock.advance(jobs.JOB_TIMEOUT_SECONDS - 10)
+    assert jobs._touch(job)
+    clock.advance(20)
+    assert jobs.claim("w2") is None
+
+    clock.advance(jobs.JOB_TIMEOUT_SECONDS)
+    assert jobs.claim("w2")["attempts"] == 2
+    assert not jobs._touch(job)
+
+
+def test_stale_job_fails_after_max_attempts(data_dir, clock):
+    name = _upload()
+    job = jobs.enqueue("test_echo", {"files": [name]})
+    for attempt in range(jobs.MAX_ATTEMPTS):
+        assert jobs.claim(f"w{attempt}")["attempts"] == attempt + 1
+        clock.advance(jobs.JOB_TIMEOUT_SECONDS + 1)
+    assert jobs.claim("last") is None
+    job = jobs.get_job(job["id"])
+    assert job["status"] == jobs.FAILED
+    assert job["error"] == "Elaborazione interrotta"
+    assert not (jobs.uploads_dir() / name).exists()
+    assert _calls == []
+
+
+def test_unexpected_error_retried_with_backoff(data_dir, clock):
+    name = _upload()
+    job = jobs.enqueue("test_flaky", {"failures": 2, "files": [name]})
+
+    assert jobs.run_pending("w1") == 1
+    current = jobs.get_job(job["id"])
+    assert current["status"] == jobs.PENDING
+    assert current["error"] is None
+    assert (jobs.uploads_dir() / name).exists()
+    # Il lavoro non viene ripreso prima della scadenza.
+    assert jobs.claim("w1") is None
+    clock.advance(jobs.RETRY_DELAY_SECONDS)
+
+    assert jobs.run_pending("w1") == 1
+    assert jobs.get_job(job["id"])["status"] == jobs.PENDING
+    clock.advance(jobs.RETRY_DELAY_SECONDS)
+    assert jobs.claim("w1") is None
+    clock.advance(jobs.RETRY_DELAY_SECONDS)
+
+    assert jobs.run_pending("w1") == 1
+    current = jobs.get_job(job["id"])
+    assert current["status"] == jobs.DONE
+    assert current["attempts"] == 3
+    assert current["result"] == {"calls": 3}
+    assert not (jobs.uploads_dir() / name).exists()
+
+
+def test_unexpected_error_fails_after_max_attempts(data_dir, clock):
+    name = _upload()
+    job = jobs.enqueue("test_flaky", {"failures": jobs.MAX_ATTEMPTS, "files": [name]})
+    for _ in range(jobs.MAX_ATTEMPTS):
+        assert jobs.run_pending("w1") == 1
+        clock.advance(jobs.RETRY_DELAY_SECONDS * 2**jobs.MAX_ATTEMPTS)
+    current = jobs.get_job(job["id"])
+    assert current["status"] == jobs.FAILED
+    assert current["error"] == "Errore durante l'elaborazione"
+    assert not (jobs.uploads_dir() / name).exists()
+    assert len(_calls) == jobs.MAX_ATTEMPTS
+
+
+def test_job_error_is_not_retried(data_dir, clock):
+    job = jobs.enqueue("test_flaky", {"user_error": True})
+    assert jobs.run_pending("w1") == 1
+    current = jobs.get_job(job["id"])
+    assert current["status"] == jobs.FAILED
+    assert current["error"] == "Traccia non valida"
+    assert current["attempts"] == 1
@@ -0,0 +1,92 @@
+"""Test delle metriche condivise tra processi di :mod:`scialpi.metrics`."""
+
+from __future__ import annotations
+
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from scialpi import metrics
+
+ROOT = Path(__file__).resolve().parent.parent
+NAME = "scialpi_storage_loads_total"
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics(data_dir):
+    metrics._reset()
+    yield
+    metrics._reset()
+
+
+def _total(collection: str = "days") -> float:
+    prefix = f'{NAME}{{collection="{collection}"}} '
+    for line in metrics.render().splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix) :])
+    return 0.0
+
+
+def _age(path: Path, seconds: float) -> None:
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def _process_files():
+    return sorted(path for path in metrics.metrics_dir().glob("*.json") if path.name != metrics.RETIRED_FILENAME)
+
+
+def test_exiting_processes_flush_and_are_retired(data_dir):
+    code = f"from scialpi import metrics; metrics.inc({NAME!r}, 2, collection='days')"
+    for _ in range(3):
+        subprocess.run([sys.executable, "-c", code], check=True, cwd=ROOT, env=os.environ)
+    files = _process_files()
+    assert len(files) == 3
+    assert all(path.name.startswith(f"{metrics._HOST}-") for path in files)
+
+    metrics.inc(NAME, 1, collection="days")
+    assert _total() == 7
+    for path in files:
+        _age(path, metrics.RETIRE_SECONDS + 1)
+    assert _total() == 7
+    assert [path.name for path in _process_files()] == [f"{metrics._HOST}-{os.getpid()}-{metrics._token}.json"]
+    assert _total() == 7
+
+
+def test_live_process_retired_is_not_counted_twice(data_dir):
+    metrics.inc(NAME, 5, collection="days")
+    assert _total() == 5
+    (own,) = _process_files()
+    # Processo inattivo, o in un altro namespace dei pid: il file invecchia.
+    _age(own, metrics.RETIRE_SECONDS + 1)
+    assert _total() == 5
+    assert _process_files() == []
+
+    metrics.inc(NAME, 1, collection="days")
+    assert _total() == 6
+    (own,) = _process_files()
+    assert json.loads(own.read_text())["counters"] == [[NAME, [["collection", "days"]], 1.0]]
+
+    _age(own, metrics.RETIRE_SECONDS + 1)
+    metrics.inc(NAME, 2, collection="days")
+    assert _total() == 8
+
+
+def test_other_host_counted_until_stale(data_dir):
+    directory = metrics.metrics_dir()
+    directory.mkdir(parents=True)
+    other = directory / "altro-container-1-abcd1234.json"
+    other.write_text(json.dumps({"counters": [[NAME, [["collection", "days"]], 4]], "histograms": []}))
+    metrics.inc(NAME, 1, collection="days")
+    assert _total() == 5
+    assert other.exists()
+
+    _age(other, metrics.RETIRE_SECONDS + 1)
+    assert _total() == 5
+    assert not other.exists()
+    assert _total() == 5
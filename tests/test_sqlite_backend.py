@@ -0,0 +1,40 @@
+"""Test di :func:`scialpi.sqlite_backend.import_json`."""
+
+from __future__ import annotations
+
+import shutil
+from pathlib import Path
+
+from scialpi import storage
+from scialpi.config import SQLITE_FILENAME, STORAGE_ENV
+from scialpi.sqlite_backend import SqliteBackend, import_json
+
+SAMPLE_DATA = Path(__file__).resolve().parent.parent / "data"
+
+
+def test_import_json_round_trip(data_dir, monkeypatch):
+    for path in SAMPLE_DATA.glob("*.json"):
+        shutil.copy(path, data_dir / path.name)
+    # Modifiche ancora nel journal e un record senza chiave, che va ignorato.
+    storage.put("days", {"id": "journal-day", "date": "2024-03-01", "route_id": "r1", "title": "Città"})
+    storage.put("avalanches", {"id": 9999, "location": "Cresta"})
+    storage.put("groups", {"name": "senza chiave"})
+    source = storage.JsonBackend(data_dir)
+    expected = {name: source.read(name)[1] for name in storage.COLLECTIONS}
+
+    database = data_dir / SQLITE_FILENAME
+    counts = import_json(data_dir, database)
+
+    target = SqliteBackend(database)
+    for name, records in expected.items():
+        records = [record for record in records if record.get(storage.key_field(name)) is not None]
+        assert counts[name] == len(records), name
+        assert target.read(name)[1] == records, name
+
+    # Una seconda importazione sostituisce i dati invece di duplicarli.
+    assert import_json(data_dir, database) == counts
+
+    monkeypatch.setenv(STORAGE_ENV, "sqlite")
+    storage.invalidate()
+    assert storage.get("days", "journal-day")["title"] == "Città"
+    assert storage.get("avalanches", 9999)["location"] == "Cresta"
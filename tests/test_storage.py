@@ -0,0 +1,180 @@
+"""Test di :mod:`scialpi.storage` con entrambi i backend."""
+
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from scialpi import storage
+from scialpi.config import SQLITE_FILENAME
+from scialpi.sqlite_backend import SqliteBackend
+
+
+def _other_process(data_dir, backend):
+    """Un backend separato sugli stessi file, come quello di un altro processo."""
+    if backend == "sqlite":
+        return SqliteBackend(data_dir / SQLITE_FILENAME)
+    return storage.JsonBackend(data_dir)
+
+
+def _day(day_id, date):
+    return {"id": day_id, "date": date, "route_id": "r1"}
+
+
+def test_put_get_delete(data_dir, backend):
+    storage.put("days", _day("d1", "2024-01-01"))
+    storage.put("days", _day("d2", "2024-01-02"))
+    storage.put("days", {**_day("d1", "2024-01-03"), "notes": "modificata"})
+    assert storage.delete("days", "d2")
+    assert not storage.delete("days", "d2")
+
+    storage.invalidate()
+    assert storage.load("days") == [{**_day("d1", "2024-01-03"), "notes": "modificata"}]
+    assert [day["id"] for day in storage.find("days", "route_id", "r1")] == ["d1"]
+
+
+def test_find_requires_index(data_dir):
+    with pytest.raises(KeyError):
+        storage.find("days", "notes", "x")
+
+
+def test_journal_replay(data_dir):
+    storage.ensure_collection("days")
+    for index in range(1, 4):
+        storage.put("days", _day(f"d{index}", f"2024-01-0{index}"))
+    storage.delete("days", "d2")
+    storage.put("days", _day("d2", "2024-02-02"))
+
+    # Lo snapshot resta vuoto: i dati stanno tutti nel journal.
+    assert json.loads((data_dir / "days.json").read_text()) == []
+    lines = (data_dir / "days.journal").read_text().splitlines()
+    assert [json.loads(line)["op"] for line in lines] == ["put", "put", "put", "del", "put"]
+    assert [json.loads(line)["seq"] for line in lines] == [1, 2, 3, 4, 5]
+
+    _, records = storage.JsonBackend(data_dir).read("days")
+    assert [(day["id"], day["date"]) for day in records] == [
+        ("d1", "2024-01-01"),
+        ("d3", "2024-01-03"),
+        ("d2", "2024-02-02"),
+    ]
+    assert storage.version("days") == 5
+
+
+def test_journal_ignores_truncated_line(data_dir):
+    storage.put("days", _day("d1", "2024-01-01"))
+    with open(data_dir / "days.journal", "a", encoding="utf-8") as f:
+        f.write('{"seq": 2, "op": "put", "record": {"id": "d2"')
+    storage.invalidate()
+    assert [day["id"] for day in storage.load("days")] == ["d1"]
+
+    # La scrittura successiva chiude la riga troncata e non va persa.
+    storage.put("days", _day("d3", "2024-01-03"))
+    storage.invalidate()
+    assert [day["id"] for day in storage.load("days")] == ["d1", "d3"]
+
+
+def test_compaction(data_dir, monkeypatch):
+    monkeypatch.setattr(storage.JsonBackend, "compact_bytes", 512)
+    for index in range(20):
+        storage.put("days", _day(f"d{index:02d}", "2024-01-01"))
+    storage.delete("days", "d05")
+
+    journal = (data_dir / "days.journal").read_text().splitlines()
+    assert len(journal) < 21
+    snapshot = json.loads((data_dir / "days.json").read_text())
+    assert snapshot
+
+    storage.compact("days")
+    assert [json.loads(line) for line in (data_dir / "days.journal").read_text().splitlines()] == [
+        {"seq": 21, "op": "base"}
+    ]
+    assert storage.version("days") == 21
+    expected = [f"d{index:02d}" for index in range(20) if index != 5]
+    assert [day["id"] for day in storage.load("days")] == expected
+    assert [day["id"] for day in json.loads((data_dir / "days.json").read_text())] == expected
+
+
+def test_cache_revalidated_after_external_write(data_dir, backend):
+    storage.put("days", _day("d1", "2024-01-01"))
+    keys, _ = storage.ordered("days", "date")
+    assert len(keys) == 1
+    version = storage.version("days")
+
+    other = _other_process(data_dir, backend)
+    other.put("days", _day("d2", "2024-01-02"))
+
+    assert storage.version("days") > version
+    assert storage.get("days", "d2") == _day("d2", "2024-01-02")
+    assert [day["id"] for day in storage.find("days", "route_id", "r1")] == ["d1", "d2"]
+    _, records = storage.ordered("days", "date")
+    assert [day["id"] for day in records] == ["d1", "d2"]
+
+    other.delete("days", "d1")
+    assert storage.get("days", "d1") is None
+    _, records = storage.ordered("days", "date")
+    assert [day["id"] for day in records] == ["d2"]
+
+
+def test_ordered_updates_after_own_writes(data_dir, backend):
+    storage.put("days", _day("d1", "2024-01-02"))
+    storage.put("days", _day("d2", "2024-01-01"))
+    _, records = storage.ordered("days", "date")
+    assert [day["id"] for day in records] == ["d2", "d1"]
+
+    storage.put("days", _day("d2", "2024-01-03"))
+    keys, records = storage.ordered("days", "date")
+    assert [day["id"] for day in records] == ["d1", "d2"]
+    assert keys == [("2024-01-02", "d1"), ("2024-01-03", "d2")]
+
+    reverse = lambda record: "".join(reversed(record.get("date", "")))  # noqa: E731
+    _, records = storage.ordered("days", "date", reverse)
+    assert [day["id"] for day in records] == ["d1", "d2"]
+    storage.put("days", _day("d1", "2024-01-09"))
+    _, records = storage.ordered("days", "date", reverse)
+    assert [day["id"] for day in records] == ["d2", "d1"]
+
+
+def _ids(items):
+    return [item["id"] for item in items]
+
+
+def test_page_cursor_across_inserts_and_deletes(data_dir, backend):
+    for index in range(1, 7):
+        storage.put("days", _day(f"d{index}", f"2024-01-0{index}"))
+
+    items, cursor = storage.page("days", "date", 2)
+    assert _ids(items) == ["d6", "d5"]
+    assert cursor == ("2024-01-05", "d5")
+
+    # Un giorno più recente non sposta le pagine successive; uno con la
+    # stessa data del cursore ma chiave minore viene dopo il cursore.
+    storage.put("days", _day("d7", "2024-01-07"))
+    storage.put("days", _day("d4a", "2024-01-04"))
+    storage.put("days", _day("d0", "2024-01-05"))
+    # Anche il record del cursore può sparire.
+    storage.delete("days", "d5")
+
+    items, cursor = storage.page("days", "date", 2, after=cursor)
+    assert _ids(items) == ["d0", "d4a"]
+
+    storage.delete("days", "d3")
+    items, cursor = storage.page("days", "date", 2, after=cursor)
+    assert _ids(items) == ["d4", "d2"]
+    items, cursor = storage.page("days", "date", 2, after=cursor)
+    assert _ids(items) == ["d1"]
+    assert cursor is None
+
+
+def test_page_accept_and_bad_cursor(data_dir):
+    for index in range(1, 7):
+        storage.put("days", _day(f"d{index}", f"2024-01-0{index}"))
+    even = lambda day: int(day["id"][1:]) % 2 == 0  # noqa: E731
+    items, cursor = storage.page("days", "date", 2, accept=even)
+    assert _ids(items) == ["d6", "d4"]
+    items, cursor = storage.page("days", "date", 2, after=cursor, accept=even)
+    assert _ids(items) == ["d2"]
+    assert cursor is None
+
+    with pytest.raises(ValueError):
+        storage.page("days", "date", 2, after=("2024-01-01", None))